@@ -1,29 +1,90 @@
+import functools
 import uuid
 from datetime import datetime, timedelta
 from random import shuffle
-from typing import Sequence
+from typing import NamedTuple
 
-import bcrypt
-from sqlalchemy import null
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, make_transient_to_detached
 from sqlmodel import Session, select
 
-from app.model import Game, Player, PlayerConnection, PlayerRole, Room, Tile, TileState, User, UserSession
-from app.util import EventBus
+from app.game_engine import GameEngine, GameState
+from app.model import (Game, Player, PlayerConnection, PlayerRole, Quiz, Room, Tile, User, UserSession,
+                       normalize_answer)
+from app.util import CodeAllocator, EventBus, SessionCache
 from app.util import azk
+from app.util.metrics import REGISTRY
+
+
+# loading strategies of the views, everything a view renders is loaded by a fixed number of queries
+PLAYER_VIEW = (joinedload(PlayerConnection.player), joinedload(PlayerConnection.room))
+
+ROOM_CODE_ALPHABET = "34679CDFGHJKLMNPQRTVWX"
+ROOM_CODE_LENGTH = 4
+# codes taken by other worker processes are found out only by the failed insert, each is then marked as used
+ROOM_CODE_ATTEMPTS = 10
+
+TRY_START_GAME = REGISTRY.counter('gamedify_try_start_game_total', 'Attempts to pair a player for a new game.',
+                                  ('result',))
+MATCHMAKING_WAIT_SECONDS = REGISTRY.histogram('gamedify_matchmaking_wait_seconds',
+                                              'Time a player waits in the queue for an opponent.',
+                                              buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800))
+
+
+def typing_topic(player_id: uuid.UUID) -> str:
+    """The event bus topic notified when the opponent of the player types an answer."""
+    return f'typing:{player_id}'
+
+
+def session_topic(session_id: uuid.UUID) -> str:
+    """The event bus topic notified when the login session ends."""
+    return f'session:{session_id}'
+
+
+class SessionUser(NamedTuple):
+    """What the session cache keeps of the user, enough to identify the user without the database."""
+    id: uuid.UUID
+    username: str
+
+
+class PlayerSummary(NamedTuple):
+    id: uuid.UUID
+    name: str | None
+
+
+class GameSummary(NamedTuple):
+    id: uuid.UUID
+    player_a: PlayerSummary
+    player_b: PlayerSummary
+    score_a: int
+    score_b: int
+    on_turn: PlayerRole
+    is_over: bool
+
+
+class RoomSnapshot(NamedTuple):
+    """What the room dashboard shows, immutable so that all the dashboards of the room can share it."""
+    games: tuple[GameSummary, ...]
+    waiting: tuple[PlayerSummary, ...]
 
 
 class ControllerImpl:
-    def __init__(self, db: Session, event_bus: EventBus):
+    def __init__(self, db: Session, event_bus: EventBus, game_engine: GameEngine,
+                 session_cache: SessionCache[SessionUser] | None = None,
+                 room_codes: CodeAllocator | None = None):
         self.db = db
         self.event_bus = event_bus
+        self.session_cache = session_cache
+        self.room_codes = room_codes
+        self.game_engine = game_engine
 
-    def login(self, username: str, password: str) -> UserSession | None:
-        user = self.db.exec(select(User).where(User.username == username)).one_or_none()
-        if not user:
-            return None
-        if not bcrypt.checkpw(password.encode(), user.hashed_password.encode()):
-            return None
-        session = UserSession(user_id=user.id, expires_at=datetime.now() + timedelta(days=3))
+    def get_user_by_username(self, username: str) -> User | None:
+        return self.db.exec(select(User).where(User.username == username)).one_or_none()
+
+    def create_session(self, user_id: uuid.UUID) -> UserSession:
+        """Log in the user whose password has been checked."""
+        session = UserSession(user_id=user_id, expires_at=datetime.now() + timedelta(days=3))
         self.db.add(session)
         self.db.commit()
         return session
@@ -33,11 +94,24 @@ class ControllerImpl:
         if session:
             self.db.delete(session)
             self.db.commit()
+        if self.session_cache is not None:
+            self.session_cache.invalidate(session_id)
+        self.event_bus.notify(session_topic(session_id))
 
     def get_user_for_session(self, session_id: uuid.UUID) -> User | None:
-        session = self.db.exec(select(UserSession).where(UserSession.id == session_id)).one_or_none()
+        if self.session_cache is not None and (cached := self.session_cache.get(session_id)):
+            # attach the cached user to this session without loading it, the owners loaded later
+            # by this session are then the same instance as the user
+            user = User(id=cached.id, username=cached.username)
+            make_transient_to_detached(user)
+            return self.db.merge(user, load=False)
+        session = self.db.exec(select(UserSession).options(joinedload(UserSession.user))
+                               .where(UserSession.id == session_id)).one_or_none()
         if not session or session.expires_at < datetime.now():
             return None
+        if self.session_cache is not None:
+            self.session_cache.put(session_id, SessionUser(session.user.id, session.user.username),
+                                   session.expires_at)
         return session.user
 
     def is_room_code_valid(self, code: str) -> bool:
@@ -59,7 +133,8 @@ class ControllerImpl:
         return pc
 
     def get_player_connection(self, connection_id: uuid.UUID) -> PlayerConnection | None:
-        return self.db.exec(select(PlayerConnection).where(PlayerConnection.id == connection_id)).one_or_none()
+        return self.db.exec(select(PlayerConnection).options(*PLAYER_VIEW)
+                            .where(PlayerConnection.id == connection_id)).one_or_none()
 
     def set_player_connection_active(self, connection_id: uuid.UUID, active: bool) -> PlayerConnection:
         pc = self.get_player_connection(connection_id)
@@ -68,22 +143,33 @@ class ControllerImpl:
         pc.active_count = max(0, pc.active_count + (1 if active else -1))
         self.db.add(pc)
         self.db.commit()
-        self.event_bus.notify(pc.room.code)
-        if pc.game:
-            self.event_bus.notify(pc.game.player_a_id)
-            self.event_bus.notify(pc.game.player_b_id)
+        if pc.game_id:
+            self.game_engine.set_player_active(pc.game_id, pc.player_id, pc.active_count)
+        elif not pc.active_count:
+            self.game_engine.matchmaking.leave(pc.room_code, pc.player_id)
+        elif active:
+            self.try_start_game(pc)
+        self.event_bus.notify(pc.room_code)
+        if game := self.game_engine.get(self.db, pc.game_id):
+            self.event_bus.notify(game.player_a.id)
+            self.event_bus.notify(game.player_b.id)
         return pc
 
     def set_player_name(self, room: Room, player: Player, name: str | None):
         player.name = name
         self.db.add(player)
         self.db.commit()
+        self.game_engine.set_player_name(player.id, name)
         pc = self.db.exec(select(PlayerConnection).where(PlayerConnection.room_code == room.code,
                                                          PlayerConnection.player_id == player.id)).one_or_none()
         if pc.game:
             self.event_bus.notify(pc.game.player_a_id)
             self.event_bus.notify(pc.game.player_b_id)
         else:
+            if name:
+                self.try_start_game(pc)
+            else:
+                self.game_engine.matchmaking.leave(room.code, player.id)
             self.event_bus.notify(player.id)
         self.event_bus.notify(room.code)
 
@@ -93,105 +179,159 @@ class ControllerImpl:
     def get_room(self, room_code: str) -> Room:
         return self.db.exec(select(Room).where(Room.code == room_code)).one()
 
+    def create_room(self, quiz: Quiz, owner: User) -> Room | None:
+        """Open a room with a free code, None when all the codes are used."""
+        seeded = False
+        if self.room_codes is None:
+            # without the allocator of the process the codes in use are known only to the database
+            self.room_codes = CodeAllocator(ROOM_CODE_ALPHABET, ROOM_CODE_LENGTH)
+            self.room_codes.seed(self.db.exec(select(Room.code)).all())
+            seeded = True
+        for _ in range(ROOM_CODE_ATTEMPTS):
+            code = self.room_codes.allocate()
+            if code is None:
+                if seeded:
+                    return None
+                # the codes released by other worker processes are known only to the database
+                self.room_codes.seed(self.db.exec(select(Room.code)).all())
+                seeded = True
+                continue
+            room = Room(code=code, quiz=quiz, owner=owner)
+            self.db.add(room)
+            try:
+                self.db.commit()
+                return room
+            except IntegrityError:
+                self.db.rollback()
+        return None
+
     def room_delete(self, room: Room):
         pcs = self.db.exec(select(PlayerConnection).where(PlayerConnection.room_code == room.code)).all()
         for pc in pcs:
             self.event_bus.notify(pc.player_id)
         self.event_bus.notify(room.code)
+        self.game_engine.remove_room(room.code)
+        code = room.code
         self.db.delete(room)
         self.db.commit()
+        if self.room_codes is not None:
+            self.room_codes.release(code)
 
-    def get_room_players(self, room_code: str) -> Sequence[Player]:
-        return self.db.exec(
-            select(Player).join(PlayerConnection).where(PlayerConnection.room_code == room_code,
-                                                        PlayerConnection.active_count > 0).distinct()).all()
-
-    def get_room_games(self, room_code: str) -> Sequence[Game]:
-        return self.db.exec(
-            select(Game).outerjoin(PlayerConnection).where(
-                PlayerConnection.room_code == room_code, PlayerConnection.active_count > 0).distinct()).all()
+    def get_room_snapshot(self, room_code: str) -> RoomSnapshot:
+        """The games and the waiting players of the active connections of the room, by a single query.
 
-    def get_waiting_pcs(self, room_code: str) -> Sequence[PlayerConnection]:
-        return self.db.exec(
-            select(PlayerConnection).join(Player)
-            .where(PlayerConnection.room_code == room_code, PlayerConnection.active_count > 0,
-                   PlayerConnection.game == null(), Player.name != null())
-        ).all()
+        The games are summarized from their state in memory, the room is notified whenever a summary changes.
+        """
+        connections = self.db.exec(
+            select(PlayerConnection.game_id, Player.id, Player.name).join(Player)
+            .where(PlayerConnection.room_code == room_code, PlayerConnection.active_count > 0)).all()
+        games = []
+        for game_id in dict.fromkeys(game_id for game_id, _, _ in connections if game_id):
+            if game := self.game_engine.snapshot(game_id, self.db):
+                games.append(GameSummary(game.id, PlayerSummary(game.player_a.id, game.player_a.name),
+                                         PlayerSummary(game.player_b.id, game.player_b.name),
+                                         game.score(PlayerRole.A), game.score(PlayerRole.B),
+                                         game.player_on_turn_role, game.is_over))
+        waiting = tuple(PlayerSummary(player_id, name) for game_id, player_id, name in connections
+                        if not game_id and name is not None)
+        return RoomSnapshot(tuple(games), waiting)
 
     def try_start_game(self, pc: PlayerConnection) -> bool:
-        pending_pc = next((ppc for ppc in self.get_waiting_pcs(pc.room_code) if ppc.player_id != pc.player_id), None)
-        if not pending_pc:
+        """Start a game with the player of the room waiting longest, or queue the player for the next one.
+
+        Called when the player connects, gets a name or leaves a game, never when a view is rendered.
+        """
+        if pc.game_id or not pc.active_count or not pc.player.name:
             return False
+        matchmaking = self.game_engine.matchmaking
+        while pending := matchmaking.join(pc.room_code, pc.player_id):
+            pending_player_id, waited = pending
+            pending_pc = self.db.exec(
+                select(PlayerConnection).options(joinedload(PlayerConnection.player))
+                .where(PlayerConnection.room_code == pc.room_code, PlayerConnection.player_id == pending_player_id)
+            ).one_or_none()
+            # the queue misses the changes made by other processes, a player that stopped waiting is dropped
+            if not (pending_pc and pending_pc.active_count and not pending_pc.game_id and pending_pc.player.name):
+                continue
+            try:
+                started = self._start_game(pc, pending_pc)
+            except BaseException:
+                self.db.rollback()
+                matchmaking.requeue(pc.room_code, pending_player_id, waited)
+                raise
+            if started:
+                MATCHMAKING_WAIT_SECONDS.observe(waited)
+                TRY_START_GAME.labels('started').inc()
+                return True
+            # the joining player was paired by a concurrent request meanwhile, else the partner was and is dropped
+            if pc.game_id:
+                matchmaking.requeue(pc.room_code, pending_player_id, waited)
+                TRY_START_GAME.labels('paired').inc()
+                return False
+        TRY_START_GAME.labels('waiting').inc()
+        return False
 
+    def _start_game(self, pc: PlayerConnection, pending_pc: PlayerConnection) -> bool:
+        """Start the game of the two players, False when either has got a game meanwhile."""
         quiz = pc.room.quiz
         layout = azk.BoardLayout.from_max_tile_count(len(quiz.questions))
 
         game = Game(room=pc.room, player_a=pending_pc.player, player_b=pc.player,
                     player_on_turn_role=PlayerRole.A, rows=layout.rows)
-        pc.game = game
-        pending_pc.game = game
         self.db.add(game)
-        self.db.add(pending_pc)
-        self.db.add(pc)
         questions = list(quiz.questions)
         shuffle(questions)
         for question, (row, col) in zip(questions, layout.tiles):
+            answers = [a.text for a in question.answers]
             tile = Tile(game=game,
                         row=row, col=col,
-                        question="|".join([question.text] + [a.text for a in question.answers]))
+                        question=question.text,
+                        answers=answers,
+                        normalized_answers=list(dict.fromkeys(normalize_answer(a) for a in answers)))
             self.db.add(tile)
+        self.db.flush()
+        # both players are claimed by a single statement, so a player joining by two requests gets one game
+        claimed = self.db.exec(
+            update(PlayerConnection)
+            .where(PlayerConnection.id.in_((pc.id, pending_pc.id)), PlayerConnection.game_id.is_(None))
+            .values(game_id=game.id)).rowcount
+        if claimed != 2:
+            self.db.rollback()
+            return False
         self.db.commit()
+        self.game_engine.add(game)
         self.event_bus.notify(pc.room_code)
         self.event_bus.notify(pending_pc.player_id)
         self.event_bus.notify(pc.player.id)
         return True
 
+    def get_game_state(self, game_id: uuid.UUID | None) -> GameState | None:
+        """A copy of the game state to render, see GameEngine.snapshot."""
+        return self.game_engine.snapshot(game_id, self.db)
+
     def tile_click(self, pc: PlayerConnection, tile_index: int):
-        if not pc.game or pc.game.player_on_turn != pc.player or pc.game.selected_tile is not None:
-            return
-        tile = pc.game.get_tile_by_index(tile_index)
-        if not tile or tile.state != TileState.DEFAULT:
-            return
-        tile.state = TileState.SELECTED
-        pc.game.last_answer = None
-        self.db.add(tile)
-        self.db.add(pc.game)
-        self.db.commit()
-        self.event_bus.notify(pc.game.player_a_id)
-        self.event_bus.notify(pc.game.player_b_id)
+        with self.game_engine.modify(self.db, pc.game_id) as game:
+            if not game or not game.select_tile(pc.player_id, tile_index):
+                return
+        self.event_bus.notify(game.player_a.id)
+        self.event_bus.notify(game.player_b.id)
 
     def submit_answer(self, pc: PlayerConnection, answer: str | None):
+        with self.game_engine.modify(self.db, pc.game_id) as game:
+            if not game or not game.submit_answer(pc.player_id, answer):
+                return
+        self.event_bus.notify(game.player_a.id)
+        self.event_bus.notify(game.player_b.id)
+        # the score and the player on turn are shown on the room dashboard
+        self.event_bus.notify(game.room_code)
 
-        if not pc.game or pc.game.player_on_turn != pc.player or not pc.game.selected_tile:
-            return
-        tile = pc.game.selected_tile
-        pc.game.last_answer = answer
-        pc.game.last_answer_time = datetime.now()
-        pc.game.last_question = tile.question
-        player_role = pc.game.player_on_turn_role
-        if not pc.game.is_last_answer_correct:
-            player_role = player_role.swap()
-        tile.state = TileState.from_role(player_role)
-        if azk.is_winner_move(pc.game, tile):
-            pc.game.player_on_turn_role = player_role
-            pc.game.is_over = True
-        else:
-            pc.game.player_on_turn_role = pc.game.player_on_turn_role.swap()
-        self.db.add(pc.game)
-        self.db.commit()
-        self.event_bus.notify(pc.game.player_a_id)
-        self.event_bus.notify(pc.game.player_b_id)
-
-    def type_answer(self, pc: PlayerConnection, answer: str | None):
-        if not pc.game or pc.game.player_on_turn != pc.player or not pc.game.selected_tile:
-            return
-        pc.game.last_answer = answer
-        self.db.add(pc.game)
-        self.db.commit()
-        if pc.game.player_on_turn_role == PlayerRole.A:
-            self.event_bus.notify(pc.game.player_b_id)
-        else:
-            self.event_bus.notify(pc.game.player_a_id)
+    def type_answer(self, game_id: uuid.UUID, player_id: uuid.UUID, answer: str | None):
+        with self.game_engine.modify(self.db, game_id) as game:
+            if not game or not game.type_answer(player_id, answer):
+                return
+            topic = typing_topic(game.get_opponent(game.player_on_turn).id)
+        # the keystrokes are coalesced per game, the last notification carries the latest answer
+        self.game_engine.typing.call(game_id, functools.partial(self.event_bus.notify, topic))
 
     def start_new_game(self, pc: PlayerConnection):
         if not pc.game:
@@ -199,11 +339,14 @@ class ControllerImpl:
         players = [pc.game.player_a, pc.game.player_b]
         opponent = pc.game.get_opponent(pc.player)
         if pc.game.is_player_active(opponent):
+            self.game_engine.set_player_active(pc.game_id, pc.player_id, 0)
             pc.game = None
             self.db.add(pc)
         else:
+            self.game_engine.remove(pc.game_id)
             self.db.delete(pc.game)
         self.db.commit()
+        self.try_start_game(pc)
         self.event_bus.notify(pc.room_code)
         for player in players:
             self.event_bus.notify(player.id)
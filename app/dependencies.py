@@ -1,24 +1,98 @@
 import contextlib
+import os
+import time
 import uuid
 from typing import Annotated, ContextManager
 
 from fastapi import Cookie, Depends, HTTPException, status
 from fastapi.templating import Jinja2Templates
 from jinja2 import Environment, FileSystemLoader
+from sqlalchemy import event
 from sqlmodel import Session, create_engine
 
-from app.ctrl import ControllerImpl
-from app.util import EventBus
+from app.ctrl import ROOM_CODE_ALPHABET, ROOM_CODE_LENGTH, ControllerImpl, session_topic
+from app.game_engine import GameEngine
+from app.util import (BrokerBackend, CodeAllocator, EventBus, PasswordHasher, QueryStats, RenderCache, SessionCache,
+                      StaticAssets, TopicCache)
+from app.util.metrics import REGISTRY, TimedTemplate
+
+# the metrics served at /stats/metrics, opt-in like the query statistics
+REGISTRY.enabled = bool(os.environ.get('GAMEDIFY_METRICS'))
+DB_SESSION_SECONDS = REGISTRY.histogram('gamedify_db_session_seconds', 'Time a database session is open.')
+
+# the static files under content-hashed names, so that the browsers may cache them for good, built at startup
+static_assets = StaticAssets("static", "build/static")
 
 jinja_env = Environment(loader=FileSystemLoader("templates"), autoescape=True)
+jinja_env.template_class = TimedTemplate
+jinja_env.globals['static_asset'] = static_assets.url
 templates = Jinja2Templates(env=jinja_env)
 engine = create_engine("sqlite:///gamedify.db", echo=False, connect_args={"check_same_thread": False})
-_event_bus = EventBus()
+
+
+@event.listens_for(engine, "connect")
+def enable_foreign_keys(dbapi_connection, _):
+    # SQLite enforces foreign keys per connection, every connection of the pool needs the pragma
+    dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+# the size of the thread pool that runs the routes and WebSocket callbacks, i.e. all database access
+worker_threads = int(os.environ.get('GAMEDIFY_WORKER_THREADS', '8'))
+# the threads that hash and check passwords, and how many passwords may wait for them before logins are refused
+password_threads = int(os.environ.get('GAMEDIFY_PASSWORD_THREADS', '2'))
+password_queue = int(os.environ.get('GAMEDIFY_PASSWORD_QUEUE', '16'))
+# the event broker socket, required to deliver notifications between several worker processes
+event_broker = os.environ.get('GAMEDIFY_EVENT_BROKER')
+_event_bus = EventBus(BrokerBackend(event_broker) if event_broker else None)
+_render_cache = RenderCache()
+# the QR codes of the rooms by their play URL
+_qr_cache = RenderCache(max_size=256)
+# the snapshots of the rooms shared by their dashboards, by the room code which is also the topic of the room
+_room_snapshots = TopicCache(_event_bus)
+_session_cache = SessionCache(_event_bus, session_topic)
+_password_hasher = PasswordHasher(password_threads, password_queue)
+# the codes of the open rooms, seeded from the database at startup
+_room_codes = CodeAllocator(ROOM_CODE_ALPHABET, ROOM_CODE_LENGTH)
+# per route and WebSocket callback query statistics, opt-in as they cost a little on every statement
+_query_stats = QueryStats()
+if os.environ.get('GAMEDIFY_SQL_STATS'):
+    _query_stats.attach(engine)
+# the games are shared by the worker processes through the database when they exchange notifications
+_game_engine = GameEngine(engine, event_bus=_event_bus if event_broker else None)
+
+
+def _event_bus_counts(field: str) -> dict[tuple, float]:
+    stats = _event_bus.stats()
+    return {(): len(stats) if field == 'topics' else sum(getattr(s, field) for s in stats.values())}
+
+
+REGISTRY.gauge('gamedify_event_bus_topics', 'Event bus topics with subscribers.',
+               callback=lambda: _event_bus_counts('topics'))
+REGISTRY.gauge('gamedify_event_bus_subscribers', 'Event bus subscriptions.',
+               callback=lambda: _event_bus_counts('subscribers'))
+REGISTRY.gauge('gamedify_event_bus_running', 'Async event bus listeners that have not finished yet.',
+               callback=lambda: _event_bus_counts('running'))
+REGISTRY.gauge('gamedify_room_codes_used', 'Room codes in use by this process.',
+               callback=lambda: {(): _room_codes.used})
+REGISTRY.gauge('gamedify_room_codes_utilisation', 'Fraction of the room code space in use by this process.',
+               callback=lambda: {(): _room_codes.utilisation})
+REGISTRY.gauge('gamedify_matchmaking_waiting', 'Players queued for an opponent by this process.',
+               callback=lambda: {(): len(_game_engine.matchmaking)})
+
+
+class TimedSession(Session):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened_at = time.perf_counter()
+
+    def close(self):
+        super().close()
+        DB_SESSION_SECONDS.observe(time.perf_counter() - self.opened_at)
 
 
 class DbFactory:
     def __call__(self):
-        return Session(engine)
+        return TimedSession(engine)
 
 
 def get_db(db_factory: Annotated[DbFactory, Depends()]):
@@ -30,34 +104,77 @@ def get_event_bus():
     return _event_bus
 
 
+def get_render_cache():
+    return _render_cache
+
+
+def get_qr_cache():
+    return _qr_cache
+
+
+def get_room_snapshots():
+    return _room_snapshots
+
+
+def get_game_engine():
+    return _game_engine
+
+
+def get_session_cache():
+    return _session_cache
+
+
+def get_password_hasher():
+    return _password_hasher
+
+
+def get_room_codes():
+    return _room_codes
+
+
+def get_query_stats():
+    return _query_stats
+
+
 class Controller(ControllerImpl):
-    def __init__(self, db: Annotated[Session, Depends(get_db)], event_bus: Annotated[EventBus, Depends(get_event_bus)]):
-        super().__init__(db, event_bus)
+    def __init__(self,
+                 db: Annotated[Session, Depends(get_db)],
+                 event_bus: Annotated[EventBus, Depends(get_event_bus)],
+                 game_engine: Annotated[GameEngine, Depends(get_game_engine)],
+                 session_cache: Annotated[SessionCache, Depends(get_session_cache)],
+                 room_codes: Annotated[CodeAllocator, Depends(get_room_codes)]):
+        super().__init__(db, event_bus, game_engine, session_cache, room_codes)
 
 
 class ControllerFactory:
     def __init__(self,
                  db_factory: Annotated[DbFactory, Depends()],
-                 event_bus: Annotated[EventBus, Depends(get_event_bus)]):
+                 event_bus: Annotated[EventBus, Depends(get_event_bus)],
+                 game_engine: Annotated[GameEngine, Depends(get_game_engine)],
+                 session_cache: Annotated[SessionCache, Depends(get_session_cache)],
+                 room_codes: Annotated[CodeAllocator, Depends(get_room_codes)]):
         self.db_factory = db_factory
         self.event_bus = event_bus
+        self.game_engine = game_engine
+        self.session_cache = session_cache
+        self.room_codes = room_codes
 
     @contextlib.contextmanager
     def __call__(self) -> ContextManager[Controller]:
         with self.db_factory() as db:
-            yield ControllerImpl(db, self.event_bus)
+            yield ControllerImpl(db, self.event_bus, self.game_engine, self.session_cache, self.room_codes)
 
 
-async def current_user(ctrl: Annotated[Controller, Depends()],
-                       session_id: Annotated[uuid.UUID | None, Cookie()] = None):
+def current_user(ctrl: Annotated[Controller, Depends()],
+                 session_id: Annotated[uuid.UUID | None, Cookie()] = None):
     if session_id:
         if user := ctrl.get_user_for_session(session_id):
             return user
     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
 
 
-async def current_user_opt(ctrl: Annotated[Controller, Depends()],
-                           session_id: Annotated[uuid.UUID | None, Cookie()] = None):
+def current_user_opt(ctrl: Annotated[Controller, Depends()],
+                     session_id: Annotated[uuid.UUID | None, Cookie()] = None):
     if session_id:
         if user := ctrl.get_user_for_session(session_id):
             return user
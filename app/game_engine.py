@@ -0,0 +1,435 @@
+import asyncio
+import contextlib
+import threading
+import uuid
+from datetime import datetime
+from typing import Iterator
+
+from sqlalchemy import Engine, bindparam, update
+from sqlmodel import Session, select
+
+from app.model import Game, GameMixin, PlayerConnection, PlayerRole, Tile, TileMixin, TileState
+from app.util import EventBus, MatchQueue, Throttle, azk
+
+TILE_STATES = tuple(TileState)
+TILE_STATE_CODES = {state: code for code, state in enumerate(TILE_STATES)}
+# the shortest time between two notifications of the answer typed in a game
+TYPING_INTERVAL = 0.2
+
+
+def game_topic(game_id: uuid.UUID) -> str:
+    """The event bus topic notified when a game shared by several processes changes in the database."""
+    return f'game:{game_id}'
+
+
+class PlayerState:
+    __slots__ = ('id', 'name', 'active_count')
+
+    def __init__(self, id: uuid.UUID, name: str | None, active_count: int):
+        self.id = id
+        self.name = name
+        self.active_count = active_count
+
+
+class TileView(TileMixin):
+    """A read-only snapshot of a single tile of a game state."""
+    __slots__ = ('row', 'col', 'state', 'question')
+
+    def __init__(self, row: int, col: int, state: TileState, question: str):
+        self.row = row
+        self.col = col
+        self.state = state
+        self.question = question
+
+
+class GameState(GameMixin):
+    """The state of a live game held in memory, tiles are stored in arrays indexed by the tile index.
+
+    The tile index is the tile id of the board layout, so the layout arrays apply to the tiles directly.
+    """
+    __slots__ = ('id', 'room_code', 'rows', 'player_a', 'player_b', 'player_on_turn_role', 'is_over',
+                 'last_question', 'last_question_answers', 'last_question_normalized_answers',
+                 'last_answer', 'last_answer_correct', 'last_answer_time', 'typed_answer', 'version',
+                 'tile_ids', 'tile_states', 'tile_questions', 'tile_answers', 'tile_normalized_answers',
+                 'selected_index', 'connectivity', 'dirty_tiles', 'stale', 'lock', '__weakref__')
+
+    def __init__(self, game: Game):
+        def player_state(player) -> PlayerState:
+            return PlayerState(player.id, player.name,
+                               sum(pc.active_count for pc in player.connections if pc.game_id == game.id))
+
+        self.id = game.id
+        self.room_code = game.room_code
+        self.rows = game.rows
+        self.player_a = player_state(game.player_a)
+        self.player_b = player_state(game.player_b)
+        self.player_on_turn_role = game.player_on_turn_role
+        self.is_over = game.is_over
+        self.last_question = game.last_question
+        self.last_question_answers = game.last_question_answers
+        self.last_question_normalized_answers = frozenset(game.last_question_normalized_answers or ())
+        self.last_answer = game.last_answer
+        self.last_answer_correct = game.last_answer_correct
+        self.last_answer_time = game.last_answer_time
+        self.typed_answer: str | None = None
+        self.version = game.version
+        tiles = sorted(game.tiles, key=lambda t: t.index)
+        self.tile_ids = tuple(t.id for t in tiles)
+        self.tile_states = bytearray(TILE_STATE_CODES[t.state] for t in tiles)
+        self.tile_questions = tuple(t.question for t in tiles)
+        self.tile_answers = tuple(tuple(t.answers) for t in tiles)
+        self.tile_normalized_answers = tuple(frozenset(t.normalized_answers) for t in tiles)
+        self.selected_index = next((t.index for t in tiles if t.state == TileState.SELECTED), None)
+        self.connectivity = {TileState.A: azk.Connectivity(self.layout), TileState.B: azk.Connectivity(self.layout)}
+        for t in tiles:
+            if t.state in self.connectivity:
+                self.connectivity[t.state].add(t.index)
+        self.dirty_tiles: set[int] = set()
+        self.stale = False  # another process may have changed the game, see GameEngine.get
+        self.lock = threading.Lock()  # held by the moves of the game and their writes
+
+    def copy(self) -> 'GameState':
+        """A read-only copy for rendering, consistent with its version when made under the lock of the game."""
+        state = GameState.__new__(GameState)
+        for name in GameState.__slots__[:-1]:
+            setattr(state, name, getattr(self, name))
+        state.player_a = PlayerState(self.player_a.id, self.player_a.name, self.player_a.active_count)
+        state.player_b = PlayerState(self.player_b.id, self.player_b.name, self.player_b.active_count)
+        state.tile_states = bytes(self.tile_states)
+        # the move bookkeeping stays with the live state
+        state.connectivity = state.dirty_tiles = state.lock = None
+        return state
+
+    @property
+    def tiles(self) -> tuple[TileView, ...]:
+        return tuple(self.get_tile_by_index(i) for i in range(len(self.tile_states)))
+
+    @property
+    def selected_tile(self) -> TileView | None:
+        return self.get_tile_by_index(self.selected_index) if self.selected_index is not None else None
+
+    def get_tile_by_index(self, index: int) -> TileView | None:
+        if not isinstance(index, int) or not 0 <= index < len(self.tile_states):
+            return None
+        layout = self.layout
+        return TileView(layout.tile_rows[index], layout.tile_cols[index], TILE_STATES[self.tile_states[index]],
+                        self.tile_questions[index])
+
+    def mark_stale(self):
+        self.stale = True
+
+    def get_player(self, player_id: uuid.UUID) -> PlayerState | None:
+        return next((p for p in (self.player_a, self.player_b) if p.id == player_id), None)
+
+    def is_player_active(self, player: PlayerState) -> bool:
+        return player.active_count > 0
+
+    def score(self, role: PlayerRole) -> int:
+        """The number of tiles won by the player of the role."""
+        return self.tile_states.count(TILE_STATE_CODES[TileState.from_role(role)])
+
+    def _set_tile_state(self, index: int, state: TileState):
+        self.tile_states[index] = TILE_STATE_CODES[state]
+        self.dirty_tiles.add(index)
+
+    def select_tile(self, player_id: uuid.UUID, index: int) -> bool:
+        if self.player_on_turn.id != player_id or self.selected_index is not None:
+            return False
+        tile = self.get_tile_by_index(index)
+        if not tile or tile.state != TileState.DEFAULT:
+            return False
+        self._set_tile_state(index, TileState.SELECTED)
+        self.selected_index = index
+        self.last_answer = None
+        self.last_answer_correct = False
+        self.typed_answer = None
+        self.version += 1
+        return True
+
+    def submit_answer(self, player_id: uuid.UUID, answer: str | None) -> bool:
+        if self.player_on_turn.id != player_id or self.selected_index is None:
+            return False
+        index = self.selected_index
+        self.last_answer = answer
+        self.typed_answer = None
+        self.last_answer_time = datetime.now()
+        self.last_question = self.tile_questions[index]
+        self.last_question_answers = self.tile_answers[index]
+        self.last_question_normalized_answers = self.tile_normalized_answers[index]
+        self.last_answer_correct = self.check_last_answer()
+        player_role = self.player_on_turn_role
+        if not self.last_answer_correct:
+            player_role = player_role.swap()
+        state = TileState.from_role(player_role)
+        self._set_tile_state(index, state)
+        self.selected_index = None
+        if self.connectivity[state].add(index):
+            self.player_on_turn_role = player_role
+            self.is_over = True
+        else:
+            self.player_on_turn_role = self.player_on_turn_role.swap()
+        self.version += 1
+        return True
+
+    def type_answer(self, player_id: uuid.UUID, answer: str | None) -> bool:
+        """Keep the answer being typed, it is neither persisted nor does it change the version of the game."""
+        if self.player_on_turn.id != player_id or self.selected_index is None:
+            return False
+        self.typed_answer = answer
+        return True
+
+    def game_values(self) -> dict:
+        answers = normalized_answers = None
+        if self.last_question:
+            answers = list(self.last_question_answers)
+            normalized_answers = sorted(self.last_question_normalized_answers)
+        return dict(b_id=self.id, player_on_turn_role=self.player_on_turn_role, is_over=self.is_over,
+                    last_question=self.last_question, last_question_answers=answers,
+                    last_question_normalized_answers=normalized_answers, last_answer=self.last_answer,
+                    last_answer_correct=self.last_answer_correct,
+                    last_answer_time=self.last_answer_time, version=self.version)
+
+    def tile_values(self, indices) -> list[dict]:
+        return [dict(b_id=self.tile_ids[i], state=TILE_STATES[self.tile_states[i]]) for i in indices]
+
+
+class GameEngine:
+    """Holds the state of all live games and writes their changes to the database in the background.
+
+    Moves are applied to the in-memory state only, games modified since the last flush are written
+    to the database in a single transaction every `flush_interval` seconds and when the engine stops.
+
+    With an event bus reaching other processes, each process holds its own copy of a game, and the database
+    stays the source of truth instead: every move is written through at once, provided the version in the
+    database is still the one the move was applied to, and then `game_topic` is notified. The other processes
+    mark their copies stale and check them against the database before the next use. A move applied to a copy
+    that another process changed first is dropped with the copy.
+    """
+
+    def __init__(self, db_engine: Engine, flush_interval: float = 0.5, event_bus: EventBus | None = None):
+        self.db_engine = db_engine
+        self.flush_interval = flush_interval
+        self.event_bus = event_bus  # set when the games are shared with other processes
+        self._games: dict[uuid.UUID, GameState] = {}
+        self._dirty: set[uuid.UUID] = set()
+        # guards the loaded and the dirty games, never held during a write; each game guards its state by its lock
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # keeps the flushes in order
+        self._writer: asyncio.Task | None = None
+        # the players of each room waiting for an opponent, by the room code
+        self.matchmaking: MatchQueue[str, uuid.UUID] = MatchQueue()
+        # the notifications of the typed answers, by the game id
+        self.typing = Throttle(TYPING_INTERVAL)
+
+    def __len__(self):
+        return len(self._games)
+
+    def recover(self, db: Session):
+        """Load all games that are referenced by a player connection."""
+        games = db.exec(select(Game).join(PlayerConnection).distinct()).all()
+        with self._lock:
+            for game in games:
+                self._games[game.id] = self._track(GameState(game))
+
+    def _track(self, state: GameState) -> GameState:
+        if self.event_bus:
+            # held weakly by the event bus, the subscription ends with the state
+            self.event_bus.subscribe(game_topic(state.id), state.mark_stale)
+        return state
+
+    def peek(self, game_id: uuid.UUID | None) -> GameState | None:
+        """The game state if it is loaded, without accessing the database."""
+        return self._games.get(game_id)
+
+    def get(self, db: Session, game_id: uuid.UUID | None) -> GameState | None:
+        if game_id is None:
+            return None
+        if (state := self._games.get(game_id)) and state.stale:
+            state = self._refresh(db, state)
+            if not state:
+                # the session may hold the game as it was before the change
+                with Session(self.db_engine) as fresh_db:
+                    return self._load(fresh_db, game_id)
+        return state or self._load(db, game_id)
+
+    def _load(self, db: Session, game_id: uuid.UUID) -> GameState | None:
+        game = db.get(Game, game_id)
+        if not game:
+            return None
+        state = GameState(game)
+        with self._lock:
+            if current := self._games.get(game_id):
+                return current
+            self._games[game_id] = self._track(state)
+            return state
+
+    def _refresh(self, db: Session, state: GameState) -> GameState | None:
+        """Catch up with another process, None when the game changed and has to be loaded again."""
+        state.stale = False
+        rows = db.exec(select(Game.version, PlayerConnection.player_id, PlayerConnection.active_count)
+                       .outerjoin(PlayerConnection, PlayerConnection.game_id == Game.id)
+                       .where(Game.id == state.id)).all()
+        with state.lock:
+            if not rows or rows[0][0] != state.version:
+                self._drop(state)
+                return None
+            # the connections of the players are not versioned, they are counted again
+            for player in (state.player_a, state.player_b):
+                player.active_count = sum(count for _, player_id, count in rows if player_id == player.id)
+            return state
+
+    def snapshot(self, game_id: uuid.UUID | None, db: Session | None = None) -> GameState | None:
+        """A copy of the game state made under its lock, for rendering while moves are applied in other threads.
+
+        A view rendered from the live state could mix two versions and be cached under the older one. Without
+        a session only a loaded game is copied.
+        """
+        state = self.get(db, game_id) if db is not None else self.peek(game_id)
+        if not state:
+            return None
+        with state.lock:
+            return state.copy()
+
+    def add(self, game: Game) -> GameState:
+        state = GameState(game)
+        with self._lock:
+            self._games[game.id] = self._track(state)
+        return state
+
+    def remove(self, game_id: uuid.UUID):
+        with self._lock:
+            self._games.pop(game_id, None)
+            self._dirty.discard(game_id)
+        self._notify(game_id)
+
+    def remove_room(self, room_code: str):
+        with self._lock:
+            game_ids = [s.id for s in self._games.values() if s.room_code == room_code]
+            for game_id in game_ids:
+                del self._games[game_id]
+                self._dirty.discard(game_id)
+        for game_id in game_ids:
+            self._notify(game_id)
+        self.matchmaking.remove(room_code)
+
+    def _notify(self, game_id: uuid.UUID):
+        if self.event_bus:
+            self.event_bus.notify(game_topic(game_id))
+
+    @contextlib.contextmanager
+    def modify(self, db: Session, game_id: uuid.UUID | None) -> Iterator[GameState | None]:
+        """Yield the game state for a move, the game is scheduled for a flush if its version changes.
+
+        Only the lock of the game is held, so the moves of the other games go on during a write-through.
+        """
+        state = self.get(db, game_id)
+        if not state:
+            yield None
+            return
+        with state.lock:
+            version = state.version
+            try:
+                yield state
+            finally:
+                if state.version != version:
+                    self._changed(state, version)
+
+    def _drop(self, state: GameState):
+        with self._lock:
+            if self._games.get(state.id) is state:
+                del self._games[state.id]
+
+    def _changed(self, state: GameState, version: int):
+        """Schedule the changed game for a flush, or write it through when it is shared, under the lock of the game.
+
+        The lock of the game keeps the writes of its moves in the order of their versions.
+        """
+        if not self.event_bus:
+            with self._lock:
+                self._dirty.add(state.id)
+            return
+        values = state.game_values()
+        del values['b_id']
+        tiles = state.tile_values(state.dirty_tiles)
+        state.dirty_tiles.clear()
+        written = False
+        try:
+            with self.db_engine.begin() as connection:
+                game_table, tile_table = Game.__table__, Tile.__table__
+                written = connection.execute(
+                    update(game_table).where(game_table.c.id == state.id, game_table.c.version == version)
+                    .values(values)).rowcount == 1
+                if written and tiles:
+                    connection.execute(update(tile_table).where(tile_table.c.id == bindparam('b_id')), tiles)
+        finally:
+            if not written:
+                # another process changed the game first, the change is dropped and the game loaded again
+                self._drop(state)
+        self._notify(state.id)
+
+    def set_player_name(self, player_id: uuid.UUID, name: str | None):
+        with self._lock:
+            states = list(self._games.values())
+        for state in states:
+            with state.lock:
+                if player := state.get_player(player_id):
+                    player.name = name
+                    state.version += 1
+                    self._changed(state, state.version - 1)
+
+    def set_player_active(self, game_id: uuid.UUID, player_id: uuid.UUID, active_count: int):
+        if state := self._games.get(game_id):
+            with state.lock:
+                if player := state.get_player(player_id):
+                    player.active_count = active_count
+        self._notify(game_id)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                states = [self._games[game_id] for game_id in dirty if game_id in self._games]
+            games, tiles = [], []
+            for state in states:
+                with state.lock:
+                    games.append(state.game_values())
+                    tiles += state.tile_values(state.dirty_tiles)
+                    state.dirty_tiles.clear()
+            if not games:
+                return
+            try:
+                with self.db_engine.begin() as connection:
+                    game_table, tile_table = Game.__table__, Tile.__table__
+                    connection.execute(update(game_table).where(game_table.c.id == bindparam('b_id')), games)
+                    if tiles:
+                        connection.execute(update(tile_table).where(tile_table.c.id == bindparam('b_id')), tiles)
+            except Exception:
+                # write the whole games again next time
+                for state in states:
+                    with state.lock:
+                        state.dirty_tiles.update(range(len(state.tile_states)))
+                with self._lock:
+                    self._dirty.update(state.id for state in states)
+                raise
+
+    async def _write_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._dirty:
+                try:
+                    await asyncio.to_thread(self.flush)
+                except Exception as exc:
+                    print(f'Game engine flush error: {exc}')
+
+    async def start(self):
+        await self.typing.start()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def stop(self):
+        if self._writer:
+            self._writer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._writer
+            self._writer = None
+        await self.typing.stop()
+        self.flush()
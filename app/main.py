@@ -1,20 +1,34 @@
 from contextlib import asynccontextmanager
 
+from anyio import to_thread
 from fastapi import FastAPI, Request, status
 from fastapi.responses import RedirectResponse
-from fastapi.staticfiles import StaticFiles
 from sqlalchemy.exc import NoResultFound
+from sqlmodel import Session, select
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
-from .dependencies import engine, templates
-from .model import create_db
-from .routers import auth, play, quiz, room, root
+from .dependencies import (engine, get_event_bus, get_game_engine, get_password_hasher, get_query_stats, get_room_codes,
+                           static_assets, templates, worker_threads)
+from .model import Room, create_db
+from .routers import auth, play, quiz, room, root, stats
+from .util import QueryStatsMiddleware, StaticAssetFiles
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
+    to_thread.current_default_thread_limiter().total_tokens = worker_threads
+    await to_thread.run_sync(static_assets.build)
     create_db(engine)
+    game_engine = get_game_engine()
+    with Session(engine) as db:
+        game_engine.recover(db)
+        get_room_codes().seed(db.exec(select(Room.code)).all())
+    await game_engine.start()
+    await get_event_bus().start()
     yield
+    await get_event_bus().stop()
+    await game_engine.stop()
+    get_password_hasher().shutdown()
 
 
 app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None)
@@ -23,7 +37,9 @@ app.include_router(play.router)
 app.include_router(quiz.router)
 app.include_router(room.router)
 app.include_router(root.router)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.include_router(stats.router)
+app.mount("/static", StaticAssetFiles(static_assets), name="static")
+app.add_middleware(QueryStatsMiddleware, stats=get_query_stats())
 
 
 @app.exception_handler(StarletteHTTPException)
@@ -8,13 +8,18 @@ from typing import Optional
 
 from alembic.config import Config
 from alembic import command
-from sqlalchemy import Column, Enum, delete, text, update
+from sqlalchemy import JSON, Column, Enum, delete, update
 from sqlmodel import Field, Relationship, SQLModel, select
 from sqlmodel import Session
 
 from app.util import azk
 
 
+def normalize_answer(s: str) -> str:
+    """Normalize an answer for comparison, ignores diacritics, case and surrounding whitespace."""
+    return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn').strip().casefold()
+
+
 class User(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     username: str = Field(unique=True, index=True)
@@ -101,28 +106,17 @@ class Player(SQLModel, table=True):
     connections: list[PlayerConnection] = Relationship(back_populates="player")
 
 
-class Game(SQLModel, table=True):
-    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
-    room_code: str = Field(foreign_key="room.code", ondelete="CASCADE")
-    player_a_id: uuid.UUID = Field(foreign_key="player.id", ondelete="RESTRICT")
-    player_b_id: uuid.UUID = Field(foreign_key="player.id", ondelete="RESTRICT")
-    player_on_turn_role: PlayerRole = Field(sa_column=Column(Enum(PlayerRole)))
-    is_over: bool = False
-    rows: int
-    last_question: str | None
-    last_answer: str | None
-    last_answer_time: datetime | None
-
+class GameMixin:
+    """Game rules shared by the database model and the in-memory game state."""
+    __slots__ = ()
 
-    # entities
-    room: Room = Relationship(back_populates="games")
-    player_a: Player = Relationship(sa_relationship_kwargs=dict(foreign_keys="[Game.player_a_id]"))
-    player_b: Player = Relationship(sa_relationship_kwargs=dict(foreign_keys="[Game.player_b_id]"))
-    tiles: list["Tile"] = Relationship(back_populates="game", cascade_delete=True)
+    @property
+    def layout(self):
+        return azk.BoardLayout.of(self.rows)
 
     @property
     def board_view_box(self):
-        return azk.BoardLayout(self.rows).view_box
+        return self.layout.view_box
 
     @property
     def player_on_turn(self) -> Player:
@@ -143,19 +137,16 @@ class Game(SQLModel, table=True):
         assert player in (self.player_a, self.player_b)
         return self.player_a if player == self.player_b else self.player_b
 
-    def is_player_active(self, player: Player) -> bool:
-        return any(pc.active_count for pc in player.connections if pc.game == self)
-
     def is_opponent_active(self, player: Player) -> bool:
-        opponent = self.get_opponent(player)
-        return any(pc.active_count for pc in opponent.connections if pc.game == self)
+        return self.is_player_active(self.get_opponent(player))
 
     def get_tile_by_index(self, index: int) -> Optional["Tile"]:
         return next((t for t in self.tiles if t.index == index), None)
 
     @property
     def show_last_answer(self) -> bool:
-        return self.last_question and self.last_answer_time and datetime.now() < self.last_answer_time + timedelta(seconds=6)
+        return (self.last_question and self.last_answer_time
+                and datetime.now() < self.last_answer_time + timedelta(seconds=6))
 
     @property
     def last_answer_text(self) -> str:
@@ -163,24 +154,21 @@ class Game(SQLModel, table=True):
 
     @property
     def last_question_text(self) -> str:
-        return self.last_question.split('|')[0] if self.last_question else ''
+        return self.last_question or ''
 
     @property
     def last_question_correct_answers(self) -> list[str]:
-        return self.last_question.split('|')[1:] if self.last_question else []
+        return self.last_question_answers or []
 
     @property
     def is_last_answer_correct(self) -> bool:
+        return self.last_answer_correct
 
-        def normalize(s: str) -> str:
-            return ''.join(
-                c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn').strip().lower()
-
+    def check_last_answer(self) -> bool:
+        """Evaluate the last answer, the verdict is stored in `last_answer_correct` by the caller."""
         if not self.last_question or not self.last_answer:
             return False
-
-        answer = normalize(self.last_answer)
-        return any(normalize(a) == answer for a in self.last_question_correct_answers)
+        return normalize_answer(self.last_answer) in self.last_question_normalized_answers
 
     @property
     def last_tile_winner(self) -> Player | None:
@@ -189,6 +177,34 @@ class Game(SQLModel, table=True):
             role = role.swap()
         return self.player_a if role == PlayerRole.A else self.player_b
 
+
+class Game(GameMixin, SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    room_code: str = Field(foreign_key="room.code", ondelete="CASCADE")
+    player_a_id: uuid.UUID = Field(foreign_key="player.id", ondelete="RESTRICT")
+    player_b_id: uuid.UUID = Field(foreign_key="player.id", ondelete="RESTRICT")
+    player_on_turn_role: PlayerRole = Field(sa_column=Column(Enum(PlayerRole)))
+    is_over: bool = False
+    rows: int
+    last_question: str | None
+    last_question_answers: list[str] | None = Field(default=None, sa_column=Column(JSON))
+    last_question_normalized_answers: list[str] | None = Field(default=None, sa_column=Column(JSON))
+    last_answer: str | None
+    last_answer_correct: bool = False  # the verdict for last_answer, set when the answer is submitted
+    last_answer_time: datetime | None
+    version: int = 0  # incremented on every change visible to the players, used as a render cache key
+
+
+    # entities
+    room: Room = Relationship(back_populates="games")
+    player_a: Player = Relationship(sa_relationship_kwargs=dict(foreign_keys="[Game.player_a_id]"))
+    player_b: Player = Relationship(sa_relationship_kwargs=dict(foreign_keys="[Game.player_b_id]"))
+    tiles: list["Tile"] = Relationship(back_populates="game", cascade_delete=True)
+
+    def is_player_active(self, player: Player) -> bool:
+        return any(pc.active_count for pc in player.connections if pc.game == self)
+
+
 class TileState(enum.Enum):
     DEFAULT = "DEFAULT"
     SELECTED = "SELECTED"
@@ -200,41 +216,28 @@ class TileState(enum.Enum):
         return TileState.A if role == PlayerRole.A else TileState.B
 
 
-class Tile(SQLModel, table=True):
+class TileMixin:
+    """Tile properties shared by the database model and the in-memory game state."""
+    __slots__ = ()
+
+    @property
+    def index(self):
+        return azk.BoardLayout.tile_id(self.row, self.col)
+
+
+class Tile(TileMixin, SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     game_id: uuid.UUID = Field(foreign_key="game.id", ondelete="CASCADE")
     row: int
     col: int
     state: TileState = Field(sa_column=Column(Enum(TileState)), default=TileState.DEFAULT)
-    question: str  # a list of strings separated by '|', the first one is the question, the rest are answers
+    question: str
+    answers: list[str] = Field(sa_column=Column(JSON, nullable=False))
+    normalized_answers: list[str] = Field(sa_column=Column(JSON, nullable=False))  # see normalize_answer
 
     # entities
     game: Game = Relationship(back_populates="tiles")
 
-    @property
-    def layout(self):
-        return azk.TileLayout(self.row, self.col)
-
-    @property
-    def index(self):
-        return self.layout.id
-
-    @property
-    def x(self):
-        return self.layout.x
-
-    @property
-    def y(self):
-        return self.layout.y
-
-    @property
-    def question_text(self) -> str:
-        return self.question.split('|')[0]
-
-    @property
-    def answers(self) -> list[str]:
-        return self.question.split('|')[1:]
-
 
 test_quiz = {
     'Hlavní město Francie': ('Paříž',),
@@ -282,8 +285,6 @@ def create_db(engine):
         command.stamp(Config("alembic.ini"), "head")
     else:
         command.upgrade(Config("alembic.ini"), "head")
-    with engine.connect() as connection:
-        connection.execute(text("PRAGMA foreign_keys=ON"))  # for SQLite only
     with Session(engine) as session:
         if os.environ.get('GAMEDIFY_PROD', '0') == '1':
             session.exec(delete(Room))
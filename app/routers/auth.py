@@ -3,9 +3,11 @@ from typing import Annotated
 
 from fastapi import APIRouter, Cookie, Depends, Form, Request, status
 from fastapi.responses import HTMLResponse, RedirectResponse
+from starlette.concurrency import run_in_threadpool
 
-from app.dependencies import Controller, current_user_opt, templates
+from app.dependencies import Controller, ControllerFactory, current_user_opt, get_password_hasher, templates
 from app.model import User
+from app.util import PasswordHasher, PasswordHasherBusy
 
 router = APIRouter()
 
@@ -23,11 +25,29 @@ async def login_form(request: Request,
 async def login_form(request: Request,
                      username: Annotated[str, Form()],
                      password: Annotated[str, Form()],
-                     ctrl: Annotated[Controller, Depends()]):
-    session = ctrl.login(username, password)
-    if session:
+                     ctrl_factory: Annotated[ControllerFactory, Depends()],
+                     password_hasher: Annotated[PasswordHasher, Depends(get_password_hasher)]):
+    # bcrypt runs in the password hasher's threads, the database access in the worker threads; no database
+    # connection is held while the password is checked
+    def get_user():
+        with ctrl_factory() as ctrl:
+            return ctrl.get_user_by_username(username)
+
+    def create_session(user_id: uuid.UUID) -> uuid.UUID:
+        with ctrl_factory() as ctrl:
+            return ctrl.create_session(user_id).id
+
+    user = await run_in_threadpool(get_user)
+    try:
+        valid = user is not None and await password_hasher.check(password, user.hashed_password)
+    except PasswordHasherBusy:
+        context = {"request": request, "username": username, "busy": True}
+        return templates.TemplateResponse("login.html", context, status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                          headers={"Retry-After": "1"})
+    if valid:
+        session_id = await run_in_threadpool(create_session, user.id)
         response = RedirectResponse(url=request.url_for('quiz_root'), status_code=status.HTTP_303_SEE_OTHER)
-        response.set_cookie("session_id", value=str(session.id), expires=259200,
+        response.set_cookie("session_id", value=str(session_id), expires=259200,
                             secure=True, httponly=True, samesite="lax")
         return response
 
@@ -36,9 +56,9 @@ async def login_form(request: Request,
 
 
 @router.get("/logout", response_class=HTMLResponse)
-async def logout(request: Request,
-                 ctrl: Annotated[Controller, Depends()],
-                 session_id: Annotated[uuid.UUID | None, Cookie()] = None):
+def logout(request: Request,
+           ctrl: Annotated[Controller, Depends()],
+           session_id: Annotated[uuid.UUID | None, Cookie()] = None):
     if session_id:
         ctrl.logout(session_id)
     response = RedirectResponse(url=request.url_for('root'), status_code=status.HTTP_303_SEE_OTHER)
@@ -1,22 +1,25 @@
 import uuid
-from typing import Annotated
+from typing import Annotated, Any, Callable
 
 from fastapi import APIRouter, Cookie, Depends, Request, WebSocket
 from fastapi.responses import HTMLResponse
 
-from app.dependencies import Controller, ControllerFactory, get_event_bus, jinja_env, templates
-from app.model import PlayerRole, TileState
-from app.util import EventBus
+from app.ctrl import typing_topic
+from app.dependencies import (Controller, ControllerFactory, get_event_bus, get_game_engine, get_render_cache,
+                              jinja_env, templates)
+from app.game_engine import GameEngine, GameState, PlayerState
+from app.model import PlayerConnection, PlayerRole, TileState
+from app.util import EventBus, RenderCache
 from app.util.ws_handler import WsHandler
 
 router = APIRouter(prefix="/play")
 
 
 @router.get("/{room_code}", response_class=HTMLResponse)
-async def play_root(request: Request,
-                    ctrl: Annotated[Controller, Depends()],
-                    room_code: str,
-                    player_id: Annotated[uuid.UUID | None, Cookie()] = None):
+def play_root(request: Request,
+              ctrl: Annotated[Controller, Depends()],
+              room_code: str,
+              player_id: Annotated[uuid.UUID | None, Cookie()] = None):
     room_code = room_code.upper()
     pc = ctrl.create_player_connection(room_code, player_id)
     if not pc:
@@ -32,51 +35,165 @@ async def play_root(request: Request,
     return response
 
 
+# fragments of play/game.html that are sent as out-of-band swaps when they change
+GAME_FRAGMENTS = (
+    'partials/play/player_container.html',
+    'partials/play/board_state.html',
+    'partials/play/new_game_popup.html',
+    'partials/play/turn_popup.html',
+)
+
+
+def get_template(name: str):
+    t = jinja_env.get_template(name)
+    t.globals['TileState'] = TileState
+    t.globals['PlayerRole'] = PlayerRole
+    return t
+
+
+def is_on_turn(player: PlayerState, game: GameState) -> bool:
+    return player == game.player_on_turn and game.is_opponent_active(player) and not game.is_over
+
+
+def game_context(player: PlayerState, game: GameState) -> dict:
+    return {
+        "player": player,
+        "game": game,
+        "opponent": game.get_opponent(player),
+        "my_role": 'A' if player == game.player_a else 'B',
+        "on_turn": is_on_turn(player, game),
+    }
+
+
+def game_view_key(player: PlayerState, game: GameState) -> tuple:
+    """Everything the rendered game view depends on, apart from the game state covered by its version."""
+    return (game.id, game.version, 'A' if player == game.player_a else 'B',
+            game.is_player_active(game.player_a), game.is_player_active(game.player_b), bool(game.show_last_answer))
+
+
 class PlayerWsHandler(WsHandler):
     def __init__(self,
                  websocket: WebSocket,
                  ctrl_factory: Annotated[ControllerFactory, Depends()],
                  event_bus: Annotated[EventBus, Depends(get_event_bus)],
+                 render_cache: Annotated[RenderCache, Depends(get_render_cache)],
+                 game_engine: Annotated[GameEngine, Depends(get_game_engine)],
                  connection_id: uuid.UUID):
         super().__init__(websocket, ctrl_factory, event_bus)
+        self.render_cache = render_cache
+        self.game_engine = game_engine
         self.connection_id = connection_id
+        self.player_id: uuid.UUID | None = None
+        # what the client currently shows: the last page sent, or the id of the game whose board it displays;
+        # for the game view we also remember the tile states and fragments, so that only the changes are sent
+        self.view: str | uuid.UUID | None = None
+        self.sent_tiles = b''
+        self.sent_fragments: dict[str, str] = {}
+        # the answer typed by the opponent is sent separately from the game view, see on_typing
+        self.sent_typing: str | None = None
 
-    async def on_connect(self, ctrl: Controller) -> uuid.UUID:
+    def on_connect(self, ctrl: Controller) -> uuid.UUID:
         pc = ctrl.set_player_connection_active(self.connection_id, True)
+        self.player_id = pc.player.id
+        self.room_code = pc.room_code
         return pc.player.id
 
-    async def on_disconnect(self, ctrl: Controller):
+    def topics(self) -> dict[Any, Callable[[Controller], str | None]]:
+        return {typing_topic(self.player_id): self.on_typing}
+
+    def on_typing(self, ctrl: Controller) -> str | None:
+        """Send the latest answer typed by the opponent, the notifications are throttled per game by the controller.
+
+        The game the client shows is enough, the database is not accessed.
+        """
+        game = self.game_engine.snapshot(self.view) if isinstance(self.view, uuid.UUID) else None
+        if game and (player := game.get_player(self.player_id)):
+            return self.render_typing(game, player)
+        return None
+
+    def on_disconnect(self, ctrl: Controller):
         ctrl.set_player_connection_active(self.connection_id, False)
 
-    async def on_event(self, ctrl: Controller):
+    def on_event(self, ctrl: Controller) -> str | None:
         pc = ctrl.get_player_connection(self.connection_id)
         if not pc:
-            await self.send(jinja_env.get_template('play/error.html').render())
-            return
+            self.view = None
+            return jinja_env.get_template('play/error.html').render()
         if not pc.player.name:
-            template = 'play/no_name.html'
-        elif not pc.game and not ctrl.try_start_game(pc):
-            template = 'play/no_game.html'
+            return self.render_page('play/no_name.html', pc)
+        # the game is missing also when the opponent deleted it after the connection was loaded,
+        # the players are paired by the controller when they connect, get a name or leave a game
+        elif not (game := ctrl.get_game_state(pc.game_id)):
+            return self.render_page('play/no_game.html', pc)
         else:
-            template = 'play/game.html'
+            return self.render_game(game, pc.player_id)
 
-        t = jinja_env.get_template(template)
-        t.globals['TileState'] = TileState
-        t.globals['PlayerRole'] = PlayerRole
-        msg = t.render(
+    def render_page(self, template: str, pc: PlayerConnection) -> str | None:
+        msg = get_template(template).render(
             player=pc.player,
             room=pc.room,
             game=pc.game,
             connection_id=str(pc.id)
         )
-        await self.send(msg)
+        if self.view == msg:
+            return None
+        self.view = msg
+        return msg
+
+    def render_game(self, game: GameState, player_id: uuid.UUID) -> str | None:
+        """Render the whole game on the first frame, afterward only the tiles and fragments that changed.
 
-    async def on_error(self, ctrl: Controller, exc: Exception):
+        The rendered markup is shared through the render cache by all connections that see the same view.
+        """
+        player = game.get_player(player_id)
+        key = game_view_key(player, game)
+        tiles = bytes(game.tile_states)
+        fragments = self.render_cache.get((key, 'fragments'), lambda: {
+            name: get_template(name).render(game_context(player, game)) for name in GAME_FRAGMENTS
+        })
+
+        if self.view != game.id:
+            self.view = game.id
+            self.sent_tiles = tiles
+            self.sent_fragments = fragments
+            self.sent_typing = None
+            msg = self.render_cache.get((key, 'game'), lambda: get_template('play/game.html').render(
+                game_context(player, game)))
+            return msg + (self.render_typing(game, player) or '')
+
+        changed_tiles = [game.get_tile_by_index(i) for i, (sent, state) in enumerate(zip(self.sent_tiles, tiles))
+                         if sent != state]
+        changed_fragments = {name: f for name, f in fragments.items() if self.sent_fragments.get(name) != f}
+        self.sent_tiles = tiles
+        self.sent_fragments = fragments
+        if 'partials/play/turn_popup.html' in changed_fragments:
+            self.sent_typing = None  # the new popup comes with an empty typed answer
+        if typing := self.render_typing(game, player):
+            changed_fragments['partials/play/typed_answer.html'] = typing
+        if not changed_tiles and not changed_fragments:
+            return None
+        return get_template('play/game_delta.html').render(tiles=changed_tiles,
+                                                           fragments=changed_fragments.values())
+
+    def render_typing(self, game: GameState, player: PlayerState) -> str | None:
+        """Render the answer typed by the opponent, if it differs from the one the client shows."""
+        typed_answer = game.typed_answer if game.selected_tile and not is_on_turn(player, game) else None
+        if typed_answer == self.sent_typing:
+            return None
+        self.sent_typing = typed_answer
+        return get_template('partials/play/typed_answer.html').render(game=game, typed_answer=typed_answer)
+
+    def on_error(self, ctrl: Controller, exc: Exception) -> str:
         print(f'Player connection {self.connection_id} error: {exc}')
-        msg = jinja_env.get_template('play/error.html').render(exc=exc)
-        await self.send(msg)
+        self.view = None
+        return jinja_env.get_template('play/error.html').render(exc=exc)
 
-    async def on_receive(self, ctrl: Controller, msg):
+    def on_receive(self, ctrl: Controller, msg):
+        if msg['action'] == 'type_answer':
+            # the most frequent message, the game shown by the client is enough to handle it
+            if isinstance(self.view, uuid.UUID):
+                ctrl.type_answer(self.view, self.player_id, msg['answer'])
+            return
         pc = ctrl.get_player_connection(self.connection_id)
         if not pc:
             return
@@ -90,8 +207,6 @@ class PlayerWsHandler(WsHandler):
             ctrl.submit_answer(pc, None)
         elif msg['action'] == 'start_new_game':
             ctrl.start_new_game(pc)
-        elif msg['action'] == 'type_answer':
-            ctrl.type_answer(pc, msg['answer'])
         else:
             print("RECEIVED:", msg)
 
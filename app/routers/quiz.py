@@ -1,24 +1,28 @@
-import random
 import uuid
 from typing import Annotated
 
 from fastapi import APIRouter, Cookie, Depends, Form, HTTPException, Request, status
 from fastapi.responses import HTMLResponse, RedirectResponse
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
 from sqlmodel import Session, and_, or_, select
 
-from app.dependencies import current_user, get_db, templates
+from app.dependencies import Controller, current_user, get_db, templates
 from app.model import Answer, Question, Quiz, Room, User
 
 router = APIRouter(prefix="/quiz")
 
+# loading strategies of the views, everything a view renders is loaded by a fixed number of queries
+QUIZ_LIST = (joinedload(Quiz.owner), selectinload(Quiz.questions), selectinload(Quiz.rooms))
+QUIZ_DETAIL = (joinedload(Quiz.owner), selectinload(Quiz.questions))
+QUESTION_DETAIL = (joinedload(Question.quiz).joinedload(Quiz.owner), selectinload(Question.answers))
+
 
 ### Dependencies ###
 
-async def get_quiz(quiz_id: uuid.UUID,
-                   db: Annotated[Session, Depends(get_db)],
-                   user: Annotated[User, Depends(current_user)]):
-    quiz = db.exec(select(Quiz).where(Quiz.id == quiz_id)).one_or_none()
+def get_quiz(quiz_id: uuid.UUID,
+             db: Annotated[Session, Depends(get_db)],
+             user: Annotated[User, Depends(current_user)]):
+    quiz = db.exec(select(Quiz).options(*QUIZ_DETAIL).where(Quiz.id == quiz_id)).one_or_none()
     if not quiz:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
     if quiz.owner != user and not quiz.is_public:
@@ -26,22 +30,23 @@ async def get_quiz(quiz_id: uuid.UUID,
     return quiz
 
 
-async def get_selected_question_no_check(db: Annotated[Session, Depends(get_db)],
-                                         selected_question_id: Annotated[uuid.UUID | None, Cookie()] = None):
+def get_selected_question_no_check(db: Annotated[Session, Depends(get_db)],
+                                   selected_question_id: Annotated[uuid.UUID | None, Cookie()] = None):
     if selected_question_id:
-        return db.exec(select(Question).where(Question.id == selected_question_id)).one_or_none()
+        return db.exec(select(Question).options(*QUESTION_DETAIL)
+                       .where(Question.id == selected_question_id)).one_or_none()
 
 
-async def get_selected_question(quiz: Annotated[Quiz, Depends(get_quiz)],
-                                selected_question: Annotated[Question | None, Depends(get_selected_question_no_check)]):
+def get_selected_question(quiz: Annotated[Quiz, Depends(get_quiz)],
+                          selected_question: Annotated[Question | None, Depends(get_selected_question_no_check)]):
     if selected_question and selected_question.quiz_id == quiz.id:
         return selected_question
 
 
-async def get_question(question_id: uuid.UUID,
-                       db: Annotated[Session, Depends(get_db)],
-                       user: Annotated[User, Depends(current_user)]):
-    question = db.exec(select(Question).where(Question.id == question_id)).one_or_none()
+def get_question(question_id: uuid.UUID,
+                 db: Annotated[Session, Depends(get_db)],
+                 user: Annotated[User, Depends(current_user)]):
+    question = db.exec(select(Question).options(*QUESTION_DETAIL).where(Question.id == question_id)).one_or_none()
     if not question:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
     if question.quiz.owner != user and not question.quiz.is_public:
@@ -49,10 +54,11 @@ async def get_question(question_id: uuid.UUID,
     return question
 
 
-async def get_answer(answer_id: uuid.UUID,
-                     db: Annotated[Session, Depends(get_db)],
-                     user: Annotated[User, Depends(current_user)]):
-    answer = db.exec(select(Answer).where(Answer.id == answer_id)).one_or_none()
+def get_answer(answer_id: uuid.UUID,
+               db: Annotated[Session, Depends(get_db)],
+               user: Annotated[User, Depends(current_user)]):
+    answer = db.exec(select(Answer).options(joinedload(Answer.question).options(*QUESTION_DETAIL))
+                     .where(Answer.id == answer_id)).one_or_none()
     if not answer:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
     if answer.question.quiz.owner != user and not answer.question.quiz.is_public:
@@ -61,9 +67,10 @@ async def get_answer(answer_id: uuid.UUID,
 
 
 ### Helpers ###
-async def load_quiz_list(db: Annotated[Session, Depends(get_db)],
-                         user: Annotated[User, Depends(current_user)]):
+def load_quiz_list(db: Annotated[Session, Depends(get_db)],
+                   user: Annotated[User, Depends(current_user)]):
     return (db.exec(select(Quiz, Room)
+                    .options(*QUIZ_LIST)
                     .join(Room, isouter=True, onclause=and_(Room.quiz_id == Quiz.id, Room.owner == user))
                     .where(or_(Quiz.is_public == True, Quiz.owner == user)))
             .all())
@@ -72,11 +79,11 @@ async def load_quiz_list(db: Annotated[Session, Depends(get_db)],
 ### Routes ###
 
 @router.get("/", response_class=HTMLResponse)
-async def quiz_root(request: Request,
-                    db: Annotated[Session, Depends(get_db)],
-                    user: Annotated[User, Depends(current_user)]):
+def quiz_root(request: Request,
+              db: Annotated[Session, Depends(get_db)],
+              user: Annotated[User, Depends(current_user)]):
     """Show all quizzes that are public or owned by the user. Also show rooms owned by the user."""
-    context = {"request": request, "user": user, "quizzes_and_rooms": await load_quiz_list(db, user)}
+    context = {"request": request, "user": user, "quizzes_and_rooms": load_quiz_list(db, user)}
     return templates.TemplateResponse("quiz/main.html", context)
 
 
@@ -88,15 +95,15 @@ async def new_quiz_row_edit(request: Request):
 
 
 @router.post("/new_quiz_row", response_class=HTMLResponse)
-async def new_quiz_row_post(request: Request,
-                            quiz_name: Annotated[str, Form()],
-                            db: Annotated[Session, Depends(get_db)],
-                            user: Annotated[User, Depends(current_user)]):
+def new_quiz_row_post(request: Request,
+                      quiz_name: Annotated[str, Form()],
+                      db: Annotated[Session, Depends(get_db)],
+                      user: Annotated[User, Depends(current_user)]):
     """Create a new quiz."""
     quiz = Quiz(name=quiz_name, owner=user)
     db.add(quiz)
     db.commit()
-    context = {"request": request, "user": user, "quizzes_and_rooms": await load_quiz_list(db, user)}
+    context = {"request": request, "user": user, "quizzes_and_rooms": load_quiz_list(db, user)}
     return templates.TemplateResponse("partials/quiz/quiz_list.html", context)
 
 
@@ -108,7 +115,7 @@ async def new_quiz_row(request: Request):
 
 
 @router.delete("/quiz_row/{quiz_id}", response_class=HTMLResponse)
-async def quiz_row_delete(
+def quiz_row_delete(
         quiz: Annotated[Quiz, Depends(get_quiz)],
         db: Annotated[Session, Depends(get_db)],
         user: Annotated[User, Depends(current_user)]):
@@ -121,9 +128,9 @@ async def quiz_row_delete(
 
 
 @router.get("/quiz_row_edit/{quiz_id}", response_class=HTMLResponse)
-async def quiz_row_edit(request: Request,
-                        quiz: Annotated[Quiz, Depends(get_quiz)],
-                        user: Annotated[User, Depends(current_user)]):
+def quiz_row_edit(request: Request,
+                  quiz: Annotated[Quiz, Depends(get_quiz)],
+                  user: Annotated[User, Depends(current_user)]):
     """Show a form to edit the name of a quiz."""
     if quiz.owner != user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -132,10 +139,10 @@ async def quiz_row_edit(request: Request,
 
 
 @router.get("/quiz_row/{quiz_id}", response_class=HTMLResponse)
-async def quiz_row_get(request: Request,
-                       db: Annotated[Session, Depends(get_db)],
-                       quiz: Annotated[Quiz, Depends(get_quiz)],
-                       user: Annotated[User, Depends(current_user)]):
+def quiz_row_get(request: Request,
+                 db: Annotated[Session, Depends(get_db)],
+                 quiz: Annotated[Quiz, Depends(get_quiz)],
+                 user: Annotated[User, Depends(current_user)]):
     """Show an existing quiz name, used when cancelling an edit."""
     if quiz.owner != user and not quiz.is_public:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -145,11 +152,11 @@ async def quiz_row_get(request: Request,
 
 
 @router.patch("/quiz_row/{quiz_id}", response_class=HTMLResponse)
-async def quiz_row_patch(request: Request,
-                         quiz_name: Annotated[str, Form()],
-                         quiz: Annotated[Quiz, Depends(get_quiz)],
-                         db: Annotated[Session, Depends(get_db)],
-                         user: Annotated[User, Depends(current_user)]):
+def quiz_row_patch(request: Request,
+                   quiz_name: Annotated[str, Form()],
+                   quiz: Annotated[Quiz, Depends(get_quiz)],
+                   db: Annotated[Session, Depends(get_db)],
+                   user: Annotated[User, Depends(current_user)]):
     """Update an existing quiz name."""
     if quiz.owner != user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -162,10 +169,10 @@ async def quiz_row_patch(request: Request,
 
 
 @router.get("/question_row_edit/{question_id}", response_class=HTMLResponse)
-async def question_row_edit(request: Request,
-                            question: Annotated[Question, Depends(get_question)],
-                            selected_question: Annotated[Question | None, Depends(get_selected_question_no_check)],
-                            user: Annotated[User, Depends(current_user)]):
+def question_row_edit(request: Request,
+                      question: Annotated[Question, Depends(get_question)],
+                      selected_question: Annotated[Question | None, Depends(get_selected_question_no_check)],
+                      user: Annotated[User, Depends(current_user)]):
     """Show a form to edit an existing question."""
     if question.quiz.owner != user and not question.quiz.is_public:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -174,12 +181,12 @@ async def question_row_edit(request: Request,
 
 
 @router.patch("/question_row/{question_id}", response_class=HTMLResponse)
-async def question_row_patch(request: Request,
-                             question_text: Annotated[str, Form()],
-                             question: Annotated[Question, Depends(get_question)],
-                             db: Annotated[Session, Depends(get_db)],
-                             user: Annotated[User, Depends(current_user)],
-                             selected_question: Annotated[Question | None, Depends(get_selected_question_no_check)]):
+def question_row_patch(request: Request,
+                       question_text: Annotated[str, Form()],
+                       question: Annotated[Question, Depends(get_question)],
+                       db: Annotated[Session, Depends(get_db)],
+                       user: Annotated[User, Depends(current_user)],
+                       selected_question: Annotated[Question | None, Depends(get_selected_question_no_check)]):
     """Update an existing answer."""
     if question.quiz.owner != user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -194,10 +201,10 @@ async def question_row_patch(request: Request,
 
 
 @router.get("/question_row/{question_id}", response_class=HTMLResponse)
-async def question_row_get(request: Request,
-                           question: Annotated[Question, Depends(get_question)],
-                           user: Annotated[User, Depends(current_user)],
-                           selected_question: Annotated[Question | None, Depends(get_selected_question_no_check)]):
+def question_row_get(request: Request,
+                     question: Annotated[Question, Depends(get_question)],
+                     user: Annotated[User, Depends(current_user)],
+                     selected_question: Annotated[Question | None, Depends(get_selected_question_no_check)]):
     """Show an existing question, used when cancelling an edit."""
     if question.quiz.owner != user and not question.quiz.is_public:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -211,7 +218,7 @@ async def question_row_get(request: Request,
 
 
 @router.delete("/question_row/{question_id}", response_class=HTMLResponse)
-async def question_row_delete(
+def question_row_delete(
         request: Request,
         question: Annotated[Question, Depends(get_question)],
         db: Annotated[Session, Depends(get_db)],
@@ -239,19 +246,19 @@ async def question_row_delete(
 
 
 @router.get("/new_question_row/{quiz_id}", response_class=HTMLResponse)
-async def new_question_row(request: Request,
-                           quiz: Annotated[Quiz, Depends(get_quiz)]):
+def new_question_row(request: Request,
+                     quiz: Annotated[Quiz, Depends(get_quiz)]):
     """Show the link for creating a new question, used when cancelling the creation of a new question."""
     context = {"request": request, "quiz": quiz}
     return templates.TemplateResponse("partials/quiz/new_question_row.html", context)
 
 
 @router.post("/new_question_row/{quiz_id}", response_class=HTMLResponse)
-async def new_question_row_post(request: Request,
-                                quiz: Annotated[Quiz, Depends(get_quiz)],
-                                question_text: Annotated[str, Form()],
-                                db: Annotated[Session, Depends(get_db)],
-                                user: Annotated[User, Depends(current_user)]):
+def new_question_row_post(request: Request,
+                          quiz: Annotated[Quiz, Depends(get_quiz)],
+                          question_text: Annotated[str, Form()],
+                          db: Annotated[Session, Depends(get_db)],
+                          user: Annotated[User, Depends(current_user)]):
     """Create a new question."""
     if quiz.owner != user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -269,9 +276,9 @@ async def new_question_row_post(request: Request,
 
 
 @router.get("/new_question_row_edit/{quiz_id}", response_class=HTMLResponse)
-async def new_question_row_edit(request: Request,
-                                quiz: Annotated[Quiz, Depends(get_quiz)],
-                                user: Annotated[User, Depends(current_user)]):
+def new_question_row_edit(request: Request,
+                          quiz: Annotated[Quiz, Depends(get_quiz)],
+                          user: Annotated[User, Depends(current_user)]):
     """Show the form for creating a new question."""
     if quiz.owner != user and not quiz.is_public:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -280,9 +287,9 @@ async def new_question_row_edit(request: Request,
 
 
 @router.get("/answer_row_edit/{answer_id}", response_class=HTMLResponse)
-async def answer_row_edit(request: Request,
-                          answer: Annotated[Answer, Depends(get_answer)],
-                          user: Annotated[User, Depends(current_user)]):
+def answer_row_edit(request: Request,
+                    answer: Annotated[Answer, Depends(get_answer)],
+                    user: Annotated[User, Depends(current_user)]):
     """Show a form to edit an existing answer."""
     if answer.question.quiz.owner != user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -291,11 +298,11 @@ async def answer_row_edit(request: Request,
 
 
 @router.patch("/answer_row/{answer_id}", response_class=HTMLResponse)
-async def answer_row_patch(request: Request,
-                           answer_text: Annotated[str, Form()],
-                           answer: Annotated[Answer, Depends(get_answer)],
-                           db: Annotated[Session, Depends(get_db)],
-                           user: Annotated[User, Depends(current_user)]):
+def answer_row_patch(request: Request,
+                     answer_text: Annotated[str, Form()],
+                     answer: Annotated[Answer, Depends(get_answer)],
+                     db: Annotated[Session, Depends(get_db)],
+                     user: Annotated[User, Depends(current_user)]):
     """Update an existing answer."""
     if answer.question.quiz.owner != user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -307,9 +314,9 @@ async def answer_row_patch(request: Request,
 
 
 @router.get("/answer_row/{answer_id}", response_class=HTMLResponse)
-async def answer_row_get(request: Request,
-                         answer: Annotated[Answer, Depends(get_answer)],
-                         user: Annotated[User, Depends(current_user)]):
+def answer_row_get(request: Request,
+                   answer: Annotated[Answer, Depends(get_answer)],
+                   user: Annotated[User, Depends(current_user)]):
     """Show an existing answer, used when cancelling an edit."""
     if answer.question.quiz.owner != user and not answer.question.quiz.is_public:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -318,7 +325,7 @@ async def answer_row_get(request: Request,
 
 
 @router.delete("/answer_row/{answer_id}", response_class=HTMLResponse)
-async def answer_row_delete(
+def answer_row_delete(
         answer: Annotated[Answer, Depends(get_answer)],
         db: Annotated[Session, Depends(get_db)],
         user: Annotated[User, Depends(current_user)]):
@@ -338,11 +345,11 @@ async def new_answer_row(request: Request):
 
 
 @router.post("/new_answer_row", response_class=HTMLResponse)
-async def new_answer_row_post(request: Request,
-                              answer_text: Annotated[str, Form()],
-                              db: Annotated[Session, Depends(get_db)],
-                              user: Annotated[User, Depends(current_user)],
-                              selected_question: Annotated[Question | None, Depends(get_selected_question_no_check)]):
+def new_answer_row_post(request: Request,
+                        answer_text: Annotated[str, Form()],
+                        db: Annotated[Session, Depends(get_db)],
+                        user: Annotated[User, Depends(current_user)],
+                        selected_question: Annotated[Question | None, Depends(get_selected_question_no_check)]):
     """Create a new answer."""
     if not selected_question:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
@@ -367,10 +374,10 @@ async def new_answer_row_edit(request: Request):
 
 
 @router.get("/{quiz_id}", response_class=HTMLResponse)
-async def quiz_detail(request: Request,
-                      quiz: Annotated[Quiz, Depends(get_quiz)],
-                      user: Annotated[User, Depends(current_user)],
-                      selected_question: Annotated[Question | None, Depends(get_selected_question)]):
+def quiz_detail(request: Request,
+                quiz: Annotated[Quiz, Depends(get_quiz)],
+                user: Annotated[User, Depends(current_user)],
+                selected_question: Annotated[Question | None, Depends(get_selected_question)]):
     """Show the details of a quiz, including all questions and answers."""
     if quiz.owner != user and not quiz.is_public:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -384,10 +391,10 @@ async def quiz_detail(request: Request,
 
 
 @router.post("/{quiz_id}/select/{question_id}", response_class=HTMLResponse)
-async def quiz_select_question(request: Request,
-                               quiz: Annotated[Quiz, Depends(get_quiz)],
-                               question_id: uuid.UUID,
-                               user: Annotated[User, Depends(current_user)]):
+def quiz_select_question(request: Request,
+                         quiz: Annotated[Quiz, Depends(get_quiz)],
+                         question_id: uuid.UUID,
+                         user: Annotated[User, Depends(current_user)]):
     """Select a question in the quiz, showing all its answers."""
     if quiz.owner != user and not quiz.is_public:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -405,21 +412,14 @@ async def quiz_select_question(request: Request,
 
 
 @router.get("/{quiz_id}/create_room", response_class=HTMLResponse)
-async def room_create(request: Request,
-                      quiz: Annotated[Quiz, Depends(get_quiz)],
-                      db: Annotated[Session, Depends(get_db)],
-                      user: Annotated[User, Depends(current_user)]):
+def room_create(request: Request,
+                quiz: Annotated[Quiz, Depends(get_quiz)],
+                ctrl: Annotated[Controller, Depends()],
+                user: Annotated[User, Depends(current_user)]):
     if quiz.owner != user and not quiz.is_public:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
-    for i in range(50):
-        code = ''.join(random.sample("34679CDFGHJKLMNPQRTVWX", 4))
-        room = Room(code=code, quiz=quiz, owner=user)
-        try:
-            db.add(room)
-            db.commit()
-            return RedirectResponse(url=request.url_for('room_root', room_code=code),
-                                    status_code=status.HTTP_303_SEE_OTHER)
-        except IntegrityError:
-            db.rollback()
+    if room := ctrl.create_room(quiz, user):
+        return RedirectResponse(url=request.url_for('room_root', room_code=room.code),
+                                status_code=status.HTTP_303_SEE_OTHER)
     raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                         detail="Unable to generate unique room code ")
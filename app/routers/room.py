@@ -1,41 +1,72 @@
+import hashlib
 import uuid
-from typing import Annotated
+from typing import Annotated, Sequence
 
-from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, WebSocket, status
 from fastapi.responses import HTMLResponse, RedirectResponse
 from qrcode import QRCode
 from qrcode.image.svg import SvgPathImage
 
-from app.dependencies import Controller, ControllerFactory, current_user, get_event_bus, jinja_env, templates
+from app.ctrl import RoomSnapshot
+from app.dependencies import (Controller, ControllerFactory, current_user, get_event_bus, get_qr_cache,
+                              get_room_snapshots, jinja_env, templates)
 from app.model import User
-from app.util import EventBus
+from app.util import EventBus, RenderCache, TopicCache
 from app.util.ws_handler import WsHandler
 
 router = APIRouter(prefix="/room")
 
+# how long the browser may use its copy of a QR code before revalidating it by the ETag
+QR_MAX_AGE = 86400
+
+
+def qr_code_svg(url: str) -> str:
+    qr = QRCode(image_factory=SvgPathImage)
+    qr.add_data(url)
+    qr.make(fit=True)
+    return qr.make_image().to_string(encoding='unicode')
+
+
+def qr_code_etag(url: str) -> str:
+    """The QR code depends on nothing but the URL, so its ETag is known without generating it."""
+    return '"' + hashlib.sha256(url.encode()).hexdigest()[:32] + '"'
+
 
 @router.get("/{room_code}", response_class=HTMLResponse)
-async def room_root(request: Request,
-                    room_code: str,
-                    ctrl: Annotated[Controller, Depends()],
-                    user: Annotated[User, Depends(current_user)]):
+def room_root(request: Request,
+              room_code: str,
+              ctrl: Annotated[Controller, Depends()],
+              user: Annotated[User, Depends(current_user)]):
     room = ctrl.get_room(room_code)
     if room.owner != user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
     url = request.url_for('play_root', room_code=room.code)
-    qr = QRCode(image_factory=SvgPathImage)
-    qr.add_data(url)
-    qr.make(fit=True)
-    img = qr.make_image(attrib={'class': 'some-css-class'})
-    context = {"request": request, "room": room, "url": url, "qrcode": img.to_string(encoding='unicode')}
+    context = {"request": request, "room": room, "url": url}
     return templates.TemplateResponse("room/main.html", context)
 
 
+@router.get("/{room_code}/qr.svg")
+def room_qr(request: Request,
+            room_code: str,
+            qr_cache: Annotated[RenderCache, Depends(get_qr_cache)],
+            _: Annotated[User, Depends(current_user)],
+            if_none_match: Annotated[str | None, Header()] = None):
+    """The QR code of the play URL, generated once and then served from the cache or revalidated by the ETag.
+
+    The room is not loaded, the code may be of a closed room, but its QR code tells no more than the URL.
+    """
+    url = str(request.url_for('play_root', room_code=room_code.upper()))
+    headers = {'ETag': qr_code_etag(url), 'Cache-Control': f'private, max-age={QR_MAX_AGE}'}
+    if if_none_match == headers['ETag']:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(qr_cache.get(url, lambda: qr_code_svg(url)), media_type='image/svg+xml', headers=headers)
+
+
 @router.get("/{room_code}/close", response_class=HTMLResponse)
-async def room_close(request: Request,
-                     room_code: str,
-                     ctrl: Annotated[Controller, Depends()],
-                     user: Annotated[User, Depends(current_user)]):
+def room_close(request: Request,
+               room_code: str,
+               ctrl: Annotated[Controller, Depends()],
+               user: Annotated[User, Depends(current_user)]):
     room = ctrl.get_room(room_code)
     if room.owner != user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
@@ -43,16 +74,32 @@ async def room_close(request: Request,
     return RedirectResponse(url=request.url_for('quiz_root'), status_code=status.HTTP_303_SEE_OTHER)
 
 
+def dashboard_changes(sent: dict[uuid.UUID, tuple], shown: Sequence[tuple],
+                      prefix: str) -> tuple[list[str], list, list]:
+    """The element ids of the summaries no longer shown, and the summaries that changed and that were added."""
+    shown_ids = {s.id for s in shown}
+    removed = [f'{prefix}-{summary_id}' for summary_id in sent.keys() - shown_ids]
+    changed = [s for s in shown if s.id in sent and sent[s.id] != s]
+    added = [s for s in shown if s.id not in sent]
+    return removed, changed, added
+
+
 class RoomWsHandler(WsHandler):
     def __init__(self,
                  websocket: WebSocket,
                  ctrl_factory: Annotated[ControllerFactory, Depends()],
                  event_bus: Annotated[EventBus, Depends(get_event_bus)],
+                 room_snapshots: Annotated[TopicCache[RoomSnapshot], Depends(get_room_snapshots)],
                  room_code: str):
         super().__init__(websocket, ctrl_factory, event_bus)
+        self.room_snapshots = room_snapshots
         self.room_code = room_code
+        # the summaries of the games and of the waiting players the dashboard shows, by their ids,
+        # None until the whole dashboard is sent; afterward only the cards and players that changed are sent
+        self.sent_games: dict[uuid.UUID, tuple] | None = None
+        self.sent_waiting: dict[uuid.UUID, tuple] = {}
 
-    async def on_connect(self, ctrl: Controller) -> str:
+    def on_connect(self, ctrl: Controller) -> str:
         if session_id := self.websocket.cookies.get('session_id'):
             if user := ctrl.get_user_for_session(uuid.UUID(session_id)):
                 room = ctrl.get_room(self.room_code)
@@ -60,25 +107,50 @@ class RoomWsHandler(WsHandler):
                     return self.room_code
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
 
-    async def on_disconnect(self, ctrl: Controller):
+    def on_disconnect(self, ctrl: Controller):
         pass
 
-    async def on_event(self, ctrl: Controller):
-        players = ctrl.get_room_players(self.room_code)
-        games = ctrl.get_room_games(self.room_code)
-        waiting = ctrl.get_waiting_pcs(self.room_code)
-        msg = jinja_env.get_template(f'room/dynamic_content.html').render({
-            'players': players,
-            'games': games,
-            'waiting': [w.player for w in waiting],
-        })
-        await self.send(msg)
-
-    async def on_error(self, ctrl: Controller, exc: Exception):
-        msg = jinja_env.get_template('room/error.html').render({'exc': exc})
-        await self.send(msg)
-
-    async def on_receive(self, ctrl: Controller, msg):
+    def on_event(self, ctrl: Controller) -> str | list[str] | None:
+        # the room code is the topic notified by every change of the snapshot
+        games, waiting = self.room_snapshots.get(self.room_code, lambda: ctrl.get_room_snapshot(self.room_code))
+        shown_games = {game.id: game for game in games}
+        shown_waiting = {player.id: player for player in waiting}
+        sent_games, sent_waiting = self.sent_games, self.sent_waiting
+        self.sent_games, self.sent_waiting = shown_games, shown_waiting
+        if sent_games is None:
+            return jinja_env.get_template('room/dynamic_content.html').render({'games': games, 'waiting': waiting})
+
+        # a section that becomes empty or stops being empty is sent whole
+        frames, sections, removed, changed_games, added_games = [], [], [], [], []
+        if bool(sent_games) != bool(shown_games):
+            sections.append('partials/room/games.html')
+        else:
+            removed, changed_games, added_games = dashboard_changes(sent_games, games, 'game')
+        if bool(sent_waiting) != bool(shown_waiting):
+            sections.append('partials/room/waiting.html')
+        if sections or removed or changed_games or added_games:
+            frames.append(jinja_env.get_template('room/dynamic_delta.html').render({
+                'games': games,
+                'waiting': waiting,
+                'sections': sections,
+                'removed': removed,
+                'changed_games': changed_games,
+                'added_games': added_games,
+            }))
+        if sent_waiting and shown_waiting and sent_waiting != shown_waiting:
+            # the rows are parsed in a frame of their own, appended, or the list is replaced when a row changed
+            removed_waiting, changed_waiting, added_waiting = dashboard_changes(sent_waiting, waiting, 'waiting')
+            frames.append(jinja_env.get_template('room/waiting_delta.html').render({
+                'waiting': waiting,
+                'added_waiting': [] if removed_waiting or changed_waiting else added_waiting,
+            }))
+        return frames or None
+
+    def on_error(self, ctrl: Controller, exc: Exception) -> str:
+        self.sent_games = None
+        return jinja_env.get_template('room/error.html').render({'exc': exc})
+
+    def on_receive(self, ctrl: Controller, msg):
         room = ctrl.get_room(self.room_code)
         if msg['action'] == 'reject_name':
             player = ctrl.get_player(uuid.UUID(msg['player_id']))
@@ -17,10 +17,10 @@ async def root(request: Request,
 
 
 @router.post("/")
-async def root_code_submit(request: Request,
-                           ctrl: Annotated[Controller, Depends()],
-                           user: Annotated[User | None, Depends(current_user_opt)],
-                           code: Annotated[str, Form()] = ''):
+def root_code_submit(request: Request,
+                     ctrl: Annotated[Controller, Depends()],
+                     user: Annotated[User | None, Depends(current_user_opt)],
+                     code: Annotated[str, Form()] = ''):
     code = code.upper()
     if ctrl.is_room_code_valid(code):
         return RedirectResponse(url=f'/play/{code}', status_code=status.HTTP_303_SEE_OTHER)
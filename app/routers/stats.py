@@ -0,0 +1,26 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
+
+from app.dependencies import current_user, get_query_stats
+from app.model import User
+from app.util import QueryStats
+from app.util.metrics import REGISTRY
+
+router = APIRouter(prefix="/stats")
+
+
+@router.get("/sql")
+async def sql_stats(_: Annotated[User, Depends(current_user)],
+                    query_stats: Annotated[QueryStats, Depends(get_query_stats)]):
+    """Query statistics of the routes and WebSocket callbacks, empty unless enabled by GAMEDIFY_SQL_STATS."""
+    return {name: stats._asdict() for name, stats in query_stats.summary().items()}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(_: Annotated[User, Depends(current_user)]):
+    """The metrics in the Prometheus text format, enabled by GAMEDIFY_METRICS."""
+    if not REGISTRY.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return PlainTextResponse(REGISTRY.exposition(), media_type='text/plain; version=0.0.4')
@@ -1 +1,11 @@
-from app.util.event_bus import EventBus
+from app.util.code_allocator import CodeAllocator
+from app.util.event_broker import BrokerBackend, EventBroker
+from app.util.event_bus import EventBus, EventBusBackend, TopicStats
+from app.util.match_queue import MatchQueue
+from app.util.password_hasher import PasswordHasher, PasswordHasherBusy
+from app.util.query_stats import QueryStats, QueryStatsMiddleware, ScopeStats
+from app.util.render_cache import RenderCache
+from app.util.session_cache import SessionCache
+from app.util.static_assets import StaticAssetFiles, StaticAssets
+from app.util.throttle import Throttle
+from app.util.topic_cache import TopicCache
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
+import functools
 import math
-from typing import Generator, NamedTuple
+from array import array
+from typing import NamedTuple
 
-from app import model
 
 sqrt3 = math.sqrt(3)
 tile_size = 11
@@ -44,26 +45,10 @@ class TileLayout(NamedTuple):
         return tile_size * 1.5 * self.r
 
 
-class BoardLayout(NamedTuple):
-    rows: int
-
-    @property
-    def view_box(self) -> str:
-        board_width = math.ceil(sqrt3 * tile_size * self.rows)
-        board_height = math.ceil((1.5 * (self.rows - 1) + 2) * tile_size)
-        board_min_x = -board_width / 2
-        board_max_y = -tile_size
-        return " ".join(str(i) for i in (board_min_x, board_max_y, board_width, board_height))
-
-    @property
-    def tiles(self) -> tuple[TileLayout, ...]:
-        return tuple(TileLayout(row, col) for row in range(self.rows) for col in range(row + 1))
-
-    @staticmethod
-    def from_max_tile_count(max_tile_count: int) -> BoardLayout:
-        rows = triangular_inv(max_tile_count)
-        return BoardLayout(rows)
-
+LEFT_EDGE = 1
+RIGHT_EDGE = 2
+BOTTOM_EDGE = 4
+ALL_EDGES = LEFT_EDGE | RIGHT_EDGE | BOTTOM_EDGE
 
 DIRS = (
     (-1, -1),  # top left
@@ -75,23 +60,90 @@ DIRS = (
 )
 
 
-def is_winner_move(game: model.Game, start_tile: model.Tile) -> bool:
-    visited = set()
-    tiles = {(t.row, t.col): t for t in game.tiles}
+class BoardLayout:
+    """Geometry of a board with the given number of rows, all arrays are indexed by the tile id.
 
-    def neighbours(r, c) -> Generator[tuple[int, int], None, None]:
-        return ((r + dr, c + dc) for dr, dc in DIRS)
+    The layout is computed once per number of rows, use `BoardLayout.of(rows)` to get it.
+    """
+    __slots__ = ('rows', 'tile_count', 'view_box', 'tiles', 'tile_rows', 'tile_cols', 'xs', 'ys', 'transforms',
+                 'edges', 'neighbours')
 
-    def visit(r, c):
-        tile = tiles.get((r, c), None)
-        if not tile or tile.state != start_tile.state or (r, c) in visited:
-            return
-        visited.add((r, c))
-        for nr, nc in neighbours(r, c):
-            visit(nr, nc)
+    def __init__(self, rows: int):
+        board_width = math.ceil(sqrt3 * tile_size * rows)
+        board_height = math.ceil((1.5 * (rows - 1) + 2) * tile_size)
+        board_min_x = -board_width / 2
+        board_max_y = -tile_size
+
+        self.rows = rows
+        self.tiles = tuple(TileLayout(row, col) for row in range(rows) for col in range(row + 1))
+        self.tile_count = len(self.tiles)
+        self.view_box = " ".join(str(i) for i in (board_min_x, board_max_y, board_width, board_height))
+        self.tile_rows = array('H', (t.row for t in self.tiles))
+        self.tile_cols = array('H', (t.col for t in self.tiles))
+        self.xs = array('d', (t.x for t in self.tiles))
+        self.ys = array('d', (t.y for t in self.tiles))
+        self.transforms = tuple(f"translate({t.x}, {t.y})" for t in self.tiles)
+        self.edges = bytes((LEFT_EDGE if t.col == 0 else 0) | (RIGHT_EDGE if t.col == t.row else 0) |
+                           (BOTTOM_EDGE if t.row == rows - 1 else 0) for t in self.tiles)
+        self.neighbours = tuple(
+            tuple(self.tile_id(t.row + dr, t.col + dc) for dr, dc in DIRS if 0 <= t.col + dc <= t.row + dr < rows)
+            for t in self.tiles)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def of(rows: int) -> BoardLayout:
+        return BoardLayout(rows)
+
+    @staticmethod
+    def tile_id(row: int, col: int) -> int:
+        return triangular(row) + col
+
+    @staticmethod
+    def from_max_tile_count(max_tile_count: int) -> BoardLayout:
+        rows = triangular_inv(max_tile_count)
+        return BoardLayout.of(rows)
+
+
+class Connectivity:
+    """Incremental union-find over the tiles of one colour, indexed by the tile id.
+
+    Every component keeps a bit mask of the board edges it touches, so a move is a winning one
+    as soon as the component of the placed tile touches all three edges.
+    """
+    __slots__ = ('layout', 'parent', 'size', 'edges')
+
+    def __init__(self, layout: BoardLayout):
+        self.layout = layout
+        self.parent = array('i', [-1]) * layout.tile_count  # -1 for tiles not owned by this colour
+        self.size = array('i', [0]) * layout.tile_count
+        self.edges = bytearray(layout.tile_count)
+
+    def find(self, tile_id: int) -> int:
+        parent = self.parent
+        while parent[tile_id] != tile_id:
+            parent[tile_id] = parent[parent[tile_id]]
+            tile_id = parent[tile_id]
+        return tile_id
+
+    def union(self, a: int, b: int) -> int:
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        self.edges[a] |= self.edges[b]
+        return a
+
+    def add(self, tile_id: int) -> bool:
+        """Add a tile of this colour, return True if its component touches all three edges."""
+        self.parent[tile_id] = tile_id
+        self.size[tile_id] = 1
+        self.edges[tile_id] = self.layout.edges[tile_id]
+        root = tile_id
+        for neighbour in self.layout.neighbours[tile_id]:
+            if self.parent[neighbour] != -1:
+                root = self.union(root, neighbour)
+        return self.edges[root] == ALL_EDGES
 
-    visit(start_tile.row, start_tile.col)
-    left_edge = any(col == 0 for (_, col) in visited)
-    right_edge = any(col == row for row, col in visited)
-    bottom_edge = any(row == game.rows - 1 for row, _ in visited)
-    return left_edge and right_edge and bottom_edge
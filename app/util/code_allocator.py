@@ -0,0 +1,77 @@
+import random
+import threading
+from typing import Iterable
+
+
+class CodeAllocator:
+    """Allocates short codes of a fixed length over an alphabet, e.g. room codes, without retrying collisions.
+
+    The codes in use are marked in a bitmap of the whole code space, one byte per code. An allocation picks a
+    random code and takes the first free one from it on, so it costs one pick while the space is mostly free
+    and a scan of the bitmap in C at worst. The allocator knows only the codes of its own process, codes taken
+    by other processes must be marked by `mark_used`, or the allocator seeded again from the database.
+    """
+
+    def __init__(self, alphabet: str, length: int):
+        self.alphabet = alphabet
+        self.length = length
+        self.size = len(alphabet) ** length
+        self.used = 0
+        self._bitmap = bytearray(self.size)
+        self._lock = threading.Lock()
+
+    @property
+    def utilisation(self) -> float:
+        return self.used / self.size
+
+    def seed(self, codes: Iterable[str]):
+        """Forget all codes and mark the given ones as used, codes outside the code space are ignored."""
+        with self._lock:
+            self._bitmap = bytearray(self.size)
+            self.used = 0
+        for code in codes:
+            self.mark_used(code)
+
+    def allocate(self) -> str | None:
+        """A free code marked as used, or None when all codes are used."""
+        with self._lock:
+            start = random.randrange(self.size)
+            index = self._bitmap.find(0, start)
+            if index < 0:
+                index = self._bitmap.find(0, 0, start)
+                if index < 0:
+                    return None
+            self._bitmap[index] = 1
+            self.used += 1
+        return self.encode(index)
+
+    def mark_used(self, code: str):
+        if (index := self.decode(code)) is not None:
+            with self._lock:
+                if not self._bitmap[index]:
+                    self._bitmap[index] = 1
+                    self.used += 1
+
+    def release(self, code: str):
+        if (index := self.decode(code)) is not None:
+            with self._lock:
+                if self._bitmap[index]:
+                    self._bitmap[index] = 0
+                    self.used -= 1
+
+    def encode(self, index: int) -> str:
+        chars = []
+        for _ in range(self.length):
+            index, digit = divmod(index, len(self.alphabet))
+            chars.append(self.alphabet[digit])
+        return ''.join(reversed(chars))
+
+    def decode(self, code: str) -> int | None:
+        if len(code) != self.length:
+            return None
+        index = 0
+        for char in code:
+            if (digit := self.alphabet.find(char)) < 0:
+                return None
+            index = index * len(self.alphabet) + digit
+        return index
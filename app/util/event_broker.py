@@ -0,0 +1,181 @@
+"""Event bus notifications between processes on one machine, through a broker listening on a Unix socket.
+
+Run the broker with `python -m app.util.event_broker PATH` and start every worker with GAMEDIFY_EVENT_BROKER=PATH.
+
+The protocol is line based, a line is a command followed by space separated topics:
+`S` subscribes to the topics, `U` unsubscribes and `P` publishes them. The broker forwards published topics
+to every other connection subscribed to them, again as `P` lines. Topics are UUIDs or strings without
+whitespace, see `encode_topic`.
+"""
+import asyncio
+import contextlib
+import os
+import sys
+import uuid
+from collections import defaultdict
+from typing import Any, Iterable
+
+from app.util.event_bus import Deliver, EventBusBackend
+
+LINE_LIMIT = 2 ** 20
+
+
+def encode_topic(topic: Any) -> bytes:
+    if isinstance(topic, uuid.UUID):
+        return b'u' + topic.hex.encode()
+    if isinstance(topic, str) and topic and not any(c.isspace() for c in topic):
+        return b's' + topic.encode()
+    raise ValueError(f'Unsupported event bus topic: {topic!r}')
+
+
+def decode_topic(data: bytes) -> Any:
+    if data[:1] == b'u':
+        return uuid.UUID(data[1:].decode())
+    return data[1:].decode()
+
+
+def encode_line(command: bytes, topics: Iterable[bytes]) -> bytes:
+    return b' '.join((command, *topics)) + b'\n'
+
+
+class EventBroker:
+    """Forwards the published topics to the other connections that subscribed to them."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._subscribers: dict[bytes, set[asyncio.StreamWriter]] = defaultdict(set)
+        self._server: asyncio.Server | None = None
+
+    async def start(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, self.path, limit=LINE_LIMIT)
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def serve_forever(self):
+        await self.start()
+        await self._server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        topics: set[bytes] = set()
+        try:
+            async for line in reader:
+                command, *args = line.split()
+                if command == b'S':
+                    topics.update(args)
+                    for topic in args:
+                        self._subscribers[topic].add(writer)
+                elif command == b'U':
+                    topics.difference_update(args)
+                    for topic in args:
+                        self._unsubscribe(topic, writer)
+                elif command == b'P':
+                    self._publish(writer, args)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            for topic in topics:
+                self._unsubscribe(topic, writer)
+            writer.close()
+
+    def _unsubscribe(self, topic: bytes, writer: asyncio.StreamWriter):
+        if subscribers := self._subscribers.get(topic):
+            subscribers.discard(writer)
+            if not subscribers:
+                del self._subscribers[topic]
+
+    def _publish(self, sender: asyncio.StreamWriter, topics: list[bytes]):
+        batches: dict[asyncio.StreamWriter, list[bytes]] = defaultdict(list)
+        for topic in topics:
+            for writer in self._subscribers.get(topic, ()):
+                if writer is not sender:
+                    batches[writer].append(topic)
+        for writer, batch in batches.items():
+            writer.write(encode_line(b'P', batch))
+
+
+class BrokerBackend(EventBusBackend):
+    """Exchanges the notifications with other processes through an `EventBroker`.
+
+    The notifications of one event loop iteration are sent to the broker as a single batch.
+    The connection is re-established with all subscriptions when the broker restarts.
+    """
+
+    def __init__(self, path: str, reconnect_delay: float = 1.0):
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self._topics: set[bytes] = set()
+        self._deliver: Deliver | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=LINE_LIMIT)
+            except OSError as exc:
+                print(f'Event broker connection error: {exc}')
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            try:
+                if self._topics:
+                    writer.write(encode_line(b'S', self._topics))
+                self._writer = writer
+                async for line in reader:
+                    command, *args = line.split()
+                    if command == b'P':
+                        self._deliver([decode_topic(topic) for topic in args])
+            except ConnectionError:
+                pass
+            finally:
+                self._writer = None
+                writer.close()
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _send(self, command: bytes, topics: Iterable[bytes]):
+        if self._writer:
+            self._writer.write(encode_line(command, topics))
+
+    def subscribe(self, topic: Any):
+        topic = encode_topic(topic)
+        self._topics.add(topic)
+        self._send(b'S', (topic,))
+
+    def unsubscribe(self, topic: Any):
+        topic = encode_topic(topic)
+        self._topics.discard(topic)
+        self._send(b'U', (topic,))
+
+    def publish(self, topics: Iterable[Any]):
+        self._send(b'P', [encode_topic(topic) for topic in topics])
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit('Usage: python -m app.util.event_broker PATH')
+    try:
+        asyncio.run(EventBroker(sys.argv[1]).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,221 @@
-from collections import defaultdict
-from typing import Any, Callable
+import asyncio
+import inspect
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Iterable, NamedTuple
 
-Listener = Callable[[], None]
+from app.util.metrics import REGISTRY
 
+DELIVERY_SECONDS = REGISTRY.histogram('gamedify_event_bus_delivery_seconds',
+                                      'Time from the first notification of a topic until its delivery.')
+NOTIFICATIONS = REGISTRY.counter('gamedify_event_bus_notifications_total', 'Notifications of subscribed topics.')
+DELIVERIES = REGISTRY.counter('gamedify_event_bus_deliveries_total', 'Deliveries of notifications to listeners.')
+
+Listener = Callable[[], Awaitable[None] | None]
+Deliver = Callable[[Iterable[Any]], None]
+
+
+class EventBusBackend:
+    """Carries notifications between the event buses of several processes.
+
+    This base backend is used by a single process, all listeners are local and there is nothing to carry.
+    All methods are called on the event loop.
+    """
+
+    async def start(self, deliver: Deliver):
+        """Start receiving notifications from other processes, they are passed to `deliver` on the event loop."""
+        pass
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, topic: Any):
+        """Called when the first local listener subscribes to the topic."""
+        pass
+
+    def unsubscribe(self, topic: Any):
+        """Called when the last local listener unsubscribes from the topic."""
+        pass
+
+    def publish(self, topics: Iterable[Any]):
+        """Pass the notifications of one event loop iteration to the other processes."""
+        pass
+
+
+class TopicStats(NamedTuple):
+    subscribers: int
+    queued: int  # notifications waiting for the next delivery, they are delivered once
+    running: int  # async listeners that have not finished yet
+    notified: int  # all notifications of the topic
+    delivered: int  # all deliveries to the listeners, less than notified when notifications were coalesced
+
+
+class _Topic:
+    __slots__ = ('listeners', 'running', 'notified', 'delivered', 'notified_at')
 
-class EventBus:
     def __init__(self):
-        self._listeners: dict[Any, list[Listener]] = defaultdict(list)
+        self.listeners: list[weakref.ref] = []
+        self.running = 0
+        self.notified = 0
+        self.delivered = 0
+        self.notified_at: float | None = None  # perf_counter of the first notification of the last delivery
+
+
+class EventBus:
+    """Notifies the listeners subscribed to a topic.
+
+    Notifications may come from any thread. They are queued and delivered on the event loop in its next
+    iteration, repeated notifications of a topic until then are delivered only once. Before `start` they are
+    delivered immediately in the calling thread.
+
+    Listeners are functions or coroutine functions and are held weakly, a subscription ends at the latest when
+    its listener is garbage collected.
+    """
+
+    def __init__(self, backend: EventBusBackend | None = None):
+        self.backend = backend or EventBusBackend()
+        self._topics: dict[Any, _Topic] = {}
+        self._queued: dict[Any, int] = {}
+        self._queued_at: dict[Any, float] = {}
+        self._unpublished: dict[Any, None] = {}  # an ordered set
+        # guards the queues and subscriptions, notify is called by worker threads; reentrant because
+        # a listener may be garbage collected, and its subscription removed, while the lock is held
+        self._lock = threading.RLock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._scheduled = False
+        self._tasks: set[asyncio.Task] = set()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        await self.backend.start(self._deliver_remote)
+
+    async def stop(self):
+        await self.backend.stop()
+        self._loop = None
 
     def subscribe(self, topic: Any, listener: Listener):
-        self._listeners[topic].append(listener)
+        def on_collected(ref: weakref.ref):
+            self._remove(topic, ref)
+
+        ref = weakref.WeakMethod(listener, on_collected) if inspect.ismethod(listener) \
+            else weakref.ref(listener, on_collected)
+        with self._lock:
+            first = topic not in self._topics
+            self._topics.setdefault(topic, _Topic()).listeners.append(ref)
+        if first:
+            self._call_backend(self.backend.subscribe, topic)
 
     def unsubscribe(self, topic: Any, listener: Listener):
-        self._listeners[topic].remove(listener)
-        if not self._listeners[topic]:
-            del self._listeners[topic]
+        entry = self._topics.get(topic)
+        ref = next((r for r in entry.listeners if r() == listener), None) if entry else None
+        if ref is None:
+            raise ValueError(f'Listener {listener!r} is not subscribed to {topic!r}')
+        self._remove(topic, ref)
+
+    def _remove(self, topic: Any, ref: weakref.ref):
+        with self._lock:
+            entry = self._topics.get(topic)
+            if not entry or ref not in entry.listeners:
+                return
+            entry.listeners.remove(ref)
+            last = not entry.listeners
+            if last:
+                del self._topics[topic]
+        if last:
+            self._call_backend(self.backend.unsubscribe, topic)
+
+    def _call_backend(self, method: Callable[[Any], None], topic: Any):
+        # subscriptions of garbage collected listeners end in whatever thread the collector runs
+        if self._loop and not self._in_loop():
+            self._loop.call_soon_threadsafe(method, topic)
+        else:
+            method(topic)
+
+    def _in_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
 
     def notify(self, topic: Any):
-        for listener in self._listeners[topic]:
-            listener()
+        self._enqueue((topic,), publish=True)
+
+    def _deliver_remote(self, topics: Iterable[Any]):
+        self._enqueue(topics, publish=False)
+
+    def _enqueue(self, topics: Iterable[Any], publish: bool):
+        now = time.perf_counter()
+        with self._lock:
+            for topic in topics:
+                if topic not in self._queued:
+                    self._queued_at[topic] = now
+                self._queued[topic] = self._queued.get(topic, 0) + 1
+                if publish:
+                    self._unpublished[topic] = None
+            if self._scheduled:
+                return
+            self._scheduled = True
+        if not self._loop:
+            self._dispatch()
+        elif self._in_loop():
+            self._loop.call_soon(self._dispatch)
+        else:
+            self._loop.call_soon_threadsafe(self._dispatch)
+
+    def _dispatch(self):
+        with self._lock:
+            queued, self._queued = self._queued, {}
+            queued_at, self._queued_at = self._queued_at, {}
+            unpublished, self._unpublished = self._unpublished, {}
+            self._scheduled = False
+            deliveries = [(entry, count, queued_at[topic], list(entry.listeners))
+                          for topic, count in queued.items() if (entry := self._topics.get(topic))]
+        if unpublished:
+            self.backend.publish(unpublished)
+        now = time.perf_counter()
+        for entry, count, notified_at, listeners in deliveries:
+            entry.notified += count
+            entry.delivered += 1
+            entry.notified_at = notified_at
+            NOTIFICATIONS.inc(count)
+            DELIVERIES.inc()
+            DELIVERY_SECONDS.observe(now - notified_at)
+            for ref in listeners:
+                if listener := ref():
+                    self._call(entry, listener)
+
+    def _call(self, entry: _Topic, listener: Listener):
+        try:
+            result = listener()
+        except Exception as exc:
+            print(f'Event bus listener error: {exc}')
+            return
+        if not inspect.isawaitable(result):
+            return
+        task = asyncio.ensure_future(result)
+        entry.running += 1
+        self._tasks.add(task)
+
+        def done(t: asyncio.Task):
+            entry.running -= 1
+            self._tasks.discard(t)
+            if not t.cancelled() and t.exception():
+                print(f'Event bus listener error: {t.exception()}')
+
+        task.add_done_callback(done)
+
+    def notified_at(self, topic: Any) -> float | None:
+        """The perf_counter of the first notification of the last delivery of the topic, for latency metrics.
+
+        Notifications from other processes count from their arrival in this one.
+        """
+        entry = self._topics.get(topic)
+        return entry.notified_at if entry else None
+
+    def stats(self) -> dict[Any, TopicStats]:
+        """Statistics of the topics that have subscribers."""
+        with self._lock:
+            return {topic: TopicStats(len(entry.listeners), self._queued.get(topic, 0), entry.running,
+                                      entry.notified, entry.delivered)
+                    for topic, entry in self._topics.items()}
@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+T = TypeVar('T', bound=Hashable)
+
+
+class MatchQueue(Generic[K, T]):
+    """In-memory FIFO queues of the items waiting for a partner, e.g. the players of each room waiting for an opponent.
+
+    Joining a queue either takes the item waiting longest out of it, or queues the joining item when there is none.
+    Both happen under a lock, so an item is paired at most once however many items join at the same time. The
+    queues know only the items of their own process.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._queues: dict[K, OrderedDict[T, float]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def depth(self, key: K) -> int:
+        return len(self._queues.get(key, ()))
+
+    def join(self, key: K, item: T) -> tuple[T, float] | None:
+        """The partner waiting longest with the seconds it waited, or None when the item was queued.
+
+        An item that is queued already keeps its place.
+        """
+        with self._lock:
+            queue = self._queues.setdefault(key, OrderedDict())
+            if item in queue:
+                return None
+            if not queue:
+                queue[item] = self.clock()
+                return None
+            partner, queued_at = queue.popitem(last=False)
+            if not queue:
+                del self._queues[key]
+        return partner, self.clock() - queued_at
+
+    def requeue(self, key: K, item: T, waited: float):
+        """Put a partner returned by `join` back to the head of the queue, e.g. when the pairing failed."""
+        with self._lock:
+            queue = self._queues.setdefault(key, OrderedDict())
+            queue[item] = self.clock() - waited
+            queue.move_to_end(item, last=False)
+
+    def leave(self, key: K, item: T) -> bool:
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue or queue.pop(item, None) is None:
+                return False
+            if not queue:
+                del self._queues[key]
+            return True
+
+    def remove(self, key: K):
+        with self._lock:
+            self._queues.pop(key, None)
@@ -0,0 +1,180 @@
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Iterable
+
+from jinja2 import Template
+
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+
+Labels = tuple[str, ...]
+
+
+class _Value:
+    __slots__ = ('registry', 'value', 'lock')
+
+    def __init__(self, registry: 'Registry'):
+        self.registry = registry
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        if self.registry.enabled:
+            with self.lock:
+                self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        if self.registry.enabled:
+            self.value = value
+
+    def samples(self, name: str, labels: str) -> Iterable[str]:
+        yield f'{name}{labels} {_format(self.value)}'
+
+
+class _Histogram:
+    __slots__ = ('registry', 'buckets', 'counts', 'sum', 'lock')
+
+    def __init__(self, registry: 'Registry', buckets: tuple[float, ...]):
+        self.registry = registry
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one counts the observations above all buckets
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        if self.registry.enabled:
+            i = bisect.bisect_left(self.buckets, value)
+            with self.lock:
+                self.counts[i] += 1
+                self.sum += value
+
+    def samples(self, name: str, labels: str) -> Iterable[str]:
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), counts):
+            cumulative += count
+            le = f'le="{_format(bound)}"'
+            yield f'{name}_bucket{{{labels[1:-1] + "," if labels else ""}{le}}} {cumulative}'
+        yield f'{name}_sum{labels} {_format(total)}'
+        yield f'{name}_count{labels} {cumulative}'
+
+
+class Metric:
+    """A metric family, its children are created by `labels`; a metric without labels is its own child."""
+
+    def __init__(self, registry: 'Registry', kind: str, name: str, help: str, labels: Labels,
+                 buckets: tuple[float, ...] = (), callback: Callable[[], dict[Labels, float]] | None = None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets
+        self.callback = callback
+        self._children: dict[Labels, _Value | _Histogram] = {}
+        self._lock = threading.Lock()
+        if not labels:
+            self._child = self.labels()
+
+    def labels(self, *values: str) -> _Value | _Histogram:
+        if child := self._children.get(values):
+            return child
+        with self._lock:
+            if values not in self._children:
+                self._children[values] = _Histogram(self.registry, self.buckets) if self.kind == 'histogram' \
+                    else _Value(self.registry)
+            return self._children[values]
+
+    def inc(self, amount: float = 1):
+        self._child.inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._child.dec(amount)
+
+    def set(self, value: float):
+        self._child.set(value)
+
+    def observe(self, value: float):
+        self._child.observe(value)
+
+    def exposition(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        if self.callback:
+            for values, value in self.callback().items():
+                yield f'{self.name}{self._format_labels(values)} {_format(value)}'
+            return
+        for values, child in list(self._children.items()):
+            yield from child.samples(self.name, self._format_labels(values))
+
+    def _format_labels(self, values: Labels) -> str:
+        if not values:
+            return ''
+        escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for v in values)
+        return '{' + ','.join(f'{n}="{v}"' for n, v in zip(self.label_names, escaped)) + '}'
+
+
+class Registry:
+    """Counters, gauges and histograms exposed in the Prometheus text format.
+
+    Disabled until `enabled` is set, until then updating a metric costs a single attribute check. The metrics
+    are updated from the event loop and the worker threads, each child has its own lock.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._metrics: dict[str, Metric] = {}
+
+    def _add(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Labels = ()) -> Metric:
+        return self._add(Metric(self, 'counter', name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Labels = (),
+              callback: Callable[[], dict[Labels, float]] | None = None) -> Metric:
+        """A gauge set by its users, or computed by the callback on every scrape."""
+        return self._add(Metric(self, 'gauge', name, help, labels, callback=callback))
+
+    def histogram(self, name: str, help: str, labels: Labels = (), buckets=LATENCY_BUCKETS) -> Metric:
+        return self._add(Metric(self, 'histogram', name, help, labels, buckets=tuple(buckets)))
+
+    def unregister(self, name: str):
+        self._metrics.pop(name, None)
+
+    def exposition(self) -> str:
+        return ''.join(f'{line}\n' for metric in list(self._metrics.values()) for line in metric.exposition())
+
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+REGISTRY = Registry()
+
+TEMPLATE_RENDER_SECONDS = REGISTRY.histogram('gamedify_template_render_seconds', 'Time to render a template.',
+                                             ('template',))
+
+
+class TimedTemplate(Template):
+    """Records the render time of the templates rendered directly, not of their includes."""
+
+    def render(self, *args, **kwargs) -> str:
+        if not REGISTRY.enabled:
+            return super().render(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            TEMPLATE_RENDER_SECONDS.labels(self.name).observe(time.perf_counter() - start)
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+import bcrypt
+
+T = TypeVar('T')
+
+
+class PasswordHasherBusy(Exception):
+    """Too many passwords are waiting to be hashed or checked, the caller should try again later."""
+
+
+class PasswordHasher:
+    """Hashes and checks passwords with bcrypt in a dedicated thread pool of a fixed size.
+
+    bcrypt releases the GIL, so the pool neither blocks the event loop nor occupies the worker threads of the
+    routes. At most `max_pending` passwords wait or run at once, more raise `PasswordHasherBusy` immediately,
+    so that a burst of logins cannot take more CPU than the pool size from the running games.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 16, rounds: int = 12):
+        self.rounds = rounds
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.workers = workers
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    async def check(self, password: str, hashed_password: str) -> bool:
+        return await self._run(bcrypt.checkpw, password.encode(), hashed_password.encode())
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(bcrypt.hashpw, password.encode(), bcrypt.gensalt(self.rounds))
+        return hashed.decode()
+
+    async def _run(self, fn: Callable[..., T], *args) -> T:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordHasherBusy()
+            self.pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password')
+            executor = self._executor
+        future = executor.submit(fn, *args)
+        # released when bcrypt is done, not when the request awaiting it is cancelled
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    def _done(self, _):
+        with self._lock:
+            self.pending -= 1
+
+    def shutdown(self):
+        """Stop the threads, a later password starts them again."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(cancel_futures=True)
@@ -0,0 +1,152 @@
+import contextlib
+import contextvars
+import json
+import threading
+import time
+from typing import Iterator, NamedTuple
+
+from sqlalchemy import Engine, event
+
+SLOWEST = 3  # the slowest statements kept per scope
+STATEMENT_LIMIT = 200  # characters of a statement kept for the slowest ones
+UNSCOPED = 'other'  # statements executed outside any scope, e.g. by the game engine flush
+
+
+class ScopeStats(NamedTuple):
+    calls: int
+    queries: int
+    rows: int  # rows written, the rows read are not known to the cursor
+    time_ms: float
+    max_queries: int  # the most queries of a single call
+    slowest: tuple[tuple[float, str], ...]  # (time_ms, statement) of the slowest statements, slowest first
+
+
+class _Invocation:
+    __slots__ = ('name', 'queries', 'rows', 'time', 'slowest')
+
+    def __init__(self, name: str | None = None):
+        self.name = name
+        self.queries = 0
+        self.rows = 0
+        self.time = 0.0
+        self.slowest: list[tuple[float, str]] = []
+
+    def add(self, duration: float, statement: str, rows: int):
+        self.queries += 1
+        self.rows += max(rows, 0)
+        self.time += duration
+        _keep_slowest(self.slowest, duration, statement)
+
+
+class _Scope(_Invocation):
+    __slots__ = ('calls', 'max_queries')
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.max_queries = 0
+
+    def merge(self, invocation: _Invocation):
+        self.calls += 1
+        self.max_queries = max(self.max_queries, invocation.queries)
+        self.queries += invocation.queries
+        self.rows += invocation.rows
+        self.time += invocation.time
+        for duration, statement in invocation.slowest:
+            _keep_slowest(self.slowest, duration, statement)
+
+
+def _keep_slowest(slowest: list[tuple[float, str]], duration: float, statement: str):
+    if len(slowest) < SLOWEST or duration > slowest[-1][0]:
+        slowest.append((duration, statement[:STATEMENT_LIMIT]))
+        slowest.sort(key=lambda s: s[0], reverse=True)
+        del slowest[SLOWEST:]
+
+
+class QueryStats:
+    """Attributes the SQL statements executed by an engine to the route or WebSocket callback that ran them.
+
+    Opt-in, until `attach` is called scopes cost nothing. Each scope that executed a statement prints one JSON
+    line with its query count, rows and time, `summary` aggregates the scopes by name. The current scope is
+    a context variable, it follows the routes and callbacks into the worker threads.
+    """
+
+    def __init__(self, log: bool = True):
+        self.log = log
+        self.enabled = False
+        self._current: contextvars.ContextVar[_Invocation | None] = contextvars.ContextVar('query_scope',
+                                                                                           default=None)
+        self._scopes: dict[str, _Scope] = {}
+        self._lock = threading.Lock()
+
+    def attach(self, engine: Engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        self.enabled = True
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_start'].pop()
+        if invocation := self._current.get():
+            invocation.add(duration, statement, cursor.rowcount)
+        else:
+            with self._lock:
+                self._scopes.setdefault(UNSCOPED, _Scope()).add(duration, statement, cursor.rowcount)
+
+    @contextlib.contextmanager
+    def scope(self, name: str | None = None) -> Iterator[_Invocation | None]:
+        """Attribute the statements to a scope, the yielded invocation may be renamed until the scope ends."""
+        if not self.enabled:
+            yield None
+            return
+        invocation = _Invocation(name)
+        token = self._current.set(invocation)
+        try:
+            yield invocation
+        finally:
+            self._current.reset(token)
+            self._record(invocation.name or UNSCOPED, invocation)
+
+    def _record(self, name: str, invocation: _Invocation):
+        with self._lock:
+            self._scopes.setdefault(name, _Scope()).merge(invocation)
+        if self.log and invocation.queries:
+            slowest = invocation.slowest[0]
+            print(json.dumps({'sql_scope': name, 'queries': invocation.queries, 'rows': invocation.rows,
+                              'time_ms': round(invocation.time * 1000, 3),
+                              'slowest_ms': round(slowest[0] * 1000, 3), 'slowest': slowest[1]}))
+
+    def summary(self) -> dict[str, ScopeStats]:
+        """Statistics of the scopes by name, the most time consuming first."""
+        with self._lock:
+            scopes = sorted(self._scopes.items(), key=lambda s: s[1].time, reverse=True)
+            return {name: ScopeStats(scope.calls, scope.queries, scope.rows, round(scope.time * 1000, 3),
+                                     scope.max_queries,
+                                     tuple((round(d * 1000, 3), s) for d, s in scope.slowest))
+                    for name, scope in scopes}
+
+    def reset(self):
+        with self._lock:
+            self._scopes.clear()
+
+
+class QueryStatsMiddleware:
+    """Runs each HTTP request in a query scope named by its method and endpoint."""
+
+    def __init__(self, app, stats: QueryStats):
+        self.app = app
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.stats.enabled:
+            return await self.app(scope, receive, send)
+        with self.stats.scope() as invocation:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                # the router stores the matched endpoint in the scope
+                if endpoint := scope.get('endpoint'):
+                    invocation.name = f"{scope['method']} {getattr(endpoint, '__name__', type(endpoint).__name__)}"
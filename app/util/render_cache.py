@@ -0,0 +1,37 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, TypeVar
+
+T = TypeVar('T')
+
+
+class RenderCache:
+    """A bounded LRU cache of rendered markup shared by all WebSocket handlers.
+
+    The handlers render in worker threads, a value missing in the cache may be rendered by several threads at
+    once, which is harmless as long as the render function is pure.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Any, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Any, render: Callable[[], T]) -> T:
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        value = render()
+        with self._lock:
+            self._entries[key] = value
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
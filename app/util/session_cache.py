@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Generic, TypeVar
+
+from app.util.event_bus import EventBus
+
+T = TypeVar('T')
+
+
+class _Entry(Generic[T]):
+    __slots__ = ('value', 'deadline', 'listener')
+
+    def __init__(self, value: T, deadline: float, listener: Callable[[], None]):
+        self.value = value
+        self.deadline = deadline
+        self.listener = listener  # held here, the event bus holds its listeners weakly
+
+
+class SessionCache(Generic[T]):
+    """A bounded LRU cache of what authenticated requests need to know about a login session.
+
+    An entry lives until its session expires, at most `ttl` seconds. Ending a session must notify its topic on
+    the event bus, the notification reaches the caches of all worker processes through the event broker; the
+    ttl bounds how long another process may use an ended session when a notification is lost.
+    """
+
+    def __init__(self, event_bus: EventBus, topic: Callable[[Any], Any], max_size: int = 1024, ttl: float = 300):
+        self.event_bus = event_bus
+        self.topic = topic
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Any, _Entry[T]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, session_id: Any) -> T | None:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry and entry.deadline > time.monotonic():
+                self.hits += 1
+                self._entries.move_to_end(session_id)
+                return entry.value
+            self.misses += 1
+        if entry:
+            self.invalidate(session_id)
+        return None
+
+    def put(self, session_id: Any, value: T, expires_at: datetime):
+        ttl = min(self.ttl, (expires_at - datetime.now()).total_seconds())
+        if ttl <= 0:
+            return
+        listener = lambda: self.invalidate(session_id)
+        # subscribed before the entry is visible, whoever removes the entry unsubscribes its listener
+        self.event_bus.subscribe(self.topic(session_id), listener)
+        with self._lock:
+            removed = [(session_id, e)] if (e := self._entries.pop(session_id, None)) else []
+            self._entries[session_id] = _Entry(value, time.monotonic() + ttl, listener)
+            while len(self._entries) > self.max_size:
+                removed.append(self._entries.popitem(last=False))
+        for sid, entry in removed:
+            self.event_bus.unsubscribe(self.topic(sid), entry.listener)
+
+    def invalidate(self, session_id: Any):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        if entry:
+            self.event_bus.unsubscribe(self.topic(session_id), entry.listener)
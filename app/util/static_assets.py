@@ -0,0 +1,139 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:  # optional, without it the assets are precompressed by gzip only
+    brotli = None
+
+HASH_LENGTH = 12
+# the file types worth compressing, the images and woff fonts are compressed already
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ttf', '.eot', '.json', '.txt', '.html'}
+# the precompressed variants in the order of preference, by their Content-Encoding
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+IMMUTABLE = 'public, max-age=31536000, immutable'
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")?#]+)([^'")]*)\1\s*\)''')
+
+
+class StaticAssets:
+    """Copies the static files under content-hashed names, with gzip and brotli variants, to a build directory.
+
+    The build is idempotent and skips the files built before, so it runs at every startup. The files referred
+    to by stylesheets are fingerprinted first and the references rewritten, so that a changed font changes the
+    name of the stylesheet too. The old builds are kept, pages rendered before a deploy can still load them.
+    """
+
+    def __init__(self, source_dir: str, build_dir: str):
+        self.source_dir = source_dir
+        self.build_dir = build_dir
+        # the fingerprinted name of every source file, and the encodings of every fingerprinted file
+        self.fingerprinted: dict[str, str] = {}
+        self.encodings: dict[str, tuple[str, ...]] = {}
+
+    def url(self, path: str) -> str:
+        """The path of the fingerprinted file, for `url_for('static', path=...)` in the templates."""
+        name = path.lstrip('/')
+        return path[:len(path) - len(name)] + self.fingerprinted.get(name, name)
+
+    def build(self):
+        names = sorted(os.path.relpath(os.path.join(root, f), self.source_dir).replace(os.sep, '/')
+                       for root, _, files in os.walk(self.source_dir) for f in files)
+        for name in sorted(names, key=lambda n: n.endswith('.css')):
+            with open(os.path.join(self.source_dir, name), 'rb') as f:
+                data = f.read()
+            if name.endswith('.css'):
+                data = self._rewrite_urls(name, data.decode()).encode()
+            stem, ext = posixpath.splitext(name)
+            hashed = f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+            self.fingerprinted[name] = hashed
+            self.encodings[hashed] = self._write(hashed, data, ext in COMPRESSIBLE)
+
+    def _rewrite_urls(self, name: str, css: str) -> str:
+        directory = posixpath.dirname(name)
+
+        def replace(match: re.Match) -> str:
+            quote, ref, suffix = match.groups()
+            hashed = self.fingerprinted.get(posixpath.normpath(posixpath.join(directory, ref)))
+            if not hashed:
+                return match.group(0)
+            return f'url({quote}{posixpath.relpath(hashed, directory or ".")}{suffix}{quote})'
+
+        return CSS_URL.sub(replace, css)
+
+    def _write(self, hashed: str, data: bytes, compressible: bool) -> tuple[str, ...]:
+        path = os.path.join(self.build_dir, hashed)
+        variants = {path: lambda: data}
+        if compressible:
+            variants[path + ENCODINGS['gzip']] = lambda: gzip.compress(data, 9, mtime=0)
+            if brotli:
+                variants[path + ENCODINGS['br']] = lambda: brotli.compress(data, quality=11)
+        for variant, compress in variants.items():
+            if not os.path.exists(variant):
+                os.makedirs(os.path.dirname(variant), exist_ok=True)
+                # several worker processes may build at once, the file appears complete or not at all
+                tmp = f'{variant}.{os.getpid()}.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(compress())
+                os.replace(tmp, variant)
+        # a variant is worth sending only when it is smaller
+        return tuple(encoding for encoding, suffix in ENCODINGS.items()
+                     if os.path.exists(path + suffix) and os.path.getsize(path + suffix) < len(data))
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """The encodings of the Accept-Encoding header, apart from those refused by q=0."""
+    encodings = set()
+    for item in accept_encoding.split(','):
+        encoding, *params = [p.strip() for p in item.split(';')]
+        q = next((p[2:] for p in params if p.startswith('q=')), '1')
+        try:
+            if float(q) > 0:
+                encodings.add(encoding.lower())
+        except ValueError:
+            pass
+    return encodings
+
+
+class StaticAssetFiles(StaticFiles):
+    """Serves the fingerprinted static files as immutable, in the best precompressed variant the client accepts.
+
+    The files requested by their original names are served too, revalidated on every use.
+    """
+
+    def __init__(self, assets: StaticAssets):
+        # the build directory may not exist before the assets are built at startup
+        super().__init__(directory=assets.build_dir, check_dir=False)
+        self.assets = assets
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        name = path.replace(os.sep, '/')
+        if name in self.assets.fingerprinted:
+            name, cache_control = self.assets.fingerprinted[name], 'no-cache'
+        elif name in self.assets.encodings:
+            cache_control = IMMUTABLE
+        if scope["method"] not in ("GET", "HEAD") or name not in self.assets.encodings:
+            return await super().get_response(path, scope)
+
+        request_headers = Headers(scope=scope)
+        accepted = accepted_encodings(request_headers.get('accept-encoding', ''))
+        encoding = next((e for e in self.assets.encodings[name] if e in accepted), None)
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path,
+                                                                name + ENCODINGS.get(encoding, ''))
+        headers = {'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        response = FileResponse(full_path, stat_result=stat_result, headers=headers,
+                                media_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import time
+from typing import Any, Callable
+
+
+class Throttle:
+    """Runs an action at most once per `interval` seconds for each key, e.g. a notification per game.
+
+    The first call runs the action at once. The calls within the interval after it are coalesced into a single
+    run at its end, of the action of the last call, so the latest value is never lost. Calls may come from any
+    thread, the deferred runs happen on the event loop. Before `start` every call runs at once.
+    """
+
+    def __init__(self, interval: float, max_keys: int = 4096):
+        self.interval = interval
+        self.max_keys = max_keys
+        self._ran_at: dict[Any, float] = {}
+        self._deferred: dict[Any, Callable[[], None]] = {}
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        self._loop = None
+
+    def call(self, key: Any, action: Callable[[], None]):
+        now = time.monotonic()
+        with self._lock:
+            if key in self._deferred:
+                self._deferred[key] = action
+                return
+            ran_at = self._ran_at.get(key)
+            loop = self._loop
+            if loop is None or ran_at is None or now - ran_at >= self.interval:
+                self._ran_at[key] = now
+                if len(self._ran_at) > self.max_keys:
+                    self._ran_at = {k: t for k, t in self._ran_at.items() if now - t < self.interval}
+                deferred = False
+            else:
+                self._deferred[key] = action
+                deferred = True
+        if not deferred:
+            action()
+        else:
+            loop.call_soon_threadsafe(loop.call_later, ran_at + self.interval - now, self._run_deferred, key)
+
+    def _run_deferred(self, key: Any):
+        with self._lock:
+            action = self._deferred.pop(key, None)
+            self._ran_at[key] = time.monotonic()
+        if action:
+            action()
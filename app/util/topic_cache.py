@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Generic, TypeVar
+
+from app.util.event_bus import EventBus
+
+T = TypeVar('T')
+
+
+class _Entry(Generic[T]):
+    __slots__ = ('value', 'generation', 'valid', 'lock', '__weakref__')
+
+    def __init__(self):
+        self.value: T | None = None
+        self.generation = 0
+        self.valid = False
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        self.generation += 1
+        self.valid = False
+
+
+class TopicCache(Generic[T]):
+    """A bounded LRU cache of values computed from the state behind event bus topics, e.g. a room snapshot.
+
+    A value is shared by all its readers until the next notification of its topic, it must therefore be computed
+    only from state whose changes notify the topic. Readers of the same topic wait for one of them to compute the
+    value, a value computed while the topic was notified is returned but not kept.
+    """
+
+    def __init__(self, event_bus: EventBus, max_size: int = 256):
+        self.event_bus = event_bus
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Any, _Entry[T]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, topic: Any, compute: Callable[[], T]) -> T:
+        with self._lock:
+            entry = self._entries.get(topic)
+            if entry:
+                self._entries.move_to_end(topic)
+            else:
+                # subscribed before the value is computed, so that no change after it is missed
+                entry = self._entries[topic] = _Entry()
+                self.event_bus.subscribe(topic, entry.invalidate)
+                while len(self._entries) > self.max_size:
+                    evicted_topic, evicted = self._entries.popitem(last=False)
+                    self.event_bus.unsubscribe(evicted_topic, evicted.invalidate)
+        with entry.lock:
+            if entry.valid:
+                self.hits += 1
+                return entry.value
+            self.misses += 1
+            generation = entry.generation
+            value = compute()
+            if entry.generation == generation:
+                entry.value = value
+                entry.valid = True
+            return value
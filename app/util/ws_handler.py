@@ -1,80 +1,157 @@
 import asyncio
+import functools
 import json
+import threading
+import time
 import uuid
+from collections import Counter
+from typing import Any, Callable
 
+from starlette.concurrency import run_in_threadpool
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
-from app.dependencies import Controller, ControllerFactory
+from app.dependencies import Controller, ControllerFactory, get_query_stats
 from app.util import EventBus
+from app.util.metrics import REGISTRY, SIZE_BUCKETS
+
+# the open connections by handler and room, maintained on the event loop and read by the metrics scrape
+_connections: Counter[tuple[str, str]] = Counter()
+_connections_lock = threading.Lock()
+
+
+def _connection_counts() -> dict[tuple[str, str], float]:
+    with _connections_lock:
+        return dict(_connections)
+
+
+REGISTRY.gauge('gamedify_ws_connections', 'Open WebSocket connections.', ('handler', 'room'),
+               callback=_connection_counts)
+NOTIFY_TO_SEND_SECONDS = REGISTRY.histogram('gamedify_ws_notify_to_send_seconds',
+                                            'Time from an event bus notification until the resulting frame was sent.',
+                                            ('handler',))
+FRAME_BYTES = REGISTRY.histogram('gamedify_ws_frame_bytes', 'Size of the sent WebSocket frames.', ('handler',),
+                                 buckets=SIZE_BUCKETS)
 
 
 class WsHandler:
+    """Runs a WebSocket connection, the callbacks are called with a new controller each.
+
+    The callbacks are synchronous and run in the worker thread pool together with their database access,
+    so a slow query never blocks the event loop. They return the message to send to the client, if any, or a list
+    of messages sent as separate frames.
+    The callbacks of the notified topics run one at a time, so they may keep what the client shows.
+    """
+
     def __init__(self, websocket: WebSocket, ctrl_factory: ControllerFactory, event_bus: EventBus):
         self.websocket = websocket
         self.ctrl_factory = ctrl_factory
         self.event_bus = event_bus
         self.event = asyncio.Event()
+        # the callbacks of the topics notified since the last dispatch, in order; the first event renders the view
+        self._due: dict[Callable, None] = {self.on_event: None}
         self.event.set()
+        # the room of the connection, a label of its metrics; set at the latest by on_connect
+        self.room_code: str | None = None
 
-    async def on_connect(self, ctrl: Controller) -> uuid.UUID:
+    def on_connect(self, ctrl: Controller) -> uuid.UUID:
         pass
 
-    async def on_disconnect(self, ctrl: Controller):
+    def on_disconnect(self, ctrl: Controller):
         pass
 
-    async def on_error(self, ctrl: Controller, exc: Exception):
+    def on_error(self, ctrl: Controller, exc: Exception) -> str | None:
         pass
 
-    async def on_event(self, ctrl: Controller):
+    def on_event(self, ctrl: Controller) -> str | None:
         pass
 
-    async def on_receive(self, ctrl: Controller, msg):
+    def on_receive(self, ctrl: Controller, msg) -> str | None:
         pass
 
+    def topics(self) -> dict[Any, Callable[[Controller], str | None]]:
+        """Further topics of the connection, with the callbacks dispatched like on_event when they are notified."""
+        return {}
+
+    def _schedule(self, callback: Callable[[Controller], str | None]):
+        self._due[callback] = None
+        self.event.set()
+
     async def send(self, msg: str):
         await self.websocket.send_text(msg)
+        if REGISTRY.enabled:
+            FRAME_BYTES.labels(type(self).__name__).observe(len(msg.encode()))
+
+    def _call(self, callback: Callable[..., str | list[str] | None], *args) -> str | list[str] | None:
+        with get_query_stats().scope(self._scope_name(callback, *args)), self.ctrl_factory() as ctrl:
+            try:
+                return callback(ctrl, *args)
+            except Exception as exc:
+                return self.on_error(ctrl, exc)
+
+    def _scope_name(self, callback: Callable[..., str | None], *args) -> str:
+        name = f'{type(self).__name__}.{callback.__name__}'
+        if args and isinstance(args[0], dict) and 'action' in args[0]:
+            name += f":{args[0]['action']}"
+        return name
 
-    async def _dispatch_loop(self):
+    async def _dispatch(self, callback: Callable[..., str | list[str] | None], *args) -> bool:
+        msgs = await run_in_threadpool(self._call, callback, *args)
+        if isinstance(msgs, str):
+            msgs = [msgs]
+        msgs = [msg for msg in msgs or () if msg]
+        for msg in msgs:
+            await self.send(msg)
+        return bool(msgs)
+
+    async def _dispatch_loop(self, topic):
+        latency = NOTIFY_TO_SEND_SECONDS.labels(type(self).__name__)
         while True:
             await self.event.wait()
             self.event.clear()
-            with self.ctrl_factory() as ctrl:
-                try:
-                    await self.on_event(ctrl)
-                except Exception as exc:
-                    await self.on_error(ctrl, exc)
+            due, self._due = self._due, {}
+            for callback in due:
+                notified_at = self.event_bus.notified_at(topic) if callback == self.on_event else None
+                if await self._dispatch(callback) and notified_at:
+                    latency.observe(time.perf_counter() - notified_at)
 
     async def _receive_loop(self):
         while True:
             msg = await self.websocket.receive_text()
-            with self.ctrl_factory() as ctrl:
-                try:
-                    await self.on_receive(ctrl, json.loads(msg))
-                except Exception as exc:
-                    await self.on_error(ctrl, exc)
+            await self._dispatch(self.on_receive, json.loads(msg))
+
+    def _connect(self) -> uuid.UUID:
+        with get_query_stats().scope(self._scope_name(self.on_connect)), self.ctrl_factory() as ctrl:
+            return self.on_connect(ctrl)
 
     async def run(self):
-        with self.ctrl_factory() as ctrl:
-            try:
-                topic = await self.on_connect(ctrl)
-            except:
-                await self.websocket.close()
-                return
+        try:
+            topic = await run_in_threadpool(self._connect)
+        except:
+            await self.websocket.close()
+            return
 
         await self.websocket.accept()
-        self.event_bus.subscribe(topic, self.event.set)
-        task = asyncio.create_task(self._dispatch_loop())
+        # held here, the event bus holds the listeners weakly
+        listeners = {topic: functools.partial(self._schedule, self.on_event)}
+        listeners.update((t, functools.partial(self._schedule, callback)) for t, callback in self.topics().items())
+        for t, listener in listeners.items():
+            self.event_bus.subscribe(t, listener)
+        tasks = [asyncio.create_task(self._dispatch_loop(topic))]
+        connection = (type(self).__name__, self.room_code or '')
+        with _connections_lock:
+            _connections[connection] += 1
         try:
             await self._receive_loop()
         except WebSocketDisconnect:
             # consume the exception to avoid log noise
             pass
         finally:
-            task.cancel()
-            self.event_bus.unsubscribe(topic, self.event.set)
-
-            with self.ctrl_factory() as ctrl:
-                try:
-                    await self.on_disconnect(ctrl)
-                except Exception as exc:
-                    await self.on_error(ctrl, exc)
+            with _connections_lock:
+                _connections[connection] -= 1
+                if not _connections[connection]:
+                    del _connections[connection]
+            for task in tasks:
+                task.cancel()
+            for t, listener in listeners.items():
+                self.event_bus.unsubscribe(t, listener)
+            await self._dispatch(self.on_disconnect)
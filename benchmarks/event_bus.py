@@ -0,0 +1,89 @@
+"""Fan-out latency of event bus notifications through the event broker to N worker processes.
+
+Every worker subscribes to one topic and reports when its listener was called, the latency of a round is
+the time from `notify` in the publishing process until the last worker was notified.
+
+Run from the project root: python -m benchmarks.event_bus
+"""
+import asyncio
+import multiprocessing
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from app.util import BrokerBackend, EventBroker, EventBus
+
+WORKERS = (1, 2, 4, 8, 16)
+ROUNDS = 200
+TOPIC = 'BENCH'
+
+
+def run_broker(path: str):
+    asyncio.run(EventBroker(path).serve_forever())
+
+
+def run_worker(path: str, received: multiprocessing.Queue):
+    async def work():
+        bus = EventBus(BrokerBackend(path, reconnect_delay=0.01))
+        listener = lambda: received.put(time.monotonic_ns())
+        bus.subscribe(TOPIC, listener)
+        await bus.start()
+        await asyncio.Event().wait()
+
+    asyncio.run(work())
+
+
+async def bench_fan_out(path: str, workers: int) -> list[float]:
+    """Latencies of the notification rounds in microseconds, CLOCK_MONOTONIC is shared by all processes."""
+    received = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_worker, args=(path, received), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    bus = EventBus(BrokerBackend(path, reconnect_delay=0.01))
+    await bus.start()
+
+    async def notify_round(timeout: float | None) -> list[int]:
+        start = time.monotonic_ns()
+        bus.notify(TOPIC)
+        times = [await asyncio.to_thread(received.get, timeout=timeout) for _ in range(workers)]
+        return [t - start for t in times]
+
+    # warm up until all workers are connected and subscribed
+    while True:
+        await asyncio.sleep(0.1)
+        while not received.empty():
+            received.get()
+        try:
+            await notify_round(timeout=0.5)
+            break
+        except Exception:
+            continue
+
+    latencies = []
+    for _ in range(ROUNDS):
+        latencies.append(max(await notify_round(timeout=5)) / 1000)
+        await asyncio.sleep(0.001)
+
+    await bus.stop()
+    for process in processes:
+        process.terminate()
+    return latencies
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / 'events.sock')
+        broker = multiprocessing.Process(target=run_broker, args=(path,), daemon=True)
+        broker.start()
+        print(f"{'workers':>7} {'median [us]':>12} {'p99 [us]':>10} {'max [us]':>10}")
+        for workers in WORKERS:
+            latencies = sorted(asyncio.run(bench_fan_out(path, workers)))
+            p99 = latencies[int(len(latencies) * 0.99) - 1]
+            print(f"{workers:>7} {statistics.median(latencies):>12.0f} {p99:>10.0f} {latencies[-1]:>10.0f}")
+        broker.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+"""Load test of a running server through the real HTTP and WebSocket protocol of the players and room dashboards.
+
+Every room gets its players and a dashboard. Each simulated player opens /play/{room_code}, connects to
+/play/ws/{connection_id}, sets its name and then plays: it clicks a free tile when on turn, types an answer
+and submits it, and starts a new game when its game is over. The latency of an action is the time from sending
+it until the next frame arrives, for `type_answer` until the opponent receives the typed answer.
+
+Start the server first, e.g. `uvicorn app.main:app`, then from the project root:
+
+    python -m benchmarks.load --rooms 20 --players 10 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import statistics
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from websockets.asyncio.client import connect
+
+TILE = re.compile(r'class="tile state-(\w+)" ws-send hx-vals=\'{"action": "tile_click", "tile": (\d+) }\'')
+PLAYER_NAMES = re.compile(r'class="player-[ab][^"]*">\s*(\S+)\s*</div>')
+WS_CONNECT = re.compile(r'ws-connect="(/play/ws/[^"]+)"')
+CREATE_ROOM = re.compile(r'href="[^"]*(/quiz/[^"/]+/create_room)"')
+# an action without a frame after this many seconds is counted as an error, and the player goes on
+ACTION_TIMEOUT = 5
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.frames = 0
+        self.bytes = 0
+        self.dashboard_frames = 0
+        self.dashboard_bytes = 0
+        self.games_over = 0
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def report(self, duration: float, players: int, dashboards: int):
+        print(f'{players} players and {dashboards} dashboards for {duration:.0f} s')
+        print(f"{'action':>15} {'count':>8} {'per s':>8} {'p50 [ms]':>9} {'p99 [ms]':>9} {'max [ms]':>9}")
+        for action, values in sorted(self.latencies.items()) + [('all', sum(self.latencies.values(), []))]:
+            if not values:
+                continue
+            values = sorted(values)
+            p99 = values[max(0, int(len(values) * 0.99) - 1)]
+            print(f'{action:>15} {len(values):>8} {len(values) / duration:>8.1f} '
+                  f'{statistics.median(values) * 1000:>9.1f} {p99 * 1000:>9.1f} {values[-1] * 1000:>9.1f}')
+        print(f'player frames: {self.frames / duration:.1f}/s, {self.bytes / duration / 1024:.1f} KiB/s')
+        print(f'dashboard frames: {self.dashboard_frames / duration:.1f}/s, '
+              f'{self.dashboard_bytes / duration / 1024:.1f} KiB/s')
+        print(f'games over: {self.games_over}')
+        for error, count in sorted(self.errors.items()):
+            print(f'error {error}: {count}')
+
+
+async def http_request(base_url: str, method: str, path: str, cookies: dict[str, str] | None = None,
+                       form: str | None = None) -> tuple[int, dict[str, str], dict[str, str], str]:
+    """A minimal HTTP/1.1 client, returns the status, headers, cookies set and body."""
+    url = urlsplit(base_url)
+    reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+    headers = [f'{method} {path} HTTP/1.1', f'Host: {url.netloc}', 'Connection: close']
+    if cookies:
+        headers.append('Cookie: ' + '; '.join(f'{k}={v}' for k, v in cookies.items()))
+    body = (form or '').encode()
+    if form is not None:
+        headers += ['Content-Type: application/x-www-form-urlencoded', f'Content-Length: {len(body)}']
+    writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode() + body)
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b'\r\n\r\n')
+    status_line, *header_lines = head.decode().split('\r\n')
+    response_headers, set_cookies = {}, {}
+    for line in header_lines:
+        name, _, value = line.partition(':')
+        if name.lower() == 'set-cookie':
+            cookie_name, _, cookie_value = value.strip().split(';')[0].partition('=')
+            set_cookies[cookie_name] = cookie_value.strip('"')
+        response_headers[name.lower()] = value.strip()
+    if response_headers.get('transfer-encoding') == 'chunked':
+        content = dechunk(content)
+    return int(status_line.split()[1]), response_headers, set_cookies, content.decode()
+
+
+def dechunk(content: bytes) -> bytes:
+    chunks = []
+    while content:
+        size, _, content = content.partition(b'\r\n')
+        size = int(size, 16)
+        if not size:
+            break
+        chunks.append(content[:size])
+        content = content[size + 2:]
+    return b''.join(chunks)
+
+
+def ws_url(base_url: str, path: str) -> str:
+    return re.sub('^http', 'ws', base_url.rstrip('/')) + path
+
+
+class Player:
+    def __init__(self, name: str, room: 'Room', stats: Stats, think: float):
+        self.name = name
+        self.room = room
+        self.stats = stats
+        self.think = think
+        self.ws = None
+        self.tiles: dict[int, str] = {}
+        self.clickable = False
+        self.answering = False
+        self.can_restart = False
+        self.wants_name = False
+        self.opponent: Player | None = None
+        self.pending: tuple[str, float] | None = None  # the action waiting for its frame
+        self.typed_at: float | None = None  # when the first unanswered type_answer was sent to the opponent
+        self.changed = asyncio.Event()
+
+    async def run(self, base_url: str, stop: asyncio.Event):
+        status, _, _, body = await http_request(base_url, 'GET', f'/play/{self.room.code}')
+        match = WS_CONNECT.search(body)
+        if status != 200 or not match:
+            self.stats.errors[f'play page {status}'] += 1
+            return
+        async with connect(ws_url(base_url, match.group(1)), max_size=None) as self.ws:
+            reader = asyncio.create_task(self.read())
+            try:
+                await self.act(stop)
+            finally:
+                reader.cancel()
+
+    async def read(self):
+        async for frame in self.ws:
+            now = time.perf_counter()
+            self.stats.frames += 1
+            self.stats.bytes += len(frame)
+            if self.pending:
+                action, sent = self.pending
+                if now - sent < ACTION_TIMEOUT:
+                    self.stats.latencies[action].append(now - sent)
+                self.pending = None
+            self.update(frame, now)
+            self.changed.set()
+
+    def update(self, frame: str, now: float):
+        if '"action": "set_name"' in frame:
+            self.wants_name = True
+        if 'id="game-content"' in frame:
+            # a whole page, the game view is sent as a whole when it is shown for the first time
+            self.tiles.clear()
+            self.clickable = self.answering = self.can_restart = False
+            names = PLAYER_NAMES.findall(frame)
+            self.opponent = next((self.room.players[n] for n in names if n != self.name and n in self.room.players),
+                                 None)
+        for state, index in TILE.findall(frame):
+            self.tiles[int(index)] = state
+        if 'id="board-state"' in frame:
+            self.clickable = 'clickable' in frame.split('id="board-state"', 1)[1].split('>', 1)[0]
+        if 'id="turn-popup"' in frame:
+            self.answering = '"action": "submit_answer"' in frame
+        if 'id="popup-new-game"' in frame:
+            over = '"action": "start_new_game"' in frame
+            if over and not self.can_restart and 'Konec hry' in frame:
+                self.stats.games_over += 1
+            self.can_restart = over
+        if 'id="typed-answer"' in frame and self.opponent and self.opponent.typed_at:
+            self.stats.latencies['type_answer'].append(now - self.opponent.typed_at)
+            self.opponent.typed_at = None
+
+    async def send(self, action: str, **values):
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.think)
+        self.pending = (action, time.perf_counter())
+        await self.ws.send(json.dumps({'action': action, **values}))
+
+    async def act(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout=1)
+            except TimeoutError:
+                pass  # on to the timeout of the pending action
+            self.changed.clear()
+            if self.pending:
+                action, sent = self.pending
+                if time.perf_counter() - sent < ACTION_TIMEOUT:
+                    continue
+                self.stats.errors[f'no frame after {action}'] += 1
+                self.pending = None
+            if self.wants_name:
+                self.wants_name = False
+                await self.send('set_name', player_name=self.name)
+            elif self.can_restart:
+                self.can_restart = False
+                await self.send('start_new_game')
+            elif self.answering:
+                self.answering = False
+                answer = random.choice(['Praha', 'Brno', 'Ostrava'])
+                for i in range(1, len(answer) + 1):
+                    await asyncio.sleep(self.think / 5)
+                    self.typed_at = self.typed_at or time.perf_counter()
+                    await self.ws.send(json.dumps({'action': 'type_answer', 'answer': answer[:i]}))
+                await self.send('submit_answer', answer=answer)
+            elif self.clickable:
+                free = [i for i, state in self.tiles.items() if state == 'DEFAULT']
+                if free:
+                    self.clickable = False
+                    await self.send('tile_click', tile=random.choice(free))
+
+
+class Room:
+    def __init__(self, code: str):
+        self.code = code
+        self.players: dict[str, Player] = {}
+
+
+async def run_dashboard(base_url: str, room: Room, session: str, stats: Stats, stop: asyncio.Event):
+    async with connect(ws_url(base_url, f'/room/ws/{room.code}'), max_size=None,
+                       additional_headers={'Cookie': f'session_id={session}'}) as ws:
+        while not stop.is_set():
+            try:
+                frame = await asyncio.wait_for(ws.recv(), timeout=1)
+            except TimeoutError:
+                continue
+            stats.dashboard_frames += 1
+            stats.dashboard_bytes += len(frame)
+
+
+async def create_rooms(base_url: str, count: int, username: str, password: str) -> tuple[str, list[Room]]:
+    status, _, cookies, _ = await http_request(base_url, 'POST', '/login',
+                                               form=f'username={username}&password={password}')
+    if 'session_id' not in cookies:
+        raise SystemExit(f'Login failed ({status})')
+    session = cookies['session_id']
+    _, _, _, body = await http_request(base_url, 'GET', '/quiz/', {'session_id': session})
+    create_room = CREATE_ROOM.findall(body)
+    if not create_room:
+        raise SystemExit('No quiz to create the rooms for')
+    rooms = []
+    for _ in range(count):
+        status, headers, _, _ = await http_request(base_url, 'GET', create_room[0], {'session_id': session})
+        rooms.append(Room(headers['location'].rstrip('/').rsplit('/', 1)[1]))
+    return session, rooms
+
+
+async def close_rooms(base_url: str, session: str, rooms: list[Room]):
+    for room in rooms:
+        await http_request(base_url, 'GET', f'/room/{room.code}/close', {'session_id': session})
+
+
+async def main(args):
+    stats = Stats()
+    stop = asyncio.Event()
+    session, rooms = await create_rooms(args.url, args.rooms, args.username, args.password)
+    tasks = []
+    try:
+        for r, room in enumerate(rooms):
+            for d in range(args.dashboards):
+                tasks.append(asyncio.create_task(run_dashboard(args.url, room, session, stats, stop)))
+            for p in range(args.players):
+                player = Player(f'p{r}-{p}', room, stats, args.think)
+                room.players[player.name] = player
+                tasks.append(asyncio.create_task(player.run(args.url, stop)))
+                await asyncio.sleep(args.ramp / (args.rooms * args.players))
+        print(f'{len(rooms)} rooms started')
+        start = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        duration = time.perf_counter() - start
+        stop.set()
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                stats.errors[type(result).__name__] += 1
+        stats.report(duration, args.rooms * args.players, args.rooms * args.dashboards)
+    finally:
+        await close_rooms(args.url, session, rooms)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--players', type=int, default=10, help='players per room')
+    parser.add_argument('--dashboards', type=int, default=1, help='dashboards per room')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of measurement after the ramp-up')
+    parser.add_argument('--ramp', type=float, default=5, help='seconds to connect all players')
+    parser.add_argument('--think', type=float, default=0.5, help='average seconds before a player acts')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='heslo')
+    asyncio.run(main(parser.parse_args()))
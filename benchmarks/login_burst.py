@@ -0,0 +1,83 @@
+"""Latency of the game frames before, during and after a burst of logins, against a running server.
+
+Simulated players play in one room, see `benchmarks.load`, while the burst phase adds clients that log in
+over and over. Checking a password costs bcrypt hundreds of milliseconds of CPU, the game frames should
+stay fast regardless.
+
+Start the server first, e.g. `uvicorn app.main:app`, then from the project root:
+
+    python -m benchmarks.login_burst --players 10 --logins 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from collections import Counter
+
+from benchmarks.load import Player, Stats, close_rooms, create_rooms, http_request
+
+PHASES = ('before', 'burst', 'after')
+
+
+async def log_in_repeatedly(args, statuses: Counter, latencies: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        status, _, _, _ = await http_request(args.url, 'POST', '/login',
+                                             form=f'username={args.username}&password={args.password}')
+        latencies.append(time.perf_counter() - start)
+        statuses[status] += 1
+
+
+def summary(values: list[float]) -> str:
+    if not values:
+        return 'no samples'
+    values = sorted(values)
+    p99 = values[max(0, int(len(values) * 0.99) - 1)]
+    return (f'{len(values):>6} samples, p50 {statistics.median(values) * 1000:>7.1f} ms, '
+            f'p99 {p99 * 1000:>7.1f} ms, max {values[-1] * 1000:>7.1f} ms')
+
+
+async def main(args):
+    session, (room,) = await create_rooms(args.url, 1, args.username, args.password)
+    stop = asyncio.Event()
+    phase_stats = {phase: Stats() for phase in PHASES}
+    players = [Player(f'p{i}', room, phase_stats['before'], args.think) for i in range(args.players)]
+    room.players = {p.name: p for p in players}
+    tasks = [asyncio.create_task(p.run(args.url, stop)) for p in players]
+    try:
+        await asyncio.sleep(args.warmup)
+        statuses, login_latencies = Counter(), []
+        for phase in PHASES:
+            for player in players:
+                player.stats = phase_stats[phase]
+            burst_stop = asyncio.Event()
+            burst = [asyncio.create_task(log_in_repeatedly(args, statuses, login_latencies, burst_stop))
+                     for _ in range(args.logins if phase == 'burst' else 0)]
+            await asyncio.sleep(args.duration)
+            burst_stop.set()
+            await asyncio.gather(*burst)
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        print(f'{args.players} players, a burst of {args.logins} clients logging in for {args.duration:.0f} s')
+        for phase in PHASES:
+            latencies = [v for action, values in phase_stats[phase].latencies.items() if action != 'type_answer'
+                         for v in values]
+            print(f'game frames {phase:>6}: {summary(latencies)}')
+        print(f'logins: {summary(login_latencies)}')
+        print('login responses: ' + ', '.join(f'{status}: {count}' for status, count in sorted(statuses.items())))
+    finally:
+        await close_rooms(args.url, session, [room])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--logins', type=int, default=20, help='clients logging in concurrently during the burst')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of each phase')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds for the players to start their games')
+    parser.add_argument('--think', type=float, default=0.2, help='average seconds before a player acts')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='heslo')
+    asyncio.run(main(parser.parse_args()))
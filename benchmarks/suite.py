@@ -0,0 +1,237 @@
+"""Micro-benchmarks of the game core and the render hot paths, with results saved as JSON for comparison.
+
+Every benchmark sets up its fixture and returns the function to time. The function is timed by `timeit` in
+several rounds, the median and minimum time per call are reported and compared by the minimum.
+
+Run from the project root:
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --compare before.json
+    python -m benchmarks.suite -k render
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import timeit
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Callable
+
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.ctrl import ControllerImpl
+from app.dependencies import jinja_env
+from app.game_engine import GameEngine, GameState
+from app.model import Answer, Player, PlayerConnection, Question, Quiz, Room, User, normalize_answer
+from app.routers.play import game_context, get_template
+from app.util import EventBus, azk
+from benchmarks.winner import is_winner_move, random_placement
+
+ROWS = (7, 25, 100)
+ROUNDS = 7
+REGRESSION = 1.15  # a benchmark slower by this factor is reported as a regression
+
+Benchmark = Callable[[], Callable[[], object]]
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+def benchmark(name: str):
+    def register(setup: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def create_room(engine, questions: int, answers: int = 1) -> Room:
+    with Session(engine, expire_on_commit=False) as db:
+        admin = User(username="admin", hashed_password="")
+        quiz = Quiz(name="Benchmark", owner=admin)
+        for i in range(questions):
+            question = Question(text=f"Question {i}?", quiz=quiz)
+            for j in range(answers):
+                db.add(Answer(text=f"Answer {i} {j}", question=question))
+        room = Room(code="BNCH", quiz=quiz, owner=admin)
+        db.add(room)
+        db.commit()
+        return room
+
+
+def add_players(db: Session, room_code: str, count: int) -> list[PlayerConnection]:
+    pcs = [PlayerConnection(room_code=room_code, player=Player(name=f"Player {i}"), active_count=1)
+           for i in range(count)]
+    db.add_all(pcs)
+    db.commit()
+    return pcs
+
+
+def memory_engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+def create_games(rows: int, games: int = 1) -> tuple[GameEngine, list[GameState]]:
+    """Live games half played, on a board with the given number of rows."""
+    engine = memory_engine()
+    game_engine = GameEngine(engine)
+    room = create_room(engine, azk.triangular(rows))
+    rnd = random.Random(42)
+    states = []
+    with Session(engine) as db:
+        ctrl = ControllerImpl(db, EventBus(), game_engine)
+        for pc_a, pc_b in zip(*[iter(add_players(db, room.code, games * 2))] * 2):
+            ctrl.try_start_game(pc_a)
+            ctrl.try_start_game(pc_b)
+            game = game_engine.get(db, pc_b.game_id)
+            free = list(range(game.layout.tile_count))
+            rnd.shuffle(free)
+            for index in free[:len(free) // 2]:
+                if game.is_over:
+                    break
+                game.select_tile(game.player_on_turn.id, index)
+                game.submit_answer(game.player_on_turn.id, rnd.choice([game.tile_answers[index][0], 'wrong']))
+            states.append(game)
+    return game_engine, states
+
+
+for rows in ROWS:
+    @benchmark(f'winner.is_winner_move[rows={rows}]')
+    def rebuild_winner(rows=rows):
+        placement = random_placement(rows, random.Random(42))
+        game = SimpleNamespace(rows=rows, tiles=placement[:len(placement) // 2])
+        tile = game.tiles[-1]
+        return lambda: is_winner_move(game, tile)
+
+
+    @benchmark(f'azk.Connectivity.add[rows={rows}]')
+    def connectivity_add(rows=rows):
+        layout = azk.BoardLayout.of(rows)
+        ids = [layout.tile_id(t.row, t.col) for t in random_placement(rows, random.Random(42))[::2]]
+
+        def run():
+            connectivity = azk.Connectivity(layout)
+            for tile_id in ids:
+                connectivity.add(tile_id)
+
+        return run
+
+
+    @benchmark(f'azk.BoardLayout[rows={rows}]')
+    def board_layout(rows=rows):
+        # the uncached construction, BoardLayout.of computes it once per number of rows
+        return lambda: azk.BoardLayout(rows).view_box
+
+
+    @benchmark(f'GameState.get_tile_by_index[rows={rows}]')
+    def get_tile_by_index(rows=rows):
+        _, (game,) = create_games(rows)
+        indexes = range(game.layout.tile_count)
+        return lambda: [game.get_tile_by_index(i) for i in indexes]
+
+
+    @benchmark(f'render.play/game.html[rows={rows}]')
+    def render_game(rows=rows):
+        _, (game,) = create_games(rows)
+        template = get_template('play/game.html')
+        context = game_context(game.player_a, game)
+        return lambda: template.render(context)
+
+
+@benchmark('GameState.selected_tile')
+def selected_tile():
+    _, (game,) = create_games(7)
+    game.select_tile(game.player_on_turn.id, next(i for i, s in enumerate(game.tile_states) if not s))
+    return lambda: game.selected_tile
+
+
+for answers in (1, 100):
+    @benchmark(f'GameState.check_last_answer[answers={answers}]')
+    def check_last_answer(answers=answers):
+        _, (game,) = create_games(7)
+        game.last_question_normalized_answers = frozenset(normalize_answer(f'Odpověď {i}') for i in range(answers))
+        game.last_answer = f'ODPOVED {answers - 1}'
+        return game.check_last_answer
+
+
+for games in (1, 20):
+    @benchmark(f'render.room/dynamic_content.html[games={games}]')
+    def render_room(games=games):
+        game_engine, _ = create_games(7, games)
+        db = Session(game_engine.db_engine)
+        ctrl = ControllerImpl(db, EventBus(), game_engine)
+        add_players(db, 'BNCH', 3)
+        snapshot = ctrl.get_room_snapshot('BNCH')
+        context = {'games': snapshot.games, 'waiting': snapshot.waiting}
+        template = jinja_env.get_template('room/dynamic_content.html')
+        return lambda: template.render(context)
+
+
+@benchmark('ControllerImpl.try_start_game')
+def try_start_game():
+    engine = memory_engine()
+    room = create_room(engine, 28, answers=2)
+    game_engine = GameEngine(engine)
+
+    def run():
+        with Session(engine) as db:
+            pc_a, pc_b = add_players(db, room.code, 2)
+            ctrl = ControllerImpl(db, EventBus(), game_engine)
+            assert not ctrl.try_start_game(pc_a) and ctrl.try_start_game(pc_b)
+
+    return run
+
+
+def measure(fn: Callable[[], object]) -> dict:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat=ROUNDS, number=number)]
+    return {'median_us': statistics.median(times) * 1e6, 'min_us': min(times) * 1e6,
+            'rounds': ROUNDS, 'number': number}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-k', default='', help='run only the benchmarks whose name contains this')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='compare the results with a JSON file saved before')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    print(f"{'benchmark':<48} {'median [us]':>12} {'min [us]':>10}" + (f" {'change':>8}" if baseline else ''))
+    for name, setup in BENCHMARKS.items():
+        if args.k not in name:
+            continue
+        results[name] = result = measure(setup())
+        line = f"{name:<48} {result['median_us']:>12.2f} {result['min_us']:>10.2f}"
+        if base := baseline.get(name):
+            ratio = result['min_us'] / base['min_us']  # the minimum is less affected by noise
+            line += f" {ratio:>7.2f}x" + (' REGRESSION' if ratio > REGRESSION else '')
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'date': datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(), 'machine': platform.machine(),
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Per-move cost of the winner detection on growing boards.
+
+Run from the project root: python -m benchmarks.winner
+"""
+import random
+import time
+from types import SimpleNamespace
+from typing import NamedTuple
+
+from app.model import TileState
+from app.util import azk
+
+ROWS = (6, 12, 25, 50, 100, 200, 400)
+
+
+class BenchTile(NamedTuple):
+    row: int
+    col: int
+    state: TileState
+
+
+def random_placement(rows: int, rnd: random.Random) -> list[BenchTile]:
+    tiles = [(row, col) for row in range(rows) for col in range(row + 1)]
+    rnd.shuffle(tiles)
+    return [BenchTile(row, col, TileState.A if i % 2 else TileState.B) for i, (row, col) in enumerate(tiles)]
+
+
+def is_winner_move(game, start_tile) -> bool:
+    """The winner check without the state of a game, rebuilds the connectivity from all tiles of the game."""
+    layout = azk.BoardLayout.of(game.rows)
+    start_id = layout.tile_id(start_tile.row, start_tile.col)
+    connectivity = azk.Connectivity(layout)
+    for t in game.tiles:
+        if t.state == start_tile.state and layout.tile_id(t.row, t.col) != start_id:
+            connectivity.add(layout.tile_id(t.row, t.col))
+    return connectivity.add(start_id)
+
+
+def bench_incremental(placement: list[BenchTile], rows: int) -> float:
+    """Average time of a move when every colour keeps its own union-find."""
+    layout = azk.BoardLayout.of(rows)
+    connectivity = {TileState.A: azk.Connectivity(layout), TileState.B: azk.Connectivity(layout)}
+    tile_ids = [(tile.state, layout.tile_id(tile.row, tile.col)) for tile in placement]
+    start = time.perf_counter()
+    for state, tile_id in tile_ids:
+        connectivity[state].add(tile_id)
+    return (time.perf_counter() - start) / len(placement)
+
+
+def bench_rebuild(placement: list[BenchTile], rows: int, samples: int = 20) -> float:
+    """Average time of is_winner_move, which rebuilds the connectivity from all tiles of the game."""
+    game = SimpleNamespace(rows=rows, tiles=placement[:len(placement) // 2])
+    start = time.perf_counter()
+    for tile in game.tiles[-samples:]:
+        is_winner_move(game, tile)
+    return (time.perf_counter() - start) / samples
+
+
+def main():
+    rnd = random.Random(42)
+    print(f"{'rows':>5} {'tiles':>7} {'incremental [us/move]':>22} {'rebuild [us/move]':>18}")
+    for rows in ROWS:
+        placement = random_placement(rows, rnd)
+        incremental = bench_incremental(placement, rows)
+        rebuild = bench_rebuild(placement, rows)
+        print(f"{rows:>5} {len(placement):>7} {incremental * 1e6:>22.2f} {rebuild * 1e6:>18.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from app.util import azk
+
+
+def reference_is_winner(owned: set[tuple[int, int]], rows: int, start: tuple[int, int]) -> bool:
+    visited, stack = set(), [start]
+    while stack:
+        r, c = stack.pop()
+        if (r, c) not in owned or (r, c) in visited:
+            continue
+        visited.add((r, c))
+        stack.extend((r + dr, c + dc) for dr, dc in azk.DIRS)
+    return (any(col == 0 for _, col in visited) and any(col == row for row, col in visited)
+            and any(row == rows - 1 for row, _ in visited))
+
+
+@pytest.mark.parametrize("rows", [1, 2, 6, 10])
+def test_connectivity_matches_flood_fill(rows):
+    rnd = random.Random(rows)
+    for _ in range(20):
+        tiles = [(row, col) for row in range(rows) for col in range(row + 1)]
+        rnd.shuffle(tiles)
+        connectivity = azk.Connectivity(azk.BoardLayout.of(rows))
+        owned = set()
+        for tile in tiles[:rnd.randint(1, len(tiles))]:
+            owned.add(tile)
+            assert connectivity.add(azk.BoardLayout.tile_id(*tile)) == reference_is_winner(owned, rows, tile)
+
+
+def test_connectivity_large_board():
+    rows = 2000
+    layout = azk.BoardLayout.of(rows)
+    connectivity = azk.Connectivity(layout)
+    # the left edge without the top tile (which touches both side edges) and the bottom row
+    assert not any(connectivity.add(layout.tile_id(row, 0)) for row in range(1, rows))
+    assert not any(connectivity.add(layout.tile_id(rows - 1, col)) for col in range(1, rows - 1))
+    assert connectivity.add(layout.tile_id(rows - 1, rows - 1))
+
+
+def test_board_layout():
+    layout = azk.BoardLayout.of(3)
+    assert layout is azk.BoardLayout.of(3)
+    assert layout.tile_count == 6
+    assert [(layout.tile_rows[i], layout.tile_cols[i]) for i in range(6)] == [t[:2] for t in layout.tiles]
+    assert all(layout.tile_id(t.row, t.col) == t.id for t in layout.tiles)
+    assert layout.transforms[0] == "translate(0.0, 0.0)"
+    assert layout.edges[0] == azk.LEFT_EDGE | azk.RIGHT_EDGE
+    assert layout.edges[4] == azk.BOTTOM_EDGE
+    assert sorted(layout.neighbours[1]) == [0, 2, 3, 4]
@@ -0,0 +1,50 @@
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.ctrl import ControllerImpl
+from app.game_engine import GameEngine
+from app.model import Quiz, Room, User
+from app.util import CodeAllocator, EventBus
+
+
+def test_code_allocator():
+    allocator = CodeAllocator("AB", 3)
+    assert allocator.decode(allocator.encode(5)) == 5 and allocator.encode(5) == "BAB"
+    allocator.seed(["AAA", "1234", "ABC", "AAA"])
+    assert allocator.used == 1
+    codes = {allocator.allocate() for _ in range(7)}
+    assert len(codes) == 7 and "AAA" not in codes
+    assert allocator.allocate() is None and allocator.utilisation == 1
+    allocator.release("BAB")
+    allocator.release("BAB")
+    assert allocator.used == 7 and allocator.allocate() == "BAB"
+
+
+def test_create_room():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    # a code space of two codes, one already taken by another worker process
+    room_codes = CodeAllocator("34", 1)
+    with Session(engine) as db:
+        user = User(username="admin", hashed_password="")
+        quiz = Quiz(name="Quiz", owner=user)
+        db.add(Room(code="3", quiz=quiz, owner=user))
+        db.commit()
+        ctrl = ControllerImpl(db, EventBus(), GameEngine(engine), room_codes=room_codes)
+        room = ctrl.create_room(quiz, user)
+        assert room.code == "4"
+        assert ctrl.create_room(quiz, user) is None and room_codes.used == 2
+
+        # released by another worker process, found when the allocator runs out of codes
+        db.delete(db.get(Room, "3"))
+        db.commit()
+        assert ctrl.create_room(quiz, user).code == "3"
+        ctrl.room_delete(room)
+        assert room_codes.used == 1
+
+        # a controller without the allocator of the process takes the codes in use from the database
+        ctrl = ControllerImpl(db, EventBus(), GameEngine(engine))
+        room = ctrl.create_room(quiz, user)
+        assert len(room.code) == 4 and ctrl.room_codes.used == 1
+        ctrl.room_delete(room)
+        assert ctrl.room_codes.used == 0
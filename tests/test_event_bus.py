@@ -0,0 +1,152 @@
+import asyncio
+import gc
+import threading
+import uuid
+
+from app.util import BrokerBackend, EventBroker, EventBus, TopicCache, TopicStats
+
+
+async def wait_for(condition, timeout: float = 2.0):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+def test_bus_without_loop():
+    bus = EventBus()
+    received = []
+    listener = lambda: received.append('room')
+    bus.subscribe('room', listener)
+    bus.notify('room')
+    bus.notify('other')
+    assert received == ['room']
+    bus.unsubscribe('room', listener)
+    bus.notify('room')
+    assert received == ['room']
+
+
+def test_notifications_are_coalesced():
+    async def run():
+        bus = EventBus()
+        await bus.start()
+        received = []
+        listener = lambda: received.append(1)
+        bus.subscribe('room', listener)
+        bus.notify('room')
+        bus.notify('room')
+        thread = threading.Thread(target=bus.notify, args=('room',))
+        thread.start()
+        thread.join()
+        assert received == []  # delivered in the next iteration of the event loop
+        assert bus.stats()['room'] == TopicStats(subscribers=1, queued=3, running=0, notified=0, delivered=0)
+        await asyncio.sleep(0)
+        assert received == [1]
+        assert bus.stats()['room'] == TopicStats(subscribers=1, queued=0, running=0, notified=3, delivered=1)
+        await bus.stop()
+
+    asyncio.run(run())
+
+
+def test_async_listener():
+    async def run():
+        bus = EventBus()
+        await bus.start()
+        done = asyncio.Event()
+
+        async def listener():
+            await done.wait()
+
+        bus.subscribe('room', listener)
+        bus.notify('room')
+        await asyncio.sleep(0)
+        assert bus.stats()['room'].running == 1
+        done.set()
+        await wait_for(lambda: bus.stats()['room'].running == 0)
+        await bus.stop()
+
+    asyncio.run(run())
+
+
+def test_collected_listener_is_unsubscribed():
+    class Handler:
+        def __init__(self):
+            self.received = 0
+
+        def on_event(self):
+            self.received += 1
+
+    bus = EventBus()
+    handler = Handler()
+    bus.subscribe('room', handler.on_event)
+    bus.notify('room')
+    assert handler.received == 1
+    del handler
+    gc.collect()
+    assert bus.stats() == {}
+
+
+def test_topic_cache():
+    bus = EventBus()
+    cache = TopicCache(bus, max_size=2)
+    computed = []
+
+    def compute(value):
+        computed.append(value)
+        return value
+
+    assert cache.get('room', lambda: compute(1)) == 1
+    assert cache.get('room', lambda: compute(2)) == 1
+    bus.notify('room')
+    assert cache.get('room', lambda: compute(3)) == 3
+
+    # a value computed while the topic is notified may be stale already, it is not kept
+    def notified_meanwhile():
+        bus.notify('room')
+        return compute(4)
+
+    bus.notify('room')
+    assert cache.get('room', notified_meanwhile) == 4
+    assert cache.get('room', lambda: compute(5)) == 5
+    assert computed == [1, 3, 4, 5] and cache.hits == 1
+
+    cache.get('other', lambda: 'other')
+    cache.get('third', lambda: 'third')
+    assert len(cache) == 2 and 'room' not in bus.stats()
+
+
+def test_broker_backend(tmp_path):
+    async def run():
+        path = str(tmp_path / 'events.sock')
+        broker = EventBroker(path)
+        await broker.start()
+        buses = [EventBus(BrokerBackend(path, reconnect_delay=0.01)) for _ in range(3)]
+        for bus in buses:
+            await bus.start()
+        await wait_for(lambda: all(bus.backend.connected for bus in buses))
+
+        player_id = uuid.uuid4()
+        received = {i: [] for i in range(len(buses))}
+        listeners = [lambda i=i: received[i].append(player_id) for i in range(len(buses))]
+        for i, bus in enumerate(buses[1:], 1):
+            bus.subscribe(player_id, listeners[i])
+        room_listener = lambda: received[2].append('ABCD')
+        buses[2].subscribe('ABCD', room_listener)
+        await asyncio.sleep(0.05)  # let the subscriptions reach the broker
+
+        # notifications of one iteration are sent as one batch, every process is notified once per topic
+        buses[0].notify(player_id)
+        buses[0].notify(player_id)
+        buses[0].notify('ABCD')
+        await wait_for(lambda: received[1] and len(received[2]) == 2)
+        buses[1].notify(player_id)  # delivered locally and to the other subscriber, not twice to itself
+        await wait_for(lambda: len(received[2]) == 3)
+        await asyncio.sleep(0.05)
+        assert received[0] == []
+        assert received[1] == [player_id, player_id]
+        assert set(received[2][:2]) == {player_id, 'ABCD'} and received[2][2] == player_id
+
+        for bus in buses:
+            await bus.stop()
+        await broker.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,36 @@
+import threading
+
+from app.util import MatchQueue
+
+
+def test_match_queue():
+    now = [0.0]
+    queue = MatchQueue(clock=lambda: now[0])
+    assert queue.join("A", 1) is None and queue.join("A", 1) is None and queue.join("B", 2) is None
+    assert len(queue) == 2 and queue.depth("A") == 1
+    now[0] = 5
+    assert queue.join("A", 3) == (1, 5) and queue.depth("A") == 0
+    queue.requeue("A", 1, 5)
+    assert queue.join("A", 3) == (1, 5)
+    assert queue.leave("B", 2) and not queue.leave("B", 2) and len(queue) == 0
+    queue.join("C", 4)
+    queue.remove("C")
+    assert queue.join("C", 5) is None
+
+
+def test_match_queue_pairs_once():
+    queue = MatchQueue()
+    barrier = threading.Barrier(8)
+    partners = []
+
+    def join(item):
+        barrier.wait()
+        if pair := queue.join("A", item):
+            partners.extend((item, pair[0]))
+
+    threads = [threading.Thread(target=join, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(partners) == 8 and len(set(partners)) == 8 and len(queue) == 0
@@ -0,0 +1,32 @@
+from app.util.metrics import Registry
+
+
+def test_exposition():
+    registry = Registry()
+    counter = registry.counter('games_total', 'Games.', ('result',))
+    histogram = registry.histogram('render_seconds', 'Render time.', buckets=(0.1, 1))
+    registry.gauge('topics', 'Topics.', callback=lambda: {(): 3})
+    counter.labels('started').inc()
+    assert 'games_total{result="started"} 0' in registry.exposition()  # disabled
+
+    registry.enabled = True
+    counter.labels('started').inc()
+    counter.labels('wait"ing').inc(2)
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+    assert registry.exposition().splitlines() == [
+        '# HELP games_total Games.',
+        '# TYPE games_total counter',
+        'games_total{result="started"} 1',
+        'games_total{result="wait\\"ing"} 2',
+        '# HELP render_seconds Render time.',
+        '# TYPE render_seconds histogram',
+        'render_seconds_bucket{le="0.1"} 1',
+        'render_seconds_bucket{le="1"} 2',
+        'render_seconds_bucket{le="+Inf"} 3',
+        'render_seconds_sum 5.55',
+        'render_seconds_count 3',
+        '# HELP topics Topics.',
+        '# TYPE topics gauge',
+        'topics 3',
+    ]
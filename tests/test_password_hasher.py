@@ -0,0 +1,26 @@
+import asyncio
+
+import bcrypt
+from app.util import PasswordHasher, PasswordHasherBusy
+
+
+def test_password_hasher():
+    async def run():
+        hasher = PasswordHasher(workers=1, max_pending=2, rounds=4)
+        hashed = await hasher.hash('heslo')
+        assert bcrypt.checkpw(b'heslo', hashed.encode())
+        assert await hasher.check('heslo', hashed)
+        assert not await hasher.check('jine', hashed)
+
+        # more checks than the queue holds are refused at once, the others complete
+        checks = [asyncio.ensure_future(hasher.check('heslo', hashed)) for _ in range(3)]
+        results = await asyncio.gather(*checks, return_exceptions=True)
+        assert results[:2] == [True, True] and isinstance(results[2], PasswordHasherBusy)
+        assert hasher.pending == 0 and hasher.rejected == 1
+        hasher.shutdown()
+
+        # restarted by the next application lifespan in the same process
+        assert await hasher.check('heslo', hashed)
+        hasher.shutdown()
+
+    asyncio.run(run())
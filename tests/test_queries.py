@@ -0,0 +1,572 @@
+"""The views load everything they render by a fixed number of queries, independent of the board and room size.
+
+The frames of the player view are kept within a byte budget too."""
+import asyncio
+import contextlib
+import re
+import threading
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app.ctrl import ControllerImpl, session_topic
+from app.dependencies import DbFactory, enable_foreign_keys, get_qr_cache
+from app.game_engine import GameEngine
+from app.main import app
+from app.model import Answer, Game, Player, PlayerConnection, Question, Quiz, Room, User, UserSession
+from app.routers.play import PlayerWsHandler
+from app.routers.room import RoomWsHandler
+from app.util import EventBus, QueryStats, RenderCache, SessionCache, TopicCache
+
+
+@pytest.fixture
+def db_engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    event.listen(engine, "connect", enable_foreign_keys)
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+@contextlib.contextmanager
+def count_queries(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def create_quiz(db: Session, owner: User, questions: int) -> Quiz:
+    quiz = Quiz(name=f"Quiz {questions}", owner=owner)
+    for i in range(questions):
+        question = Question(text=f"Question {i}", quiz=quiz)
+        db.add(Answer(text=f"Answer {i}", question=question))
+    db.add(quiz)
+    return quiz
+
+
+def create_room(db_engine, questions: int, games: int) -> tuple[GameEngine, list[PlayerConnection]]:
+    """A room with the given number of running games."""
+    game_engine = GameEngine(db_engine)
+    with Session(db_engine, expire_on_commit=False) as db:
+        admin = User(username="admin", hashed_password="")
+        room = Room(code="ABCD", quiz=create_quiz(db, admin, questions), owner=admin)
+        db.add(room)
+        db.commit()
+        ctrl = ControllerImpl(db, EventBus(), game_engine)
+        pcs = []
+        for i in range(games * 2):
+            pc = PlayerConnection(room_code=room.code, player=Player(name=f"Player {i}"), active_count=1)
+            db.add(pc)
+            db.commit()
+            pcs.append(pc)
+            assert ctrl.try_start_game(pc) == bool(i % 2)
+        return game_engine, pcs
+
+
+@pytest.mark.parametrize("questions", [10, 36])
+def test_player_view_queries(db_engine, questions):
+    game_engine, pcs = create_room(db_engine, questions, games=1)
+    handler = PlayerWsHandler(None, None, EventBus(), RenderCache(), game_engine, pcs[0].id)
+    handler.player_id = pcs[0].player_id
+    with Session(db_engine) as db, count_queries(db_engine) as statements:
+        ctrl = ControllerImpl(db, EventBus(), game_engine)
+        assert 'id="game-content"' in handler.on_event(ctrl)
+        ctrl.tile_click(ctrl.get_player_connection(pcs[0].id), 0)
+        assert 'tile-0' in handler.on_event(ctrl)
+    # the player connection for both events and for the click
+    assert len(statements) <= 3, statements
+
+
+def test_game_snapshot(db_engine):
+    game_engine, pcs = create_room(db_engine, 10, games=1)
+    with Session(db_engine) as db:
+        snapshot = game_engine.snapshot(pcs[0].game_id, db)
+        ctrl = ControllerImpl(db, EventBus(), game_engine)
+        ctrl.tile_click(ctrl.get_player_connection(pcs[0].id), 0)
+        ctrl.set_player_connection_active(pcs[1].id, False)
+    # the moves change the live state only, a view rendered from the snapshot matches its version
+    game = game_engine.peek(pcs[0].game_id)
+    assert game.version == snapshot.version + 1 and game.selected_index == 0
+    assert snapshot.selected_tile is None and snapshot.tile_states == bytes(len(snapshot.tile_states))
+    assert snapshot.player_b.active_count == 1 and game.player_b.active_count == 0
+
+
+def test_shared_games(db_engine):
+    _, pcs = create_room(db_engine, 10, games=1)
+    game_id, player_a, player_b = pcs[0].game_id, pcs[0].player_id, pcs[1].player_id
+    # the engines of two worker processes, and one that misses their notifications
+    event_bus = EventBus()
+    engines = [GameEngine(db_engine, event_bus=event_bus) for _ in range(2)]
+    lagging = GameEngine(db_engine, event_bus=EventBus())
+    with Session(db_engine) as db:
+        for engine in (*engines, lagging):
+            engine.get(db, game_id)
+
+        # a move is written through and the other process checks its copy by one query
+        with engines[0].modify(db, game_id) as game:
+            assert game.select_tile(player_a, 0)
+        assert db.exec(select(Game.version).where(Game.id == game_id)).one() == game.version
+        with count_queries(db_engine) as statements:
+            engines[0].get(db, game_id)
+        assert len(statements) == 1, statements
+        assert engines[1].snapshot(game_id, db).selected_index == 0
+        with count_queries(db_engine) as statements:
+            engines[1].get(db, game_id)
+        assert not statements
+
+        # the connections of the players are counted again
+        db.get(PlayerConnection, pcs[1].id).active_count = 0
+        db.commit()
+        engines[0].set_player_active(game_id, player_b, 0)
+        assert engines[1].snapshot(game_id, db).player_b.active_count == 0
+
+        # a move applied to a copy changed by another process meanwhile is dropped
+        with lagging.modify(db, game_id) as game:
+            assert game.select_tile(player_a, 1)
+        assert lagging.snapshot(game_id, db).selected_index == 0
+        assert engines[1].snapshot(game_id, db).selected_index == 0
+
+
+def test_shared_game_writes(tmp_path):
+    db_engine = create_engine(f"sqlite:///{tmp_path / 'gamedify.db'}", connect_args={"check_same_thread": False})
+    event.listen(db_engine, "connect", enable_foreign_keys)
+    SQLModel.metadata.create_all(db_engine)
+    _, pcs = create_room(db_engine, 10, games=2)
+    game_engine = GameEngine(db_engine, event_bus=EventBus())
+    with Session(db_engine) as db:
+        game_ids = [game_engine.get(db, pc.game_id).id for pc in pcs[::2]]
+
+    # the write-through of a move in the first game waits until released
+    writing, released = threading.Event(), threading.Event()
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if statement.startswith("UPDATE game ") and not writing.is_set():
+            writing.set()
+            released.wait(10)
+
+    def move(game_id, player_id):
+        with game_engine.modify(None, game_id) as game:
+            assert game.select_tile(player_id, 0)
+
+    event.listen(db_engine, "before_cursor_execute", before_cursor_execute)
+    writer = threading.Thread(target=move, args=(game_ids[0], pcs[0].player_id))
+    writer.start()
+    assert writing.wait(10)
+    # the other game is neither held up in a move nor in a view
+    other = threading.Thread(target=move, args=(game_ids[1], pcs[2].player_id))
+    other.start()
+    other.join(5)
+    assert not other.is_alive() and game_engine.snapshot(game_ids[1]).selected_index == 0
+    released.set()
+    writer.join()
+    assert game_engine.snapshot(game_ids[0]).selected_index == 0
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self):
+        await asyncio.Event().wait()
+
+    async def send_text(self, msg: str):
+        self.sent.append(msg)
+
+
+def test_typed_answer_frames(db_engine):
+    game_engine, pcs = create_room(db_engine, 10, games=1)
+    event_bus = EventBus()
+
+    @contextlib.contextmanager
+    def ctrl_factory():
+        with Session(db_engine) as db:
+            yield ControllerImpl(db, event_bus, game_engine)
+
+    async def run():
+        await event_bus.start()
+        await game_engine.typing.start()
+        websocket = FakeWebSocket()
+        handler = PlayerWsHandler(websocket, ctrl_factory, event_bus, RenderCache(), game_engine, pcs[1].id)
+        task = asyncio.create_task(handler.run())
+        while not websocket.sent:
+            await asyncio.sleep(0.01)
+
+        def opponent_types():
+            with ctrl_factory() as ctrl:
+                ctrl.tile_click(ctrl.get_player_connection(pcs[0].id), 0)
+                for answer in ("P", "Pr", "Pra"):
+                    ctrl.type_answer(pcs[0].game_id, pcs[0].player_id, answer)
+
+        # the new popup and the typed answers are dispatched one at a time, the latest answer is the last one sent
+        await asyncio.to_thread(opponent_types)
+        await asyncio.sleep(0.5)
+        typed = [re.search(r'<strong>(.*)</strong>', m) for m in websocket.sent if 'id="typed-answer"' in m]
+        assert typed[-1] and typed[-1].group(1) == "Pra"
+        assert len(websocket.sent) <= 4
+        task.cancel()
+        await game_engine.typing.stop()
+        await event_bus.stop()
+
+    asyncio.run(run())
+
+
+def test_player_view_frame_size(db_engine):
+    game_engine, pcs = create_room(db_engine, 36, games=1)
+    handler = PlayerWsHandler(None, None, EventBus(), RenderCache(), game_engine, pcs[0].id)
+    handler.player_id = pcs[0].player_id
+    with Session(db_engine) as db:
+        ctrl = ControllerImpl(db, EventBus(), game_engine)
+        first = handler.on_event(ctrl)
+        assert game_engine.peek(pcs[0].game_id).layout.tile_count == 36
+        ctrl.tile_click(ctrl.get_player_connection(pcs[0].id), 0)
+        delta = handler.on_event(ctrl)
+    # the style and the defs of the board are loaded with the page, the frames carry the tiles and popups only
+    assert '<style' not in first and '<defs' not in first
+    assert len(first.encode()) < 12_000
+    assert len(delta.encode()) < 1_200
+
+
+@pytest.mark.parametrize("games", [1, 5])
+def test_room_dashboard_queries(db_engine, games):
+    game_engine, pcs = create_room(db_engine, 10, games=games)
+    with Session(db_engine) as db:
+        db.add(PlayerConnection(room_code="ABCD", player=Player(name="Waiting"), active_count=1))
+        db.commit()
+    event_bus = EventBus()
+    room_snapshots = TopicCache(event_bus)
+    handlers = [RoomWsHandler(None, None, event_bus, room_snapshots, "ABCD") for _ in range(2)]
+    with Session(db_engine) as db, count_queries(db_engine) as statements:
+        msg = handlers[0].on_event(ControllerImpl(db, event_bus, game_engine))
+    assert msg.count('card-container') == games and 'Waiting' in msg
+    # the active connections of the room, the games are in memory
+    assert len(statements) <= 1, statements
+    # another dashboard of the room shares the snapshot
+    with Session(db_engine) as db, count_queries(db_engine) as statements:
+        assert handlers[1].on_event(ControllerImpl(db, event_bus, game_engine)) == msg
+    assert not statements
+
+
+def test_room_dashboard_changes(db_engine):
+    game_engine, pcs = create_room(db_engine, 10, games=3)
+    event_bus = EventBus()
+    handler = RoomWsHandler(None, None, event_bus, TopicCache(event_bus), "ABCD")
+    with Session(db_engine) as db:
+        ctrl = ControllerImpl(db, event_bus, game_engine)
+        assert handler.on_event(ctrl).count('card-container') == 3
+        assert handler.on_event(ctrl) is None
+
+        # an answer changes the score and the player on turn
+        pc = ctrl.get_player_connection(pcs[2].id)
+        ctrl.tile_click(pc, 0)
+        assert handler.on_event(ctrl) is None
+        ctrl.submit_answer(pc, "wrong")
+        msg, = handler.on_event(ctrl)
+        assert msg.count('card-container') == 1 and f'id="game-{pc.game_id}"' in msg and "0 : 1" in msg
+
+        # renaming a player sends the card of the player's game only
+        pc = ctrl.get_player_connection(pcs[0].id)
+        ctrl.set_player_name(pc.room, pc.player, "Renamed")
+        msg, = handler.on_event(ctrl)
+        game_id = pc.game_id
+        assert msg.count('card-container') == 1 and f'id="game-{game_id}"' in msg and "Renamed" in msg
+
+        # the first waiting player shows the waiting section, the next ones are appended to it
+        waiting = []
+        for name in ("Waiting 1", "Waiting 2"):
+            waiting.append(PlayerConnection(room_code="ABCD", player=Player(name=name), active_count=1))
+            db.add(waiting[-1])
+            db.commit()
+            event_bus.notify("ABCD")  # as when the player connects
+            msg, = handler.on_event(ctrl)
+            assert name in msg and 'card-container' not in msg
+        assert 'id="room-waiting"' not in msg and 'beforeend:#room-waiting-list' in msg
+
+        # a new game adds its card and empties the waiting section
+        assert not ctrl.try_start_game(waiting[0]) and ctrl.try_start_game(waiting[1])
+        msg, = handler.on_event(ctrl)
+        assert msg.count('card-container') == 1 and 'beforeend:#room-games-list' in msg
+        assert re.search(r'<section id="room-waiting">\s*</section>', msg)
+
+        # the first player leaving a game waits for a new opponent
+        ctrl.start_new_game(ctrl.get_player_connection(pcs[0].id))
+        msg, = handler.on_event(ctrl)
+        assert "Renamed" in msg and 'id="room-waiting"' in msg
+
+        # the second one is paired with the first one, the card of their old game is removed
+        ctrl.start_new_game(ctrl.get_player_connection(pcs[1].id))
+        msg, = handler.on_event(ctrl)
+        assert f'<div id="game-{game_id}" hx-swap-oob="delete"></div>' in msg
+        assert msg.count('card-container') == 1 and "Renamed" in msg
+        assert re.search(r'<section id="room-waiting">\s*</section>', msg)
+
+
+# the insertion mode a template switches to by its first element, and the top-level elements each mode keeps
+TEMPLATE_MODES = {'caption': 'table', 'colgroup': 'table', 'tbody': 'table', 'thead': 'table', 'tfoot': 'table',
+                  'col': 'column group', 'tr': 'table body', 'td': 'row', 'th': 'row'}
+TEMPLATE_CHILDREN = {'table': {'caption', 'colgroup', 'tbody', 'thead', 'tfoot'}, 'column group': {'col'},
+                     'table body': {'tr'}, 'row': {'td', 'th'}}
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+
+class TemplateParse(HTMLParser):
+    """The top-level elements of a frame, with the ids inside them, as htmx parses the frame in a template.
+
+    The first element sets the insertion mode of the template. The later top-level elements the mode does not
+    take are dropped or wrapped by the HTML parser, they are left out as htmx would not swap them.
+    """
+
+    def __init__(self, frame: str):
+        super().__init__()
+        self.mode = None
+        self.depth = 0
+        self.kept = False
+        self.elements: list[tuple[dict, list[str]]] = []
+        self.feed(frame)
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if not self.depth:
+            self.mode = self.mode or TEMPLATE_MODES.get(tag, 'body')
+            children = TEMPLATE_CHILDREN.get(self.mode)
+            self.kept = tag in children if children else tag not in TEMPLATE_MODES
+            if self.kept:
+                self.elements.append((attrs, []))
+        if self.kept and 'id' in attrs:
+            self.elements[-1][1].append(attrs['id'])
+        if tag not in VOID_ELEMENTS:
+            self.depth += 1
+
+    def handle_endtag(self, tag):
+        if tag not in VOID_ELEMENTS:
+            self.depth -= 1
+
+
+def swapped_ids(frames: list[str]) -> dict[str, str]:
+    """The ids of the elements the frames swap in or delete, by the hx-swap-oob of their top-level element."""
+    return {element_id: attrs.get('hx-swap-oob', 'true')
+            for frame in frames for attrs, ids in TemplateParse(frame).elements for element_id in ids}
+
+
+def test_room_dashboard_frames(db_engine):
+    game_engine, pcs = create_room(db_engine, 10, games=2)
+    event_bus = EventBus()
+    handler = RoomWsHandler(None, None, event_bus, TopicCache(event_bus), "ABCD")
+    with Session(db_engine) as db:
+        ctrl = ControllerImpl(db, event_bus, game_engine)
+        handler.on_event(ctrl)
+        waiting = [PlayerConnection(room_code="ABCD", player=Player(name=f"Waiting {i}"), active_count=1)
+                   for i in range(2)]
+        db.add_all(waiting)
+        db.commit()
+        event_bus.notify("ABCD")
+        assert f'waiting-{waiting[0].player_id}' in swapped_ids(handler.on_event(ctrl))
+
+        # in one dispatch a game card is removed and one of its players added to the waiting list
+        game_id = pcs[0].game_id
+        ctrl.start_new_game(ctrl.get_player_connection(pcs[0].id))
+        ctrl.set_player_connection_active(pcs[1].id, False)
+        swapped = swapped_ids(handler.on_event(ctrl))
+        assert swapped[f'game-{game_id}'] == 'delete'
+        assert swapped[f'waiting-{pcs[0].player_id}'] == 'beforeend:#room-waiting-list'
+
+        # the paired players are removed from the waiting list, which is replaced
+        assert ctrl.try_start_game(waiting[0])
+        swapped = swapped_ids(handler.on_event(ctrl))
+        assert swapped['room-waiting-list'] == 'true' and f'waiting-{waiting[1].player_id}' in swapped
+        assert f'waiting-{waiting[0].player_id}' not in swapped and f'waiting-{pcs[0].player_id}' not in swapped
+
+    # the rows after a card in a single frame are dropped by the parser
+    assert not swapped_ids([f'<div id="game-{game_id}" hx-swap-oob="delete"></div>'
+                            '<tbody hx-swap-oob="beforeend:#room-waiting-list"><tr id="waiting-1"></tr></tbody>'
+                            ]).keys() - {f'game-{game_id}'}
+
+
+def test_matchmaking(db_engine):
+    game_engine, _ = create_room(db_engine, 10, games=0)
+    with Session(db_engine, expire_on_commit=False) as db:
+        ctrl = ControllerImpl(db, EventBus(), game_engine)
+        pcs = [PlayerConnection(room_code="ABCD", player=Player(name=f"Player {i}")) for i in range(3)]
+        db.add_all(pcs)
+        db.commit()
+
+        # the players are paired when they connect, in the order they came
+        ctrl.set_player_connection_active(pcs[0].id, True)
+        ctrl.set_player_connection_active(pcs[1].id, False)
+        assert game_engine.matchmaking.depth("ABCD") == 1
+        pcs[0] = ctrl.set_player_connection_active(pcs[0].id, True)
+        assert game_engine.matchmaking.depth("ABCD") == 1 and not pcs[0].game_id
+        pcs[1] = ctrl.set_player_connection_active(pcs[1].id, True)
+        assert pcs[1].game_id and pcs[0].game_id == pcs[1].game_id
+        assert game_engine.matchmaking.depth("ABCD") == 0
+
+        # a player leaves the queue when the last connection closes or the name is rejected
+        for _ in range(2):
+            ctrl.set_player_connection_active(pcs[2].id, True)
+        pcs[2] = ctrl.set_player_connection_active(pcs[2].id, False)
+        assert game_engine.matchmaking.depth("ABCD") == 1
+        ctrl.set_player_connection_active(pcs[2].id, False)
+        assert game_engine.matchmaking.depth("ABCD") == 0
+        ctrl.set_player_connection_active(pcs[2].id, True)
+        ctrl.set_player_name(pcs[2].room, pcs[2].player, None)
+        assert game_engine.matchmaking.depth("ABCD") == 0
+
+        ctrl.set_player_name(pcs[2].room, pcs[2].player, "Player 2")
+        assert game_engine.matchmaking.depth("ABCD") == 1
+
+        # the player view of the waiting player only renders
+        handler = PlayerWsHandler(None, None, EventBus(), RenderCache(), game_engine, pcs[2].id)
+        with count_queries(db_engine) as statements:
+            assert "Player 2" in handler.on_event(ctrl)
+        assert all(s.lstrip().upper().startswith("SELECT") for s in statements), statements
+
+
+def test_concurrent_joins(tmp_path):
+    # a file database, so that every request has a connection and a transaction of its own
+    db_engine = create_engine(f"sqlite:///{tmp_path / 'gamedify.db'}", connect_args={"check_same_thread": False})
+    event.listen(db_engine, "connect", enable_foreign_keys)
+    SQLModel.metadata.create_all(db_engine)
+    game_engine, _ = create_room(db_engine, 10, games=0)
+    with Session(db_engine) as db:
+        pcs = [PlayerConnection(room_code="ABCD", player=Player(name=f"Player {i}"), active_count=1) for i in range(3)]
+        db.add_all(pcs)
+        db.commit()
+        ids = [pc.id for pc in pcs]
+        # two opponents waiting, as the queue may hold when their pairings raced
+        assert not ControllerImpl(db, EventBus(), game_engine).try_start_game(pcs[1])
+        game_engine.matchmaking.requeue("ABCD", pcs[2].player_id, 0)
+
+    # two connections of the same player join at once, both loaded the player without a game
+    barrier = threading.Barrier(2)
+    started = []
+
+    def join():
+        with Session(db_engine) as db:
+            pc = db.get(PlayerConnection, ids[0])
+            barrier.wait()
+            started.append(ControllerImpl(db, EventBus(), game_engine).try_start_game(pc))
+
+    threads = [threading.Thread(target=join) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(started) == [False, True]
+    with Session(db_engine) as db:
+        assert len(db.exec(select(Game)).all()) == 1
+        assert len([pc for pc in db.exec(select(PlayerConnection)).all() if pc.game_id]) == 2
+    assert game_engine.matchmaking.depth("ABCD") == 1
+
+
+@pytest.mark.parametrize("quizzes, questions", [(1, 10), (5, 36)])
+def test_quiz_views_queries(db_engine, quizzes, questions):
+    with Session(db_engine) as db:
+        user = User(username="admin", hashed_password="")
+        quiz_ids = [create_quiz(db, user, questions).id for _ in range(quizzes)]
+        session = UserSession(user=user, expires_at=datetime.now() + timedelta(days=1))
+        db.add(session)
+        db.commit()
+        session_id = str(session.id)
+
+    app.dependency_overrides[DbFactory] = lambda: lambda: Session(db_engine)
+    try:
+        client = TestClient(app, base_url="https://testserver", cookies={"session_id": session_id})
+        with count_queries(db_engine) as statements:
+            assert client.get("/quiz/").status_code == 200
+        # the user session, the quizzes with their owners, questions and rooms
+        assert len(statements) <= 4, statements
+        with count_queries(db_engine) as statements:
+            assert client.get(f"/quiz/{quiz_ids[0]}").status_code == 200
+        # the user session, the quiz with its owner and questions, and the answers of the first question
+        assert len(statements) <= 4, statements
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_query_stats(db_engine):
+    game_engine, pcs = create_room(db_engine, 10, games=1)
+    query_stats = QueryStats(log=False)
+    assert query_stats.scope('disabled').__enter__() is None
+    query_stats.attach(db_engine)
+    for _ in range(2):
+        with query_stats.scope('RoomWsHandler.on_event'), Session(db_engine) as db:
+            event_bus = EventBus()
+            handler = RoomWsHandler(None, None, event_bus, TopicCache(event_bus), "ABCD")
+            handler.on_event(ControllerImpl(db, event_bus, game_engine))
+    with Session(db_engine) as db:
+        ControllerImpl(db, EventBus(), game_engine).get_player_connection(pcs[0].id)
+
+    summary = query_stats.summary()
+    assert summary.keys() == {'RoomWsHandler.on_event', 'other'}
+    stats = summary['RoomWsHandler.on_event']
+    assert stats.calls == 2 and stats.queries == 2 and stats.max_queries == 1
+    assert len(stats.slowest) == 2 and stats.slowest[0][0] >= stats.slowest[-1][0]
+    assert summary['other'].queries == 1
+
+
+def test_session_cache(db_engine):
+    game_engine = GameEngine(db_engine)
+    with Session(db_engine) as db:
+        quiz = create_quiz(db, User(username="admin", hashed_password=""), 10)
+        session = UserSession(user=quiz.owner, expires_at=datetime.now() + timedelta(days=1))
+        db.add(session)
+        db.commit()
+        session_id, quiz_id = session.id, quiz.id
+
+    # two worker processes sharing the database, the event bus stands for the broker between them
+    event_bus = EventBus()
+    caches = [SessionCache(event_bus, session_topic) for _ in range(2)]
+    for cache in caches:
+        with Session(db_engine) as db:
+            assert ControllerImpl(db, event_bus, game_engine, cache).get_user_for_session(session_id)
+    with Session(db_engine) as db, count_queries(db_engine) as statements:
+        user = ControllerImpl(db, event_bus, game_engine, caches[0]).get_user_for_session(session_id)
+        assert user.username == "admin"
+        assert db.get(Quiz, quiz_id).owner is user
+    assert len(statements) == 1, statements  # the quiz only
+
+    with Session(db_engine) as db:
+        ControllerImpl(db, event_bus, game_engine, caches[1]).logout(session_id)
+    assert len(caches[0]) == len(caches[1]) == 0
+    with Session(db_engine) as db:
+        assert ControllerImpl(db, event_bus, game_engine, caches[0]).get_user_for_session(session_id) is None
+
+
+def test_room_qr(db_engine):
+    with Session(db_engine) as db:
+        session = UserSession(user=User(username="admin", hashed_password=""),
+                              expires_at=datetime.now() + timedelta(days=1))
+        db.add(session)
+        db.commit()
+        session_id = str(session.id)
+
+    qr_cache = RenderCache()
+    app.dependency_overrides[DbFactory] = lambda: lambda: Session(db_engine)
+    app.dependency_overrides[get_qr_cache] = lambda: qr_cache
+    try:
+        client = TestClient(app, base_url="https://testserver", cookies={"session_id": session_id})
+        response = client.get("/room/abcd/qr.svg")
+        assert response.status_code == 200 and response.text.startswith('<svg')
+        assert response.headers['content-type'] == 'image/svg+xml'
+        assert client.get("/room/ABCD/qr.svg").text == response.text
+        assert qr_cache.misses == 1 and qr_cache.hits == 1
+        with count_queries(db_engine) as statements:
+            revalidated = client.get("/room/ABCD/qr.svg", headers={'If-None-Match': response.headers['etag']})
+        assert revalidated.status_code == 304 and not revalidated.content
+        assert qr_cache.hits == 1
+        assert len(statements) <= 1, statements  # the user session
+    finally:
+        app.dependency_overrides.clear()
@@ -0,0 +1,41 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.util import StaticAssetFiles, StaticAssets
+
+
+def test_static_assets(tmp_path):
+    (tmp_path / "static" / "fonts").mkdir(parents=True)
+    (tmp_path / "static" / "styles").mkdir()
+    (tmp_path / "static" / "fonts" / "icons.woff").write_bytes(b"font")
+    (tmp_path / "static" / "styles" / "main.css").write_text(
+        "@font-face{src:url('../fonts/icons.woff?v=1') format('woff'), url(../fonts/missing.eot)}" + " " * 1000)
+    assets = StaticAssets(str(tmp_path / "static"), str(tmp_path / "build"))
+    assets.build()
+    font = assets.fingerprinted["fonts/icons.woff"]
+    css = assets.url("/styles/main.css")
+    assert font.startswith("fonts/icons.") and css.startswith("/styles/main.") and css.endswith(".css")
+    assert assets.encodings[font] == () and "gzip" in assets.encodings[css[1:]]
+
+    app = FastAPI()
+    app.mount("/static", StaticAssetFiles(assets), name="static")
+    client = TestClient(app)
+    response = client.get(f"/static{css}", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert f"url('../{font}?v=1')" in response.text and "url(../fonts/missing.eot)" in response.text
+    assert int(response.headers["content-length"]) < len(response.content)  # decompressed by the client
+
+    response = client.get(f"/static{css}", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in response.headers and response.headers["vary"] == "Accept-Encoding"
+    # the original name still works, revalidated by the ETag
+    response = client.get("/static/styles/main.css", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["cache-control"] == "no-cache"
+    assert client.get("/static/styles/main.css", headers={"Accept-Encoding": "gzip",
+                                                          "If-None-Match": response.headers["etag"]}).status_code == 304
+    assert client.get("/static/styles/missing.css").status_code == 404
+
+    # building again finds everything built
+    rebuilt = StaticAssets(str(tmp_path / "static"), str(tmp_path / "build"))
+    rebuilt.build()
+    assert rebuilt.fingerprinted == assets.fingerprinted
@@ -0,0 +1,36 @@
+import asyncio
+import threading
+
+from app.util import Throttle
+
+
+def test_throttle_without_loop():
+    throttle = Throttle(10)
+    calls = []
+    for i in range(3):
+        throttle.call('game', lambda i=i: calls.append(i))
+    assert calls == [0, 1, 2]
+
+
+def test_throttle():
+    async def run():
+        throttle = Throttle(0.05)
+        await throttle.start()
+        calls = []
+        throttle.call('game', lambda: calls.append(('game', 1)))
+        throttle.call('other', lambda: calls.append(('other', 1)))
+        assert calls == [('game', 1), ('other', 1)]
+        # the calls within the interval are coalesced into the last one, at the end of the interval
+        throttle.call('game', lambda: calls.append(('game', 2)))
+        thread = threading.Thread(target=throttle.call, args=('game', lambda: calls.append(('game', 3))))
+        thread.start()
+        thread.join()
+        assert len(calls) == 2
+        await asyncio.sleep(0.1)
+        assert calls[2:] == [('game', 3)]
+        await asyncio.sleep(0.1)
+        throttle.call('game', lambda: calls.append(('game', 4)))
+        assert calls[3:] == [('game', 4)]
+        await throttle.stop()
+
+    asyncio.run(run())